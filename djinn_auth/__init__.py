@@ -1,3 +1,10 @@
+import django
+
+
+if django.VERSION < (3, 2):
+    default_app_config = "djinn_auth.apps.DjinnAuthConfig"
+
+
 def get_urls():
 
     return []
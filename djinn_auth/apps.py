@@ -0,0 +1,136 @@
+from django.apps import AppConfig
+from django.core.signals import setting_changed
+from django.db.models.signals import m2m_changed, post_save, post_delete, \
+    pre_delete, post_migrate
+
+
+class DjinnAuthConfig(AppConfig):
+
+    name = "djinn_auth"
+
+    def ready(self):
+
+        from django.contrib.auth import get_user_model
+        from django.contrib.auth.models import Group as AuthGroup
+        from django.contrib.auth.models import Permission
+        from djinn_auth import ctcache, groupclosure, instrument, \
+            materialize, sharedcache
+        from djinn_auth.cache import invalidate_on_change
+        from djinn_auth.models import Role, LocalRole, GlobalRole, \
+            LocalPermission, Group as DjinnGroup
+        from djinn_auth.permindex import invalidate_on_change as \
+            invalidate_index_on_change
+        from djinn_auth.signals import permission_checked, roles_changed
+        from djinn_auth.utils import get_group_model
+
+        user_model = get_user_model()
+
+        # Group membership and direct permissions
+        #
+        for m2m in [user_model.groups, user_model.user_permissions,
+                    AuthGroup.permissions, DjinnGroup.permissions,
+                    Role.permissions]:
+            m2m_changed.connect(invalidate_on_change, sender=m2m.through)
+
+        m2m_changed.connect(invalidate_on_change,
+                            sender=DjinnGroup.users.through)
+
+        group_model = get_group_model()
+
+        if group_model not in [AuthGroup, DjinnGroup] and \
+           hasattr(group_model, "users"):
+            m2m_changed.connect(invalidate_on_change,
+                                sender=group_model.users.through)
+
+        for model in [LocalRole, GlobalRole, LocalPermission]:
+            post_save.connect(invalidate_on_change, sender=model)
+            post_delete.connect(invalidate_on_change, sender=model)
+
+        roles_changed.connect(invalidate_on_change)
+
+        # Models and content type ids
+        #
+        setting_changed.connect(ctcache.invalidate_on_setting_changed)
+        post_migrate.connect(ctcache.invalidate_on_migrate)
+
+        # Role to permission index, and roles by name. Permissions are
+        # created in bulk after migrations, without post_save.
+        #
+        m2m_changed.connect(invalidate_index_on_change,
+                            sender=Role.permissions.through)
+
+        for model in [Role, Permission]:
+            post_save.connect(invalidate_index_on_change, sender=model)
+            post_delete.connect(invalidate_index_on_change, sender=model)
+
+        post_migrate.connect(invalidate_index_on_change)
+
+        # Materialised effective permissions. These come last, so the
+        # index is up to date.
+        #
+        for m2m in [user_model.groups, user_model.user_permissions,
+                    AuthGroup.permissions, DjinnGroup.permissions,
+                    Role.permissions, DjinnGroup.users]:
+            m2m_changed.connect(materialize.m2m_changed, sender=m2m.through)
+
+        for model in [LocalRole, GlobalRole, LocalPermission]:
+            post_save.connect(materialize.assignment_changed, sender=model)
+            post_delete.connect(materialize.assignment_changed, sender=model)
+
+        roles_changed.connect(materialize.roles_changed)
+
+        # Deleting a group removes its memberships without m2m_changed.
+        # The members of djinn_auth groups are handled with the closure.
+        #
+        if not issubclass(group_model, DjinnGroup):
+            pre_delete.connect(materialize.group_pre_delete,
+                               sender=group_model)
+            post_delete.connect(materialize.group_deleted,
+                                sender=group_model)
+
+        # Generations of the shared cache
+        #
+        for m2m in [user_model.groups, DjinnGroup.users]:
+            m2m_changed.connect(sharedcache.membership_changed,
+                                sender=m2m.through)
+
+        for model in [LocalRole, LocalPermission]:
+            post_save.connect(sharedcache.local_assignment_changed,
+                              sender=model)
+            post_delete.connect(sharedcache.local_assignment_changed,
+                                sender=model)
+
+        post_save.connect(sharedcache.global_assignment_changed,
+                          sender=GlobalRole)
+        post_delete.connect(sharedcache.global_assignment_changed,
+                            sender=GlobalRole)
+
+        roles_changed.connect(sharedcache.roles_changed)
+
+        # Deleting a group removes its memberships without m2m_changed.
+        # The members of djinn_auth groups are handled with the closure.
+        #
+        if not issubclass(group_model, DjinnGroup):
+            pre_delete.connect(sharedcache.group_pre_delete,
+                               sender=group_model)
+            post_delete.connect(sharedcache.group_deleted,
+                                sender=group_model)
+
+        # Closure of nested groups. Subclasses of Group send the model
+        # signals with themselves as sender, so connect every kind.
+        #
+        for model in self.apps.get_models():
+            if issubclass(model, DjinnGroup):
+                post_save.connect(groupclosure.group_saved, sender=model)
+                pre_delete.connect(groupclosure.group_pre_delete,
+                                   sender=model)
+                post_delete.connect(groupclosure.group_deleted,
+                                    sender=model)
+
+        m2m_changed.connect(groupclosure.subgroups_changed,
+                            sender=DjinnGroup.subgroups.through)
+
+        # Instrumentation. The signal is only sent when enabled.
+        #
+        permission_checked.connect(instrument.collector)
+        permission_checked.connect(instrument.record_request_check)
@@ -1,6 +1,20 @@
 import logging
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import Permission
-from djinn_auth.utils import get_user_global_roles, get_user_local_roles
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Exists, Q
+from djinn_auth import checkstats, ctcache, instrument
+from djinn_auth.cache import get_permission_cache, verdict_key, object_key
+from djinn_auth.models import GlobalRole, LocalRole, LocalPermission, \
+    EffectivePermission
+from djinn_auth.utils import get_user_group_ids, get_user_global_role_ids, \
+    get_user_local_grants, get_user_local_grants_many, \
+    get_user_assignee_filter, grants_perm, iter_acquire_levels, \
+    get_acquire_chain, get_user_direct_permission_ids, get_instances_filter, \
+    get_user_permission_masks, grants_mask, get_group_permission_model, \
+    get_user_group_subquery, has_group_permission
+from djinn_auth.permindex import permission_index
 
 
 LOGGER = logging.getLogger("djinn_auth")
@@ -13,6 +27,26 @@ class AuthBackend(object):
     supports_object_permissions = True
     supports_anonymous_user = False
 
+    # Available permission check engines, selectable through the
+    # DJINN_AUTH_ENGINE setting.
+    #
+    engines = {
+        'queryset': '_check_all_permissions',
+        'sql': '_check_sql_permissions',
+        'materialized': '_check_materialized_permissions',
+        'bitset': '_check_bitset_permissions',
+    }
+
+    # Checks of the queryset engine per source
+    #
+    sources = {
+        instrument.USER_SET: '_check_user_set',
+        instrument.GROUP_SET: '_check_group_set',
+        instrument.GLOBAL_ROLE: '_check_global_role',
+        instrument.LOCAL_ROLE: '_check_local_role',
+        instrument.ACQUIRED: '_check_acquired',
+    }
+
     def authenticate(self, username=None, password=None):
 
         return None
@@ -36,17 +70,201 @@ class AuthBackend(object):
         if:
           3. the user has a local role on the object
           4. the user is part of a group that has a local role on the object
+          5. the user, or one of the user's groups, has the permission
+             locally on the object
 
         Some heuristics are in place to try and determine this in a
         smart way. We first check on the 'user' role. If this holds
         the permission, return. If not, check ownership...
 
+        The verdict is cached on the user, so repeated checks within
+        the same request are free. If all permissions of the user on
+        the object were already resolved by get_all_permissions, these
+        are used.
+
+        """
+
+        if user.is_anonymous:
+            return False
+
+        check = self.get_check()
+        key = verdict_key(permission, obj)
+
+        if key is None:
+            return check(user, permission, obj=obj)
+
+        cache = get_permission_cache(user)
+
+        if key not in cache.verdicts:
+
+            all_permission_ids = cache.all_permission_ids.get(key[1:])
+
+            if all_permission_ids is not None:
+                cache.verdicts[key] = bool(
+                    permission_index.get_permission_ids(permission) &
+                    all_permission_ids)
+            else:
+                cache.verdicts[key] = check(user, permission, obj=obj)
+
+        return cache.verdicts[key]
+
+    async def ahas_perm(self, user, permission, obj=None):
+
+        """Async variant of has_perm, for ASGI views. Verdicts that are
+        already cached on the user are returned right away; otherwise the
+        check runs in the thread that Django uses for database access,
+        like Django's own async ORM does.
+
         """
 
         if user.is_anonymous:
             return False
 
-        return self._check_all_permissions(user, permission, obj=obj)
+        key = verdict_key(permission, obj)
+
+        if key is not None:
+            cache = get_permission_cache(user)
+
+            if key in cache.verdicts:
+                return cache.verdicts[key]
+
+        return await sync_to_async(self.has_perm)(user, permission, obj=obj)
+
+    def get_all_permissions(self, user, obj=None):
+
+        """Return the set of permissions, as 'app_label.codename'
+        strings, the user has globally, or on the object if given. This
+        takes into account the same sources as has_perm, in a fixed
+        number of queries: direct permissions, global roles, and a
+        single query for local roles and permissions on the object and
+        all objects it acquires from. The
+        result is cached on the user, so subsequent calls to has_perm or
+        has_perms for the same object are free.
+
+        """
+
+        if user.is_anonymous:
+            return set()
+
+        return permission_index.get_labels(
+            self._get_all_permission_ids(user, obj))
+
+    def get_group_permissions(self, user, obj=None):
+
+        """ Return the set of permissions the user has through the
+        user's groups, globally or on the object if given. """
+
+        if user.is_anonymous:
+            return set()
+
+        group_ids = get_user_group_ids(user)
+
+        if not group_ids:
+            return set()
+
+        assignee = Q(assignee_ct_id=ctcache.get_group_ct_id(),
+                     assignee_id__in=group_ids)
+
+        perm_ids = set(get_group_permission_model().objects.filter(
+            group_id__in=group_ids).values_list('permission_id', flat=True))
+
+        role_ids = set()
+
+        if not obj or getattr(obj, "acquire_global_roles", True):
+            role_ids.update(GlobalRole.objects.filter(
+                assignee).values_list('role_id', flat=True))
+
+        if obj:
+            instances = get_instances_filter([obj] + get_acquire_chain(obj))
+
+            role_ids.update(LocalRole.objects.filter(
+                assignee, instances).values_list('role_id', flat=True))
+            perm_ids.update(LocalPermission.objects.filter(
+                assignee, instances).values_list('permission_id', flat=True))
+
+        for role_id in role_ids:
+            perm_ids.update(permission_index.get_role_permission_ids(role_id))
+
+        return permission_index.get_labels(perm_ids)
+
+    def _get_all_permission_ids(self, user, obj=None):
+
+        """ Return the ids of all permissions the user has, globally or on
+        the given object, caching them on the user """
+
+        key = object_key(obj)
+        cache = get_permission_cache(user)
+
+        if key in cache.all_permission_ids:
+            return cache.all_permission_ids[key]
+
+        perm_ids = set(get_user_direct_permission_ids(user))
+        role_ids = set()
+
+        if not obj or getattr(obj, "acquire_global_roles", True):
+            role_ids.update(get_user_global_role_ids(user))
+
+        if obj and obj.pk is not None:
+            instances = [obj]
+
+            for level in iter_acquire_levels([obj]):
+                instances.extend(level)
+
+            for local_role_ids, local_perm_ids in get_user_local_grants_many(
+                    user, instances).values():
+                role_ids.update(local_role_ids)
+                perm_ids.update(local_perm_ids)
+
+        for role_id in role_ids:
+            perm_ids.update(permission_index.get_role_permission_ids(role_id))
+
+        perm_ids = frozenset(perm_ids)
+
+        if key is not None:
+            cache.all_permission_ids[key] = perm_ids
+
+        return perm_ids
+
+    def get_check(self):
+
+        """ Return the check method for the configured engine """
+
+        engine = getattr(settings, 'DJINN_AUTH_ENGINE', 'queryset')
+
+        if engine == 'materialized' and not getattr(
+                settings, 'DJINN_AUTH_MATERIALIZE', False):
+            raise ImproperlyConfigured(
+                "The materialized engine requires DJINN_AUTH_MATERIALIZE")
+
+        try:
+            check = getattr(self, self.engines[engine])
+        except KeyError:
+            raise ImproperlyConfigured(
+                "DJINN_AUTH_ENGINE must be one of %s" %
+                ", ".join(sorted(self.engines)))
+
+        if instrument.is_enabled():
+            return instrument.instrument(type(self),
+                                         self.get_source(engine, check))
+
+        return check
+
+    def get_source(self, engine, check):
+
+        """Return a function that finds the deciding source of a check with
+        the given engine. Only the queryset engine knows which source
+        decided; the others report their name.
+
+        """
+
+        if engine == 'queryset':
+            return self._find_source
+
+        def find_source(user, perm, obj=None):
+
+            return engine if check(user, perm, obj=obj) else None
+
+        return find_source
 
     def _check_all_permissions(self, user, perm, obj=None):
 
@@ -56,52 +274,178 @@ class AuthBackend(object):
         permission.
         """
 
-        # print("djinn_auth.authbackend.AuthBackend._check_all_permissions...")
+        return self._find_source(user, perm, obj=obj) is not None
+
+    def _find_source(self, user, perm, obj=None):
 
-        perm_app, perm_name = perm.split(".")
+        """ Do the checks of _check_all_permissions, and return the source
+        that granted the permission, or None. The sources are tried in
+        their default order, or with DJINN_AUTH_ADAPTIVE_ORDER, in the
+        order of how often they granted the permission. """
 
-        _perm = Permission.objects.get(codename=perm_name)
+        perm_ids, perm_role_ids = permission_index.lookup(perm)
 
-        # Check whether the user is in the permission's user set
+        # Unknown permissions are not granted to anyone
         #
-        _filter = {user.USERNAME_FIELD: user.get_username()}
+        if not perm_ids:
+            return None
 
-        if _perm.user_set.filter(**_filter).exists():
-            return True
+        adaptive = checkstats.is_enabled()
 
-        user_group_ids = user.groups.all().values_list('id', flat=True)
+        if adaptive:
+            sources = checkstats.check_stats.get_order(perm)
+        else:
+            sources = checkstats.SOURCES
 
-        # Check whether the user and the permission share any groups
-        #
-        if _perm.group_set.filter(pk__in=user_group_ids):
-            return True
+        for source in sources:
+            if getattr(self, self.sources[source])(user, perm_ids,
+                                                   perm_role_ids, obj):
+                if adaptive:
+                    checkstats.check_stats.record(perm, source)
 
-        # Now check on the roles. Start with global roles
-        #
-        perm_role_ids = _perm.role_set.all().values_list('id', flat=True)
+                return source
+
+        return None
+
+    def _check_user_set(self, user, perm_ids, perm_role_ids, obj):
+
+        """ Check whether the user is in the permission's user set """
+
+        return user.user_permissions.filter(pk__in=perm_ids).exists()
+
+    def _check_group_set(self, user, perm_ids, perm_role_ids, obj):
+
+        """ Check whether the user and the permission share any groups """
+
+        return has_group_permission(get_user_group_ids(user), perm_ids)
+
+    def _check_global_role(self, user, perm_ids, perm_role_ids, obj):
+
+        """ Check the global roles, unless the object doesn't acquire
+        them """
+
+        if perm_role_ids and (
+                not obj or getattr(obj, "acquire_global_roles", True)):
+            return bool(perm_role_ids & get_user_global_role_ids(user))
+
+        return False
+
+    def _check_local_role(self, user, perm_ids, perm_role_ids, obj):
+
+        """ Check local roles and local permissions on the object. Both
+        are fetched in one go. """
+
+        return bool(obj) and grants_perm(get_user_local_grants(user, obj),
+                                         perm_ids, perm_role_ids)
+
+    def _check_acquired(self, user, perm_ids, perm_role_ids, obj):
+
+        """Check the objects the object acquires from, so as to be able to
+        'inherit' roles from another object, or objects. These may in
+        turn acquire from others. Fetch a level at a time.
+
+        """
+
+        for level in iter_acquire_levels([obj] if obj else []):
+            for grants in get_user_local_grants_many(user, level).values():
+                if grants_perm(grants, perm_ids, perm_role_ids):
+                    return True
+
+        return False
+
+    def _check_sql_permissions(self, user, perm, obj=None):
+
+        """ Check all the same sources as _check_all_permissions, but
+        compile the whole check into one query, with an EXISTS subquery
+        per source. This costs a single database round trip, whatever
+        the outcome.
+        """
+
+        perm_ids, perm_role_ids = permission_index.lookup(perm)
+
+        if not perm_ids:
+            return False
+
+        condition = Q(Exists(user.user_permissions.filter(pk__in=perm_ids)))
+        condition |= Q(Exists(get_group_permission_model().objects.filter(
+            group_id__in=get_user_group_subquery(user),
+            permission_id__in=perm_ids)))
+
+        assignee = get_user_assignee_filter(user)
+
+        if perm_role_ids and (
+                not obj or getattr(obj, "acquire_global_roles", True)):
+            condition |= Q(Exists(GlobalRole.objects.filter(
+                assignee, role__in=perm_role_ids)))
+
+        instances = get_instances_filter(
+            [obj] + get_acquire_chain(obj) if obj else [])
+
+        if instances:
+            if perm_role_ids:
+                condition |= Q(Exists(LocalRole.objects.filter(
+                    assignee, instances, role__in=perm_role_ids)))
+
+            condition |= Q(Exists(LocalPermission.objects.filter(
+                assignee, instances, permission__in=perm_ids)))
+
+        return Permission.objects.filter(pk__in=perm_ids).filter(
+            condition).exists()
+
+    def _check_materialized_permissions(self, user, perm, obj=None):
+
+        """ Look up the permission in the materialised effective
+        permissions, see djinn_auth.materialize. This is a single index
+        lookup. """
+
+        perm_ids = permission_index.get_permission_ids(perm)
+
+        if not perm_ids:
+            return False
 
         if not obj or getattr(obj, "acquire_global_roles", True):
+            instances = Q(instance_ct__isnull=True)
+        else:
+            instances = Q(instance_ct__isnull=True, global_role=False)
 
-            if get_user_global_roles(user).filter(
-                    role__id__in=perm_role_ids).exists():
-                return True
+        instances |= get_instances_filter(
+            [obj] + get_acquire_chain(obj) if obj else [])
 
-        # Now go for local roles if need be
-        #
-        if obj:
+        return EffectivePermission.objects.filter(
+            instances, user=user, permission__in=perm_ids).exists()
 
-            if get_user_local_roles(user, obj).filter(
-                    role__id__in=perm_role_ids
-            ).exists():
-                return True
+    def _check_bitset_permissions(self, user, perm, obj=None):
 
-        # Finally, we may have an acquire list, so as to be able to
-        # 'inherit' roles from another object, or objects.
-        #
-        for acq_obj in getattr(obj, "acquire_from", []):
-            if get_user_local_roles(user, acq_obj).filter(
-                    role__id__in=perm_role_ids
-            ).exists():
+        """Check the same sources as _check_all_permissions, using the
+        permission bits of the permission index. The permissions the user
+        has globally are combined into masks once, after which a global
+        check is a bitwise and. Local grants are turned into masks as
+        well.
+        """
+
+        perm_mask = permission_index.get_permission_mask(perm)
+
+        if not perm_mask:
+            return False
+
+        direct_mask, global_mask = get_user_permission_masks(user)
+
+        if direct_mask & perm_mask:
+            return True
+
+        if not obj or getattr(obj, "acquire_global_roles", True):
+            if global_mask & perm_mask:
                 return True
 
+        if not obj:
+            return False
+
+        if grants_mask(get_user_local_grants(user, obj)) & perm_mask:
+            return True
+
+        for level in iter_acquire_levels([obj]):
+            for grants in get_user_local_grants_many(user, level).values():
+                if grants_mask(grants) & perm_mask:
+                    return True
+
         return False
@@ -0,0 +1,419 @@
+""" Benchmark helpers. All data is generated within a transaction that is
+rolled back afterwards, so it is safe to run against a database that
+holds real data, although you probably shouldn't do that in production.
+
+"""
+
+import random
+import time
+import django
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from djinn_auth.authbackend import AuthBackend
+from djinn_auth.models import GlobalRole, LocalRole, Role
+from djinn_auth.permindex import permission_index
+from djinn_auth.utils import get_group_model
+
+
+BATCH_SIZE = 5000
+
+
+class Rollback(Exception):
+
+    """ Raised to roll back the benchmark data """
+
+
+def populate_role_assignments(local_roles=100000, global_roles=1000,
+                              assignees=1000, roles=10):
+
+    """Create the given amount of role assignments, spread over the
+    assignees and roles. Assignees are fake groups: only the ids are
+    used. Return the generated roles.
+
+    """
+
+    _roles = [Role.objects.create(name="benchmark role %d" % i)
+              for i in range(roles)]
+
+    assignee_ct = ContentType.objects.get_for_model(get_group_model())
+    instance_ct = ContentType.objects.get_for_model(Group)
+
+    batch = []
+
+    for i in range(local_roles):
+        batch.append(LocalRole(instance_ct=instance_ct,
+                               instance_id=i // assignees,
+                               assignee_ct=assignee_ct,
+                               assignee_id=i % assignees,
+                               role=_roles[i % roles]))
+
+        if len(batch) == BATCH_SIZE:
+            LocalRole.objects.bulk_create(batch)
+            batch = []
+
+    LocalRole.objects.bulk_create(batch)
+
+    GlobalRole.objects.bulk_create(
+        [GlobalRole(assignee_ct=assignee_ct,
+                    assignee_id=i % assignees,
+                    role=_roles[i // assignees % roles])
+         for i in range(global_roles)], batch_size=BATCH_SIZE)
+
+    return _roles
+
+
+def time_queries(make_queryset, repeat=100):
+
+    """Evaluate the queryset returned by make_queryset repeat times, with
+    a random seed each time. Return the timings in milliseconds.
+
+    """
+
+    timings = []
+
+    for i in range(repeat):
+        queryset = make_queryset(random.random())
+
+        start = time.perf_counter()
+        list(queryset)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    return {'avg_ms': sum(timings) / len(timings),
+            'min_ms': min(timings),
+            'max_ms': max(timings)}
+
+
+def run_index_benchmark(local_roles=100000, global_roles=1000,
+                        assignees=1000, roles=10, repeat=100):
+
+    """Time the lookups that the auth backend and utils do on the role
+    assignment tables. Run this before and after the index migration
+    to compare.
+
+    """
+
+    results = {}
+
+    try:
+        with transaction.atomic():
+
+            populate_role_assignments(local_roles, global_roles, assignees,
+                                      roles)
+
+            # Have the query planner know about the new data
+            #
+            if connection.vendor in ['sqlite', 'postgresql']:
+                with connection.cursor() as cursor:
+                    cursor.execute("ANALYZE")
+
+            assignee_ct = ContentType.objects.get_for_model(
+                get_group_model())
+            instance_ct = ContentType.objects.get_for_model(Group)
+            instances = max(local_roles // assignees, 1)
+
+            lookups = {
+                'local role by instance and assignee': lambda r: (
+                    LocalRole.objects.filter(
+                        instance_ct=instance_ct,
+                        instance_id=int(r * instances),
+                        assignee_ct=assignee_ct,
+                        assignee_id=int(r * assignees))),
+                'local roles by instance': lambda r: (
+                    LocalRole.objects.filter(
+                        instance_ct=instance_ct,
+                        instance_id=int(r * instances))),
+                'local roles by assignee': lambda r: (
+                    LocalRole.objects.filter(
+                        assignee_ct=assignee_ct,
+                        assignee_id=int(r * assignees),
+                        instance_ct=instance_ct)),
+                'global roles by assignee': lambda r: (
+                    GlobalRole.objects.filter(
+                        assignee_ct=assignee_ct,
+                        assignee_id=int(r * assignees))),
+            }
+
+            for name, make_queryset in lookups.items():
+                results[name] = time_queries(make_queryset, repeat=repeat)
+                results[name]['plan'] = make_queryset(0.5).explain()
+
+            raise Rollback()
+    except Rollback:
+        pass
+
+    return results
+
+
+def populate_permission_data(users=1000, groups=100, roles=10,
+                             local_roles=1000000, roles_per_instance=10,
+                             groups_per_user=2):
+
+    """Create users, groups, roles and local roles for the permission
+    benchmark. Users are split in three: a tenth has a global role that
+    grants the benchmark permission, a tenth has no roles or groups at
+    all, and the rest gets local roles, directly or through their
+    groups. Instances are auth groups that only exist by id. Even roles
+    grant the permission.
+
+    Return a dict with the permission, the user ids per kind and a
+    sample of (user id, instance id) pairs where the user holds a
+    granting local role directly.
+
+    """
+
+    user_model = get_user_model()
+    group_ct = ContentType.objects.get_for_model(Group)
+    user_ct = ContentType.objects.get_for_model(user_model)
+    assignee_group_ct = ContentType.objects.get_for_model(get_group_model())
+
+    perm, created = Permission.objects.get_or_create(
+        codename="djinn_auth_benchmark", content_type=group_ct,
+        defaults={'name': 'Benchmark permission'})
+
+    _roles = [Role.objects.create(name="benchmark role %d" % i)
+              for i in range(roles)]
+
+    Role.permissions.through.objects.bulk_create(
+        [Role.permissions.through(role=role, permission=perm)
+         for role in _roles[::2]])
+
+    user_model.objects.bulk_create(
+        [user_model(username="djinn_auth_benchmark_%d" % i)
+         for i in range(users)], batch_size=BATCH_SIZE)
+
+    user_ids = list(user_model.objects.filter(
+        username__startswith="djinn_auth_benchmark_").order_by(
+            'id').values_list('id', flat=True))
+
+    Group.objects.bulk_create(
+        [Group(name="djinn_auth_benchmark_%d" % i) for i in range(groups)],
+        batch_size=BATCH_SIZE)
+
+    group_ids = list(Group.objects.filter(
+        name__startswith="djinn_auth_benchmark_").order_by(
+            'id').values_list('id', flat=True))
+
+    global_user_ids = user_ids[:max(users // 10, 1)]
+    denied_user_ids = user_ids[len(user_ids) - max(users // 10, 1):]
+    local_user_ids = user_ids[len(global_user_ids):
+                              len(user_ids) - len(denied_user_ids)]
+
+    through = user_model.groups.through
+
+    through.objects.bulk_create(
+        [through(user_id=user_id,
+                 group_id=group_ids[(i * 3 + j) % len(group_ids)])
+         for i, user_id in enumerate(global_user_ids + local_user_ids)
+         for j in range(min(groups_per_user, len(group_ids)))],
+        batch_size=BATCH_SIZE)
+
+    GlobalRole.objects.bulk_create(
+        [GlobalRole(assignee_ct=user_ct, assignee_id=user_id,
+                    role=_roles[0]) for user_id in global_user_ids],
+        batch_size=BATCH_SIZE)
+
+    # Every instance gets roles_per_instance distinct assignees, taken
+    # from the local users and the groups.
+    #
+    assignees = ([(user_ct, user_id) for user_id in local_user_ids] +
+                 [(assignee_group_ct, group_id) for group_id in group_ids])
+    roles_per_instance = min(roles_per_instance, len(assignees))
+    instances = max(local_roles // roles_per_instance, 1)
+
+    samples = []
+    batch = []
+
+    for i in range(local_roles):
+        instance_id, k = divmod(i, roles_per_instance)
+        assignee_ct, assignee_id = assignees[
+            (instance_id * 7 + k) % len(assignees)]
+        role = k % len(_roles)
+
+        batch.append(LocalRole(instance_ct=group_ct,
+                               instance_id=instance_id,
+                               assignee_ct=assignee_ct,
+                               assignee_id=assignee_id,
+                               role=_roles[role]))
+
+        if assignee_ct == user_ct and role % 2 == 0 and len(samples) < 1000:
+            samples.append((assignee_id, instance_id))
+
+        if len(batch) == BATCH_SIZE:
+            LocalRole.objects.bulk_create(batch)
+            batch = []
+
+    LocalRole.objects.bulk_create(batch)
+
+    return {'permission': "%s.%s" % (group_ct.app_label, perm.codename),
+            'global_user_ids': global_user_ids,
+            'local_user_ids': local_user_ids,
+            'denied_user_ids': denied_user_ids,
+            'instances': instances,
+            'samples': samples}
+
+
+def make_instance(instance_id, depth=0, first_id=0):
+
+    """Return an in memory instance that acquires from the instance with
+    the given id, depth levels up. The instances in between have ids
+    from first_id up, where no local roles should be assigned.
+
+    """
+
+    instance = Group(pk=instance_id)
+
+    for i in range(depth):
+        acquiring = Group(pk=first_id + i)
+        acquiring.acquire_from = [instance]
+        instance = acquiring
+
+    return instance
+
+
+def time_checks(make_check, repeat=1000, count_queries=20):
+
+    """Call the check returned by make_check repeat times, each with a
+    fresh random choice and user object, so no request cache is
+    involved. Return latencies in milliseconds, throughput in checks per
+    second, the number of checks that were granted, and the average
+    number of queries per check, counted over a separate run of
+    count_queries checks.
+
+    """
+
+    timings = []
+    granted = 0
+
+    make_check(random.random())()
+
+    for i in range(repeat):
+        check = make_check(random.random())
+
+        start = time.perf_counter()
+        granted += bool(check())
+        timings.append((time.perf_counter() - start) * 1000)
+
+    with CaptureQueriesContext(connection) as context:
+        for i in range(count_queries):
+            make_check(random.random())()
+
+    timings.sort()
+
+    return {'avg_ms': sum(timings) / len(timings),
+            'p50_ms': timings[len(timings) // 2],
+            'p95_ms': timings[min(int(len(timings) * 0.95),
+                                  len(timings) - 1)],
+            'max_ms': timings[-1],
+            'checks_per_second': len(timings) / (sum(timings) / 1000),
+            'queries_per_check': len(context) / float(count_queries or 1),
+            'granted': granted,
+            'checks': len(timings)}
+
+
+def run_permission_benchmark(users=1000, groups=100, roles=10,
+                             local_roles=1000000, roles_per_instance=10,
+                             groups_per_user=2, depth=3, repeat=1000,
+                             engine=None):
+
+    """Time AuthBackend.has_perm for the global, local, acquired and
+    denied paths on generated data, that is rolled back afterwards.
+    Acquired and denied checks are done on instances that acquire from
+    depth levels of other instances. Return a dict that is fit for
+    dumping as JSON.
+
+    """
+
+    engine = engine or 'queryset'
+    settings = {'DJINN_AUTH_ENGINE': engine}
+
+    if engine == 'materialized':
+        settings['DJINN_AUTH_MATERIALIZE'] = True
+
+    results = {}
+    user_model = get_user_model()
+    backend = AuthBackend()
+
+    try:
+        with transaction.atomic(), override_settings(**settings):
+
+            data = populate_permission_data(
+                users=users, groups=groups, roles=roles,
+                local_roles=local_roles,
+                roles_per_instance=roles_per_instance,
+                groups_per_user=groups_per_user)
+
+            # The data was created without signals
+            #
+            permission_index.invalidate()
+
+            if engine == 'materialized':
+                from djinn_auth import materialize
+
+                materialize.rebuild(data['global_user_ids'] +
+                                    data['local_user_ids'] +
+                                    data['denied_user_ids'])
+
+            if connection.vendor in ['sqlite', 'postgresql']:
+                with connection.cursor() as cursor:
+                    cursor.execute("ANALYZE")
+
+            perm = data['permission']
+            samples = data['samples'] or [(0, 0)]
+            first_id = data['instances'] + 1
+
+            def pick(items, r):
+                return items[int(r * len(items))]
+
+            def check_global(r):
+                user = user_model(pk=pick(data['global_user_ids'], r))
+
+                return lambda: backend.has_perm(user, perm)
+
+            def check_local(r):
+                user_id, instance_id = pick(samples, r)
+                user = user_model(pk=user_id)
+                obj = make_instance(instance_id)
+
+                return lambda: backend.has_perm(user, perm, obj=obj)
+
+            def check_acquired(r):
+                user_id, instance_id = pick(samples, r)
+                user = user_model(pk=user_id)
+                obj = make_instance(instance_id, depth, first_id)
+
+                return lambda: backend.has_perm(user, perm, obj=obj)
+
+            def check_denied(r):
+                user = user_model(pk=pick(data['denied_user_ids'], r))
+                obj = make_instance(int(r * data['instances']), depth,
+                                    first_id)
+
+                return lambda: backend.has_perm(user, perm, obj=obj)
+
+            paths = {'global': check_global,
+                     'local': check_local,
+                     'acquired': check_acquired,
+                     'denied': check_denied}
+
+            for name, make_check in paths.items():
+                results[name] = time_checks(make_check, repeat=repeat)
+
+            raise Rollback()
+    except Rollback:
+        pass
+
+    permission_index.invalidate()
+
+    return {'parameters': {'users': users, 'groups': groups,
+                           'roles': roles, 'local_roles': local_roles,
+                           'roles_per_instance': roles_per_instance,
+                           'groups_per_user': groups_per_user,
+                           'depth': depth, 'repeat': repeat,
+                           'engine': engine},
+            'environment': {'django': django.get_version(),
+                            'database': connection.vendor,
+                            'time': time.strftime("%Y-%m-%dT%H:%M:%S")},
+            'results': results}
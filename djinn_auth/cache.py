@@ -0,0 +1,114 @@
+""" Per request permission cache. The cache is stored on the user
+object, so it lives as long as the user instance, which normally is the
+duration of a request. Whenever roles, permissions or group memberships
+change, the process wide generation is bumped and all caches created
+before that are discarded on next access.
+
+"""
+
+import itertools
+
+
+CACHE_ATTR = "_djinn_auth_cache"
+
+_generations = itertools.count(1)
+_generation = next(_generations)
+
+
+class PermissionCache(object):
+
+    """Holds the resolved data for one user: group ids, global role
+    ids, local role and permission ids per instance, the verdicts of
+    earlier permission checks, the ids of all permissions the user
+    has, globally and per object, and the masks of the bitset engine.
+
+    """
+
+    def __init__(self, generation):
+
+        self.generation = generation
+        self.group_ids = None
+        self.global_role_ids = None
+        self.local_grants = {}
+        self.verdicts = {}
+        self.direct_permission_ids = None
+        self.all_permission_ids = {}
+        self.masks = None
+
+
+def instance_key(instance):
+
+    """ Hashable key for a model instance """
+
+    return (instance._meta.label_lower, instance.pk)
+
+
+def object_key(obj=None):
+
+    """Key for the object of a permission check. Since the outcome of a
+    check also depends on the acquisition attributes of the object,
+    these are part of the key. Returns None if the check can't be
+    cached, i.e. for unsaved objects.
+
+    """
+
+    if obj is None:
+        return ()
+
+    if obj.pk is None:
+        return None
+
+    return (instance_key(obj),
+            bool(getattr(obj, "acquire_global_roles", True)),
+            tuple(instance_key(acq_obj) for acq_obj in
+                  getattr(obj, "acquire_from", [])))
+
+
+def verdict_key(perm, obj=None):
+
+    """ Key for the verdict of a permission check, or None if the check
+    can't be cached """
+
+    key = object_key(obj)
+
+    if key is None:
+        return None
+
+    return (perm,) + key
+
+
+def get_permission_cache(user):
+
+    """ Get the permission cache for the user, creating a fresh one if
+    there is none yet, or the existing one is outdated. """
+
+    cache = getattr(user, CACHE_ATTR, None)
+
+    if cache is None or cache.generation != _generation:
+        cache = PermissionCache(_generation)
+        setattr(user, CACHE_ATTR, cache)
+
+    return cache
+
+
+def invalidate_permission_cache(assignee=None):
+
+    """Invalidate all permission caches. If the assignee is given and
+    holds a cache, drop it right away.
+
+    """
+
+    global _generation
+
+    _generation = next(_generations)
+
+    if assignee is not None and hasattr(assignee, CACHE_ATTR):
+        delattr(assignee, CACHE_ATTR)
+
+
+def invalidate_on_change(sender, **kwargs):
+
+    """ Signal handler for any change that may affect permissions """
+
+    if kwargs.get("action", "post_").startswith("post_"):
+        invalidate_permission_cache()
@@ -0,0 +1,93 @@
+""" Statistics of the sources that grant permissions, for the queryset
+engine. With DJINN_AUTH_ADAPTIVE_ORDER enabled, the backend records the
+source that granted each check, and tries the sources that granted a
+permission most often first. Counters decay with every grant of the
+permission, by DJINN_AUTH_ADAPTIVE_DECAY, so the order follows changes
+in how permissions are given out. Denied checks run all sources anyway,
+and are not recorded.
+
+The statistics are kept per process. Inspect them with
+check_stats.get_stats().
+
+"""
+
+import threading
+from django.conf import settings
+from djinn_auth import instrument
+
+
+# Sources of the queryset engine, in their default order
+#
+SOURCES = (instrument.USER_SET, instrument.GROUP_SET, instrument.GLOBAL_ROLE,
+           instrument.LOCAL_ROLE, instrument.ACQUIRED)
+
+DECAY = 0.99
+
+
+def is_enabled():
+
+    return getattr(settings, 'DJINN_AUTH_ADAPTIVE_ORDER', False)
+
+
+def get_decay():
+
+    return getattr(settings, 'DJINN_AUTH_ADAPTIVE_DECAY', DECAY)
+
+
+class CheckStats(object):
+
+    """Decaying counters of granting sources, per permission name, and
+    the order of sources derived from them.
+
+    """
+
+    def __init__(self):
+
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+
+        with self._lock:
+            self._counts = {}
+            self._orders = {}
+
+    def record(self, perm, source):
+
+        """ Record that source granted perm """
+
+        decay = get_decay()
+
+        with self._lock:
+            counts = self._counts.setdefault(perm, dict.fromkeys(SOURCES, 0))
+
+            for _source in counts:
+                counts[_source] *= decay
+
+            counts[source] += 1
+
+            # Sort is stable, so ties keep the default order
+            #
+            self._orders[perm] = tuple(sorted(
+                SOURCES, key=lambda _source: -counts[_source]))
+
+    def get_order(self, perm):
+
+        """ Return the sources in the order to try them for perm """
+
+        return self._orders.get(perm, SOURCES)
+
+    def get_stats(self):
+
+        """Return a dict of permission name to a dict with the decayed
+        counts per source, and the resulting order.
+
+        """
+
+        with self._lock:
+            return dict((perm, {'counts': dict(counts),
+                                'order': list(self._orders[perm])})
+                        for perm, counts in self._counts.items())
+
+
+check_stats = CheckStats()
@@ -0,0 +1,68 @@
+""" Deferral of shared invalidations until the transaction commits.
+Invalidating shared state before the commit lets other processes cache
+the old rows again, under the new version. Instead, the invalidation is
+registered as a commit hook, and until it runs, the thread making the
+change keeps away from the shared state. Hooks that the connection
+drops belong to transactions, or savepoints, that were rolled back.
+
+"""
+
+import threading
+from django.db import transaction
+
+
+class PendingHooks(object):
+
+    """ Commit hooks registered by the current thread, that did not run
+    yet """
+
+    def __init__(self):
+
+        self._local = threading.local()
+
+    def add(self, func, using=None):
+
+        """Call func when the transaction commits, or right away outside
+        of transactions.
+
+        """
+
+        if not transaction.get_connection(using).in_atomic_block:
+            func()
+            return
+
+        pending = getattr(self._local, "pending", None)
+
+        if pending is None:
+            pending = self._local.pending = []
+
+        def hook():
+            if hook in pending:
+                pending.remove(hook)
+
+            func()
+
+        pending.append(hook)
+
+        transaction.on_commit(hook, using=using)
+
+    def check(self, using=None):
+
+        """Return a tuple of the number of hooks that are pending, and
+        whether any were dropped since the last check, because of a
+        rollback.
+
+        """
+
+        pending = getattr(self._local, "pending", None)
+
+        if not pending:
+            return 0, False
+
+        registered = [hook[1] for hook in getattr(
+            transaction.get_connection(using), "run_on_commit", [])]
+
+        count = len(pending)
+        pending[:] = [hook for hook in pending if hook in registered]
+
+        return len(pending), len(pending) < count
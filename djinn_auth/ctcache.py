@@ -0,0 +1,120 @@
+""" Process local cache of the models and content type ids the permission
+checks filter on: the user model, the group model and the content types
+of the instances checked. These only change when the app registry or the
+database is set up anew, so they are resolved once, and dropped on
+setting changes and after migrations.
+
+"""
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ImproperlyConfigured
+
+
+# Settings that change the models or the app registry
+#
+SETTINGS = ["AUTH_USER_MODEL", "AUTH_GROUP_MODEL", "INSTALLED_APPS"]
+
+_group_model = None
+_user_ct_id = None
+_group_ct_id = None
+_ct_ids = {}
+
+
+def load_group_model():
+
+    """Resolve the group model from the AUTH_GROUP_MODEL setting, or the
+    Django group model if not set.
+
+    """
+
+    from django.contrib.auth.models import Group
+
+    if not getattr(settings, 'AUTH_GROUP_MODEL', None):
+        return Group
+
+    try:
+        app_label, model_name = settings.AUTH_GROUP_MODEL.split('.')
+    except ValueError:
+        raise ImproperlyConfigured(
+            "AUTH_GROUP_MODEL must be of the form 'app_label.model_name'")
+
+    try:
+        return apps.get_model(app_label, model_name)
+    except LookupError:
+        raise ImproperlyConfigured("AUTH_GROUP_MODEL refers to model '%s' "
+                                   "that has not been installed" %
+                                   settings.AUTH_GROUP_MODEL)
+
+
+def get_group_model():
+
+    global _group_model
+
+    if _group_model is None:
+        _group_model = load_group_model()
+
+    return _group_model
+
+
+def get_ct_id(model):
+
+    """ Return the content type id of the model, or of the model of the
+    given instance """
+
+    model = model if isinstance(model, type) else model.__class__
+
+    try:
+        return _ct_ids[model]
+    except KeyError:
+        ct_id = _ct_ids[model] = ContentType.objects.get_for_model(model).id
+
+        return ct_id
+
+
+def get_user_ct_id():
+
+    global _user_ct_id
+
+    if _user_ct_id is None:
+        _user_ct_id = get_ct_id(get_user_model())
+
+    return _user_ct_id
+
+
+def get_group_ct_id():
+
+    global _group_ct_id
+
+    if _group_ct_id is None:
+        _group_ct_id = get_ct_id(get_group_model())
+
+    return _group_ct_id
+
+
+def invalidate():
+
+    global _group_model, _user_ct_id, _group_ct_id
+
+    _group_model = None
+    _user_ct_id = None
+    _group_ct_id = None
+    _ct_ids.clear()
+
+
+def invalidate_on_setting_changed(sender, setting, **kwargs):
+
+    """ Signal handler for changed settings """
+
+    if setting in SETTINGS:
+        invalidate()
+
+
+def invalidate_on_migrate(sender, **kwargs):
+
+    """ Signal handler for post_migrate. Content types may have been
+    created anew, for instance after a flush. """
+
+    invalidate()
@@ -0,0 +1,190 @@
+""" Maintenance of the group nesting closure. The GroupClosure table
+holds a row for every (ancestor, descendant) pair of groups, including
+each group with itself, so the effective groups of a user are found with
+a single lookup. The signal handlers in this module update the rows of
+the groups affected by a change in nesting, and invalidate the
+permission caches of their members.
+
+"""
+
+from django.contrib.auth import get_user_model
+from djinn_auth import materialize, sharedcache
+from djinn_auth.cache import invalidate_permission_cache
+from djinn_auth.models import Group, GroupClosure
+
+
+def get_descendant_ids(group_ids):
+
+    """ Return the ids of the groups and all groups nested in them """
+
+    return set(GroupClosure.objects.filter(
+        ancestor_id__in=group_ids).values_list(
+            'descendant_id', flat=True)) | set(group_ids)
+
+
+def get_member_ids(group_ids):
+
+    """ Return the ids of the users in the groups, or in groups nested in
+    them """
+
+    return set(get_user_model().objects.filter(
+        group__in=GroupClosure.objects.filter(
+            ancestor_id__in=group_ids).values('descendant_id')).values_list(
+                'id', flat=True))
+
+
+def refresh(group_ids):
+
+    """Recompute the ancestors of the given groups and the groups nested
+    in them, and update the rows that differ. Only the nesting of these
+    groups is read; the ancestors of their parents outside of them are
+    taken from the closure, that a change in their nesting doesn't
+    affect. Return the ids of the groups that were refreshed.
+
+    """
+
+    group_ids = get_descendant_ids(group_ids)
+
+    parents = {}
+
+    for parent_id, child_id in Group.subgroups.through.objects.filter(
+            to_group_id__in=group_ids).values_list(
+                'from_group_id', 'to_group_id'):
+        parents.setdefault(child_id, set()).add(parent_id)
+
+    outside = {}
+
+    for ancestor_id, descendant_id in GroupClosure.objects.filter(
+            descendant_id__in=set().union(*parents.values()) - group_ids
+    ).values_list('ancestor_id', 'descendant_id'):
+        outside.setdefault(descendant_id, set([descendant_id])).add(
+            ancestor_id)
+
+    expected = set()
+
+    for group_id in group_ids:
+        ancestors = set([group_id])
+        todo = [group_id]
+
+        while todo:
+            for parent_id in parents.get(todo.pop(), ()):
+                if parent_id in ancestors:
+                    continue
+
+                if parent_id in group_ids:
+                    ancestors.add(parent_id)
+                    todo.append(parent_id)
+                else:
+                    ancestors.update(outside.get(parent_id, [parent_id]))
+
+        expected.update((ancestor_id, group_id) for ancestor_id in ancestors)
+
+    existing = dict(
+        ((ancestor_id, descendant_id), pk) for pk, ancestor_id, descendant_id
+        in GroupClosure.objects.filter(
+            descendant_id__in=group_ids).values_list(
+                'id', 'ancestor_id', 'descendant_id'))
+
+    GroupClosure.objects.filter(pk__in=[
+        pk for row, pk in existing.items() if row not in expected]).delete()
+
+    GroupClosure.objects.bulk_create(
+        [GroupClosure(ancestor_id=row[0], descendant_id=row[1])
+         for row in expected if row not in existing],
+        ignore_conflicts=True)
+
+    return group_ids
+
+
+def rebuild():
+
+    """ Rebuild the closure of all groups """
+
+    return refresh(Group.objects.values_list('id', flat=True))
+
+
+def invalidate(group_ids):
+
+    """ Invalidate whatever depends on the membership of the groups """
+
+    if sharedcache.is_enabled() or materialize.is_enabled():
+        invalidate_users(get_member_ids(group_ids))
+    else:
+        invalidate_permission_cache()
+
+
+def invalidate_users(user_ids):
+
+    """ Invalidate whatever depends on the groups of the users """
+
+    invalidate_permission_cache()
+
+    if sharedcache.is_enabled():
+        sharedcache.bump(*[sharedcache.user_generation_key(user_id)
+                           for user_id in user_ids])
+
+    if materialize.is_enabled():
+        materialize.refresh_users(user_ids)
+
+
+def group_saved(sender, instance, created, **kwargs):
+
+    """ Handler for saving groups. New groups are their own ancestor. """
+
+    if created and isinstance(instance, Group):
+        GroupClosure.objects.get_or_create(ancestor_id=instance.pk,
+                                           descendant_id=instance.pk)
+
+
+def group_pre_delete(sender, instance, **kwargs):
+
+    """ Handler for deleting groups. The members, that the delete removes
+    without m2m_changed signals, and the nested groups are determined
+    before the delete. """
+
+    if isinstance(instance, Group):
+        instance._djinn_auth_member_ids = get_member_ids([instance.pk])
+        instance._djinn_auth_descendant_ids = get_descendant_ids(
+            [instance.pk]) - set([instance.pk])
+
+
+def group_deleted(sender, instance, **kwargs):
+
+    """ Handler for deleting groups. The groups nested in the deleted
+    group lose its ancestors, and all members lose its roles. """
+
+    if not isinstance(instance, Group):
+        return
+
+    group_ids = getattr(instance, "_djinn_auth_descendant_ids", None)
+
+    if group_ids:
+        refresh(group_ids)
+
+    invalidate_users(getattr(instance, "_djinn_auth_member_ids", ()))
+
+
+def subgroups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+
+    """Handler for changes in group nesting. The subgroups of a group that
+    are cleared are determined before the clear.
+
+    """
+
+    if action == "pre_clear":
+        if reverse:
+            instance._djinn_auth_cleared_group_ids = [instance.pk]
+        else:
+            instance._djinn_auth_cleared_group_ids = list(
+                instance.subgroups.values_list('id', flat=True))
+        return
+
+    if action == "post_clear":
+        group_ids = getattr(instance, "_djinn_auth_cleared_group_ids", [])
+    elif action in ["post_add", "post_remove"]:
+        group_ids = [instance.pk] if reverse else pk_set
+    else:
+        return
+
+    if group_ids:
+        invalidate(refresh(group_ids))
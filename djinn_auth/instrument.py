@@ -0,0 +1,220 @@
+""" Optional instrumentation of permission checks. With the
+DJINN_AUTH_INSTRUMENT setting enabled, every permission check that is
+resolved by the backend sends the permission_checked signal, with the
+permission, the deciding source, the number of queries and the elapsed
+time. Verdicts that are cached on the user are not resolved, and not
+reported. With the setting disabled, the checks are not wrapped at all.
+
+The collector in this module aggregates the checks the way Prometheus
+does, and renders them in its text format. PermissionCheckMiddleware
+summarises the checks per request.
+
+"""
+
+import bisect
+import collections
+import contextlib
+import contextvars
+import threading
+import time
+from django.conf import settings
+from django.db import connections
+from djinn_auth.signals import permission_checked
+
+
+# Deciding sources of the queryset engine. The other engines report
+# their name as source. Checks that are not granted have source 'denied'.
+#
+USER_SET = "user_set"
+GROUP_SET = "group_set"
+GLOBAL_ROLE = "global_role"
+LOCAL_ROLE = "local_role"
+ACQUIRED = "acquired"
+DENIED = "denied"
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+           0.5, 1.0)
+
+_request_checks = contextvars.ContextVar("djinn_auth_request_checks",
+                                         default=None)
+
+
+def is_enabled():
+
+    return getattr(settings, 'DJINN_AUTH_INSTRUMENT', False)
+
+
+class QueryCounter(object):
+
+    """ Execute wrapper that counts queries """
+
+    def __init__(self):
+
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+
+        self.count += 1
+
+        return execute(sql, params, many, context)
+
+
+@contextlib.contextmanager
+def count_queries():
+
+    """ Count the queries on all database connections within the block """
+
+    counter = QueryCounter()
+
+    with contextlib.ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(counter))
+
+        yield counter
+
+
+def instrument(sender, find_source):
+
+    """Wrap find_source, that returns the deciding source of a permission
+    check or None, into a check that returns a boolean, and sends the
+    permission_checked signal.
+
+    """
+
+    def check(user, permission, obj=None):
+
+        with count_queries() as counter:
+            start = time.perf_counter()
+            source = find_source(user, permission, obj=obj)
+            elapsed = time.perf_counter() - start
+
+        permission_checked.send(
+            sender=sender, user=user, permission=permission, obj=obj,
+            result=source is not None, source=source or DENIED,
+            queries=counter.count, elapsed=elapsed)
+
+        return source is not None
+
+    return check
+
+
+class Collector(object):
+
+    """Aggregate permission checks per source: a counter of checks, a
+    counter of queries, and a histogram of the elapsed time. Connect an
+    instance to the permission_checked signal.
+
+    """
+
+    def __init__(self, buckets=BUCKETS):
+
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+
+        with self._lock:
+            self.checks = collections.Counter()
+            self.queries = collections.Counter()
+            self.seconds = collections.defaultdict(
+                lambda: [0] * (len(self.buckets) + 1))
+            self.seconds_sum = collections.Counter()
+
+    def __call__(self, sender, source, queries, elapsed, **kwargs):
+
+        with self._lock:
+            self.checks[source] += 1
+            self.queries[source] += queries
+            self.seconds[source][
+                bisect.bisect_left(self.buckets, elapsed)] += 1
+            self.seconds_sum[source] += elapsed
+
+    def render(self):
+
+        """ Return the metrics in the Prometheus text format """
+
+        lines = []
+
+        with self._lock:
+            lines.append("# HELP djinn_auth_permission_checks_total "
+                         "Permission checks by deciding source")
+            lines.append("# TYPE djinn_auth_permission_checks_total counter")
+
+            for source, count in sorted(self.checks.items()):
+                lines.append('djinn_auth_permission_checks_total'
+                             '{source="%s"} %d' % (source, count))
+
+            lines.append("# HELP djinn_auth_permission_check_queries_total "
+                         "Queries done by permission checks")
+            lines.append("# TYPE djinn_auth_permission_check_queries_total "
+                         "counter")
+
+            for source, count in sorted(self.queries.items()):
+                lines.append('djinn_auth_permission_check_queries_total'
+                             '{source="%s"} %d' % (source, count))
+
+            lines.append("# HELP djinn_auth_permission_check_seconds "
+                         "Time taken by permission checks")
+            lines.append("# TYPE djinn_auth_permission_check_seconds "
+                         "histogram")
+
+            for source, counts in sorted(self.seconds.items()):
+                total = 0
+
+                for bucket, count in zip(self.buckets + ("+Inf",), counts):
+                    total += count
+                    lines.append('djinn_auth_permission_check_seconds_bucket'
+                                 '{source="%s",le="%s"} %d' % (
+                                     source, bucket, total))
+
+                lines.append('djinn_auth_permission_check_seconds_sum'
+                             '{source="%s"} %f' % (
+                                 source, self.seconds_sum[source]))
+                lines.append('djinn_auth_permission_check_seconds_count'
+                             '{source="%s"} %d' % (source, total))
+
+        return "\n".join(lines) + "\n"
+
+
+collector = Collector()
+
+
+def start_request():
+
+    """ Start recording the checks of the current request """
+
+    return _request_checks.set([])
+
+
+def end_request(token):
+
+    """ Stop recording, and return the recorded checks """
+
+    checks = _request_checks.get()
+    _request_checks.reset(token)
+
+    return checks or []
+
+
+def record_request_check(sender, **kwargs):
+
+    """ Handler that records checks for the current request, if any """
+
+    checks = _request_checks.get()
+
+    if checks is not None:
+        checks.append(kwargs)
+
+
+def summarize(checks):
+
+    """ Summarise recorded checks: the number of checks, the number
+    granted, queries, elapsed milliseconds and checks per source """
+
+    return {'checks': len(checks),
+            'granted': sum(1 for check in checks if check['result']),
+            'queries': sum(check['queries'] for check in checks),
+            'elapsed_ms': sum(check['elapsed'] for check in checks) * 1000,
+            'sources': dict(collections.Counter(
+                check['source'] for check in checks))}
@@ -0,0 +1 @@
+""" Being there """
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+from djinn_auth.benchmark import run_index_benchmark
+
+
+class Command(BaseCommand):
+
+    help = """Time the role assignment lookups on generated data. The data
+    is rolled back afterwards. Run before and after migrating to compare
+    the effect of the indexes."""
+
+    def add_arguments(self, parser):
+
+        parser.add_argument("--local-roles", type=int, default=100000)
+        parser.add_argument("--global-roles", type=int, default=1000)
+        parser.add_argument("--assignees", type=int, default=1000)
+        parser.add_argument("--roles", type=int, default=10)
+        parser.add_argument("--repeat", type=int, default=100)
+        parser.add_argument("--explain", action="store_true",
+                            help="Show the query plans")
+
+    def handle(self, *args, **options):
+
+        results = run_index_benchmark(
+            local_roles=options['local_roles'],
+            global_roles=options['global_roles'],
+            assignees=options['assignees'],
+            roles=options['roles'],
+            repeat=options['repeat'])
+
+        for name, result in results.items():
+            self.stdout.write(
+                "%-40s avg %8.3fms  min %8.3fms  max %8.3fms" % (
+                    name, result['avg_ms'], result['min_ms'],
+                    result['max_ms']))
+
+            if options['explain']:
+                self.stdout.write("    %s" % result['plan'])
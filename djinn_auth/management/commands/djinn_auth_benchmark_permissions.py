@@ -0,0 +1,49 @@
+import json
+from django.core.management.base import BaseCommand
+from djinn_auth.authbackend import AuthBackend
+from djinn_auth.benchmark import run_permission_benchmark
+
+
+class Command(BaseCommand):
+
+    help = """Time permission checks by the auth backend on generated
+    data: latency, queries per check and throughput, for checks granted
+    by a global role, by a local role, by acquisition, and for denied
+    checks. The data is rolled back afterwards. The results are written
+    as JSON, so runs can be compared over time."""
+
+    def add_arguments(self, parser):
+
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--groups", type=int, default=100)
+        parser.add_argument("--roles", type=int, default=10)
+        parser.add_argument("--local-roles", type=int, default=1000000)
+        parser.add_argument("--roles-per-instance", type=int, default=10)
+        parser.add_argument("--groups-per-user", type=int, default=2)
+        parser.add_argument("--depth", type=int, default=3,
+                            help="Acquisition depth of acquired and "
+                            "denied checks")
+        parser.add_argument("--repeat", type=int, default=1000)
+        parser.add_argument("--engine", choices=sorted(AuthBackend.engines))
+        parser.add_argument("--output",
+                            help="Write the JSON to this file instead of "
+                            "standard output")
+
+    def handle(self, *args, **options):
+
+        results = run_permission_benchmark(
+            users=options['users'],
+            groups=options['groups'],
+            roles=options['roles'],
+            local_roles=options['local_roles'],
+            roles_per_instance=options['roles_per_instance'],
+            groups_per_user=options['groups_per_user'],
+            depth=options['depth'],
+            repeat=options['repeat'],
+            engine=options['engine'])
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2, sort_keys=True)
+        else:
+            self.stdout.write(json.dumps(results, indent=2, sort_keys=True))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from djinn_auth.materialize import check_users
+
+
+class Command(BaseCommand):
+
+    help = """Check the materialised effective permissions against the
+    live permission data, for all users or for the given user ids"""
+
+    def add_arguments(self, parser):
+
+        parser.add_argument("user_ids", nargs="*", type=int)
+
+    def handle(self, *args, **options):
+
+        problems = 0
+
+        for user_id, problem, grant in check_users(
+                options['user_ids'] or None):
+            problems += 1
+
+            self.stdout.write(
+                "user %s: %s permission %s on %s" % (
+                    user_id, problem, grant[0],
+                    "%s/%s" % grant[1:3] if grant[1] else "all"))
+
+        if problems:
+            raise CommandError("Found %d problems" % problems)
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from djinn_auth.snapshot import export_snapshot, CHUNK_SIZE
+
+
+class Command(BaseCommand):
+
+    help = """Export roles, global roles, local roles and local permissions
+    to a snapshot file, see djinn_auth.snapshot"""
+
+    def add_arguments(self, parser):
+
+        parser.add_argument("path")
+        parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+
+        with open(options['path'], "wb") as output:
+            counts = export_snapshot(output, chunk_size=options['chunk_size'])
+
+        for name, count in sorted(counts.items()):
+            self.stdout.write("%s: %d" % (name, count))
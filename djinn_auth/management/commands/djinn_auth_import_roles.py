@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from djinn_auth import materialize
+from djinn_auth.snapshot import import_snapshot, SnapshotError
+
+
+class Command(BaseCommand):
+
+    help = """Import a snapshot made with djinn_auth_export_roles. Roles
+    are matched by name; existing assignments are kept, unless --replace
+    is given."""
+
+    def add_arguments(self, parser):
+
+        parser.add_argument("path")
+        parser.add_argument("--replace", action="store_true",
+                            help="Remove all existing assignments first")
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+
+        try:
+            with open(options['path'], "rb") as infile, \
+                    transaction.atomic():
+                counts = import_snapshot(infile, replace=options['replace'],
+                                         batch_size=options['batch_size'])
+        except SnapshotError as e:
+            raise CommandError(str(e))
+
+        for name, count in sorted(counts.items()):
+            self.stdout.write("%s: %d" % (name, count))
+
+        if materialize.is_enabled():
+            self.stdout.write("Rebuilding effective permissions")
+            materialize.rebuild()
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router, transaction
+from djinn_auth import partitions
+from djinn_auth.models import LocalRole
+
+
+class Command(BaseCommand):
+
+    help = """Move the local roles into a partitioned table, by the key
+    given or DJINN_AUTH_LOCALROLE_PARTITION_KEY, or back into a single
+    table with --unpartition. Requires PostgreSQL. All rows are copied
+    in a single transaction, holding an exclusive lock on the table."""
+
+    def add_arguments(self, parser):
+
+        parser.add_argument("--key", choices=sorted(partitions.KEYS),
+                            default=None)
+        parser.add_argument("--partitions", type=int, default=None,
+                            help="Number of partitions for the "
+                            "'instance_id' key")
+        parser.add_argument("--unpartition", action="store_true")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="Only print the statements")
+
+    def handle(self, *args, **options):
+
+        if options['unpartition']:
+            key = None
+        else:
+            key = options['key'] or partitions.get_partition_key()
+
+            if not key:
+                raise CommandError(
+                    "Give --key, or set DJINN_AUTH_LOCALROLE_PARTITION_KEY")
+
+        alias = router.db_for_write(LocalRole)
+
+        try:
+            with transaction.atomic(using=alias):
+                statements = partitions.migrate(
+                    connections[alias], LocalRole._meta.db_table, key=key,
+                    count=options['partitions'],
+                    dry_run=options['dry_run'])
+        except partitions.PartitionError as e:
+            raise CommandError(str(e))
+
+        for statement in statements:
+            self.stdout.write("%s;" % statement)
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from djinn_auth.materialize import rebuild
+
+
+class Command(BaseCommand):
+
+    help = """Rebuild the materialised effective permissions, for all users
+    or for the given user ids"""
+
+    def add_arguments(self, parser):
+
+        parser.add_argument("user_ids", nargs="*", type=int)
+
+    def handle(self, *args, **options):
+
+        rebuild(options['user_ids'] or None)
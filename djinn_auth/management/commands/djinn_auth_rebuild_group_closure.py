@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from djinn_auth.groupclosure import rebuild
+
+
+class Command(BaseCommand):
+
+    help = """Rebuild the closure of nested groups, after changes that
+    bypassed the ORM signals"""
+
+    def handle(self, *args, **options):
+
+        rebuild()
@@ -0,0 +1,422 @@
+""" Maintenance of the materialised effective permissions. When the
+DJINN_AUTH_MATERIALIZE setting is True, the signal handlers in this
+module keep the EffectivePermission table up to date. Role assignments
+and local permissions only affect the grants of their members on one
+instance, or their global role grants, so only those are recomputed;
+other changes recompute all grants of every user affected. Use the
+djinn_auth_rebuild_effective_permissions command to (re)build the
+table from scratch, and djinn_auth_check_effective_permissions to check
+it against the live resolution.
+
+"""
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Q
+from djinn_auth import ctcache
+from djinn_auth.partitions import instances_filter
+from djinn_auth.authbackend import AuthBackend
+from djinn_auth.models import EffectivePermission, GlobalRole, LocalRole, \
+    LocalPermission, Role, Group as DjinnGroup
+from djinn_auth.permindex import permission_index
+from djinn_auth.utils import get_group_permission_model, \
+    load_user_group_ids, uses_group_closure
+
+
+FIELDS = ('permission_id', 'instance_ct_id', 'instance_id', 'global_role')
+
+
+def is_enabled():
+
+    return getattr(settings, 'DJINN_AUTH_MATERIALIZE', False)
+
+
+def compute_user_grants(user):
+
+    """Compute the effective grants for the user from the live data.
+    Return a set of (permission_id, instance_ct_id, instance_id,
+    global_role) tuples, where global grants have no instance.
+
+    """
+
+    group_ids = list(load_user_group_ids(user))
+
+    assignee = (Q(assignee_ct_id=ctcache.get_user_ct_id(),
+                  assignee_id=user.id) |
+                Q(assignee_ct_id=ctcache.get_group_ct_id(),
+                  assignee_id__in=group_ids))
+
+    grants = set()
+
+    for perm_id in user.user_permissions.all().values_list('id', flat=True):
+        grants.add((perm_id, None, None, False))
+
+    for perm_id in get_group_permission_model().objects.filter(
+            group_id__in=group_ids).values_list('permission_id', flat=True):
+        grants.add((perm_id, None, None, False))
+
+    for role_id in GlobalRole.objects.filter(assignee).values_list(
+            'role_id', flat=True):
+        for perm_id in permission_index.get_role_permission_ids(role_id):
+            grants.add((perm_id, None, None, True))
+
+    for ctype_id, instance_id, role_id in LocalRole.objects.filter(
+            assignee).values_list('instance_ct_id', 'instance_id', 'role_id'):
+        for perm_id in permission_index.get_role_permission_ids(role_id):
+            grants.add((perm_id, ctype_id, instance_id, False))
+
+    for ctype_id, instance_id, perm_id in LocalPermission.objects.filter(
+            assignee).values_list('instance_ct_id', 'instance_id',
+                                  'permission_id'):
+        grants.add((perm_id, ctype_id, instance_id, False))
+
+    return grants
+
+
+def get_user_grants(user_id):
+
+    """ Return a dict of materialised grant to row id for the user """
+
+    return dict(
+        (tuple(row[1:]), row[0]) for row in
+        EffectivePermission.objects.filter(user_id=user_id).values_list(
+            'id', *FIELDS))
+
+
+def refresh_users(user_ids):
+
+    """ Recompute the effective grants of the given users, and update
+    the table where it differs. """
+
+    user_model = get_user_model()
+
+    for user_id in set(user_ids):
+
+        expected = compute_user_grants(user_model(pk=user_id))
+
+        with transaction.atomic():
+
+            existing = get_user_grants(user_id)
+
+            EffectivePermission.objects.filter(pk__in=[
+                pk for grant, pk in existing.items()
+                if grant not in expected]).delete()
+
+            EffectivePermission.objects.bulk_create([
+                EffectivePermission(user_id=user_id,
+                                    **dict(zip(FIELDS, grant)))
+                for grant in expected if grant not in existing])
+
+
+def refresh_scope(assignees, instances=None):
+
+    """Recompute the grants of the users affected by changes in the
+    assignments of the given (content type id, id) assignees, on the
+    instances, given as a list of (content type id, instance id)
+    tuples, or their global role grants if instances is None. Update the
+    table where it differs. Only the assignments on these instances, or
+    the global roles, are read, so the cost doesn't depend on the number
+    of other grants of the users.
+
+    """
+
+    members = dict((assignee, set(get_assignee_user_ids(*assignee)))
+                   for assignee in set(assignees))
+    user_ids = set().union(*members.values())
+
+    if not user_ids:
+        return
+
+    user_ct_id = ctcache.get_user_ct_id()
+
+    # Only assignments to the users themselves, or to groups, count
+    #
+    assignee = (Q(assignee_ct_id=user_ct_id, assignee_id__in=user_ids) |
+                ~Q(assignee_ct_id=user_ct_id))
+
+    def get_user_ids(assignee_ct_id, assignee_id):
+        key = (assignee_ct_id, assignee_id)
+
+        if key not in members:
+            members[key] = user_ids.intersection(
+                get_assignee_user_ids(assignee_ct_id, assignee_id))
+
+        return members[key]
+
+    expected = set()
+
+    if instances is None:
+        scope = Q(global_role=True)
+
+        for assignee_ct_id, assignee_id, role_id in GlobalRole.objects.filter(
+                assignee).values_list('assignee_ct_id', 'assignee_id',
+                                      'role_id'):
+            for user_id in get_user_ids(assignee_ct_id, assignee_id):
+                for perm_id in permission_index.get_role_permission_ids(
+                        role_id):
+                    expected.add((user_id, perm_id, None, None, True))
+    else:
+        if not instances:
+            return
+
+        scope = instances_filter(instances) & Q(global_role=False)
+
+        for model in [LocalRole, LocalPermission]:
+            field = 'role_id' if model is LocalRole else 'permission_id'
+
+            for row in model.objects.filter(
+                    instances_filter(instances), assignee).values_list(
+                        'assignee_ct_id', 'assignee_id', 'instance_ct_id',
+                        'instance_id', field):
+                assignee_ct_id, assignee_id, ctype_id, instance_id, pk = row
+
+                if model is LocalRole:
+                    perm_ids = permission_index.get_role_permission_ids(pk)
+                else:
+                    perm_ids = [pk]
+
+                for user_id in get_user_ids(assignee_ct_id, assignee_id):
+                    for perm_id in perm_ids:
+                        expected.add(
+                            (user_id, perm_id, ctype_id, instance_id, False))
+
+    with transaction.atomic():
+
+        existing = dict(
+            (tuple(row[1:]), row[0]) for row in
+            EffectivePermission.objects.filter(
+                scope, user_id__in=user_ids).values_list(
+                    'id', 'user_id', *FIELDS))
+
+        EffectivePermission.objects.filter(pk__in=[
+            pk for grant, pk in existing.items()
+            if grant not in expected]).delete()
+
+        EffectivePermission.objects.bulk_create([
+            EffectivePermission(user_id=grant[0],
+                                **dict(zip(FIELDS, grant[1:])))
+            for grant in expected if grant not in existing])
+
+
+def rebuild(user_ids=None):
+
+    """ Rebuild the table for the given users, or for all users """
+
+    if user_ids is None:
+        EffectivePermission.objects.all().delete()
+
+        user_ids = get_user_model().objects.values_list(
+            'id', flat=True).iterator()
+
+    refresh_users(user_ids)
+
+
+def check_users(user_ids=None):
+
+    """Compare the materialised grants with the live data. Yield tuples of
+    (user_id, problem, grant), where problem is 'missing' for grants
+    that should be materialised, 'stale' for rows that should not be
+    there, and 'denied' for grants that the live permission check in
+    AuthBackend._check_all_permissions doesn't confirm.
+
+    """
+
+    backend = AuthBackend()
+    user_model = get_user_model()
+    labels = dict(
+        (pk, "%s.%s" % (app_label, codename)) for pk, app_label, codename
+        in Permission.objects.values_list(
+            'id', 'content_type__app_label', 'codename'))
+
+    if user_ids is None:
+        user_ids = user_model.objects.values_list('id', flat=True).iterator()
+
+    for user in user_model.objects.filter(pk__in=list(user_ids)):
+
+        expected = compute_user_grants(user)
+        existing = get_user_grants(user.id)
+
+        for grant in expected - set(existing):
+            yield (user.id, 'missing', grant)
+
+        for grant in set(existing) - expected:
+            yield (user.id, 'stale', grant)
+
+        for grant in expected:
+            perm_id, ctype_id, instance_id, global_role = grant
+            obj = None
+
+            if ctype_id:
+                try:
+                    obj = ContentType.objects.get_for_id(
+                        ctype_id).get_object_for_this_type(pk=instance_id)
+                except Exception:
+                    continue
+
+            if not backend._check_all_permissions(user, labels[perm_id],
+                                                  obj=obj):
+                yield (user.id, 'denied', grant)
+
+
+def get_assignee_user_ids(assignee_ct_id, assignee_id):
+
+    """ Return the ids of the users affected by a change in the
+    assignments of the given assignee. """
+
+    if assignee_ct_id == ctcache.get_user_ct_id():
+        return [assignee_id]
+
+    if assignee_ct_id == ctcache.get_group_ct_id():
+        return get_group_user_ids([assignee_id])
+
+    return []
+
+
+def get_group_user_ids(group_ids):
+
+    if uses_group_closure():
+        from djinn_auth.groupclosure import get_member_ids
+
+        return list(get_member_ids(group_ids))
+
+    return list(get_user_model().objects.filter(
+        groups__in=group_ids).values_list('id', flat=True))
+
+
+def get_role_user_ids(role_ids):
+
+    """ Return the ids of the users that have any of the roles, globally
+    or locally """
+
+    user_ids = set()
+
+    for model in [GlobalRole, LocalRole]:
+        for assignee_ct_id, assignee_id in model.objects.filter(
+                role__in=role_ids).values_list(
+                    'assignee_ct_id', 'assignee_id').distinct():
+            user_ids.update(get_assignee_user_ids(assignee_ct_id,
+                                                  assignee_id))
+
+    return user_ids
+
+
+def assignment_changed(sender, instance, **kwargs):
+
+    """ Handler for saving or deleting role assignments and local
+    permissions """
+
+    if not is_enabled():
+        return
+
+    assignees = [(instance.assignee_ct_id, instance.assignee_id)]
+
+    if isinstance(instance, GlobalRole):
+        refresh_scope(assignees)
+    else:
+        refresh_scope(assignees, [(instance.instance_ct_id,
+                                   instance.instance_id)])
+
+
+def roles_changed(sender, assignees, instances, **kwargs):
+
+    """ Handler for bulk role (un)assignments """
+
+    if is_enabled():
+        refresh_scope(assignees, instances)
+
+
+def group_pre_delete(sender, instance, **kwargs):
+
+    """Handler for deleting groups. The delete removes the memberships
+    without m2m_changed signals, so the members are determined before
+    the delete.
+
+    """
+
+    if is_enabled():
+        instance._djinn_auth_member_ids = get_group_user_ids([instance.pk])
+
+
+def group_deleted(sender, instance, **kwargs):
+
+    """ Handler for deleting groups. The members lose its grants. """
+
+    if is_enabled():
+        refresh_users(getattr(instance, "_djinn_auth_member_ids", []))
+
+
+def _get_m2m_user_ids(sender, instance, reverse, pk_set):
+
+    """Find the users affected by a change in one of the many to many
+    relations that grant permissions. For a clear, pk_set is None and
+    the related objects have to be found from the instance.
+
+    """
+
+    user_model = get_user_model()
+
+    if sender is user_model.groups.through:
+        if not reverse:
+            return [instance.pk]
+        if pk_set is None:
+            return get_group_user_ids([instance.pk])
+        return pk_set
+
+    if sender is DjinnGroup.users.through:
+        if reverse:
+            return [instance.pk]
+        if pk_set is None:
+            return list(instance.users.values_list('id', flat=True))
+        return pk_set
+
+    if sender is user_model.user_permissions.through:
+        if not reverse:
+            return [instance.pk]
+        if pk_set is None:
+            return list(user_model.objects.filter(
+                user_permissions=instance).values_list('id', flat=True))
+        return pk_set
+
+    # Only the permissions of the kind of group the users' groups are
+    # taken from count
+    #
+    if sender is get_group_permission_model():
+        if not reverse:
+            return get_group_user_ids([instance.pk])
+        if pk_set is None:
+            pk_set = sender.objects.filter(
+                permission_id=instance.pk).values_list('group_id', flat=True)
+        return get_group_user_ids(list(pk_set))
+
+    if sender is Role.permissions.through:
+        if not reverse:
+            return get_role_user_ids([instance.pk])
+        if pk_set is None:
+            pk_set = Role.objects.filter(
+                permissions=instance).values_list('id', flat=True)
+        return get_role_user_ids(list(pk_set))
+
+    return []
+
+
+def m2m_changed(sender, instance, action, reverse, pk_set, **kwargs):
+
+    """Handler for changes in group membership and (role) permissions.
+    The users affected by a clear are determined before the clear, and
+    refreshed afterwards.
+
+    """
+
+    if not is_enabled():
+        return
+
+    if action == "pre_clear":
+        instance._djinn_auth_cleared_user_ids = _get_m2m_user_ids(
+            sender, instance, reverse, None)
+    elif action == "post_clear":
+        refresh_users(getattr(instance, "_djinn_auth_cleared_user_ids", []))
+    elif action in ["post_add", "post_remove"]:
+        refresh_users(_get_m2m_user_ids(sender, instance, reverse, pk_set))
@@ -0,0 +1,45 @@
+import logging
+from django.conf import settings
+from djinn_auth import instrument
+
+
+LOGGER = logging.getLogger("djinn_auth")
+
+
+class PermissionCheckMiddleware(object):
+
+    """Summarise the permission checks of each request. Requires
+    DJINN_AUTH_INSTRUMENT. The summary is logged at debug level and, when
+    DEBUG is on, added to the response as the X-Djinn-Auth-Checks
+    header.
+
+    """
+
+    def __init__(self, get_response):
+
+        self.get_response = get_response
+
+    def __call__(self, request):
+
+        if not instrument.is_enabled():
+            return self.get_response(request)
+
+        token = instrument.start_request()
+
+        try:
+            response = self.get_response(request)
+        finally:
+            summary = instrument.summarize(instrument.end_request(token))
+
+        LOGGER.debug("%s %s: %d permission checks, %d granted, "
+                     "%d queries, %.1fms, sources %s",
+                     request.method, request.path, summary['checks'],
+                     summary['granted'], summary['queries'],
+                     summary['elapsed_ms'], summary['sources'])
+
+        if settings.DEBUG:
+            response["X-Djinn-Auth-Checks"] = (
+                "checks=%(checks)d granted=%(granted)d queries=%(queries)d "
+                "ms=%(elapsed_ms).1f" % summary)
+
+        return response
@@ -0,0 +1,51 @@
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicates(apps, schema_editor):
+
+    """ Remove duplicate role assignments, so the unique constraints can
+    be added. The oldest assignment is kept. """
+
+    for model_name, fields in [
+            ('GlobalRole', ['assignee_ct', 'assignee_id', 'role']),
+            ('LocalRole', ['instance_ct', 'instance_id', 'assignee_ct',
+                           'assignee_id', 'role'])]:
+
+        model = apps.get_model('djinn_auth', model_name)
+
+        duplicates = model.objects.values(*fields).order_by().annotate(
+            keep_id=Min('id'), count=Count('id')).filter(count__gt=1)
+
+        for duplicate in duplicates:
+            keep_id = duplicate.pop('keep_id')
+            duplicate.pop('count')
+
+            model.objects.filter(**duplicate).exclude(id=keep_id).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('djinn_auth', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='globalrole',
+            unique_together={('assignee_ct', 'assignee_id', 'role')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='localrole',
+            unique_together={('instance_ct', 'instance_id', 'assignee_ct',
+                              'assignee_id', 'role')},
+        ),
+        migrations.AddIndex(
+            model_name='localrole',
+            index=models.Index(
+                fields=['assignee_ct', 'assignee_id', 'instance_ct'],
+                name='djinn_auth_lr_assignee_idx'),
+        ),
+    ]
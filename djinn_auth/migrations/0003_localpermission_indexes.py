@@ -0,0 +1,45 @@
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicates(apps, schema_editor):
+
+    """ Remove duplicate local permissions, so the unique constraint can
+    be added. The oldest one is kept. """
+
+    model = apps.get_model('djinn_auth', 'LocalPermission')
+    fields = ['instance_ct', 'instance_id', 'assignee_ct', 'assignee_id',
+              'permission']
+
+    duplicates = model.objects.values(*fields).order_by().annotate(
+        keep_id=Min('id'), count=Count('id')).filter(count__gt=1)
+
+    for duplicate in duplicates:
+        keep_id = duplicate.pop('keep_id')
+        duplicate.pop('count')
+
+        model.objects.filter(**duplicate).exclude(id=keep_id).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0009_alter_user_last_name_max_length'),
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('djinn_auth', '0002_role_assignment_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='localpermission',
+            unique_together={('instance_ct', 'instance_id', 'assignee_ct',
+                              'assignee_id', 'permission')},
+        ),
+        migrations.AddIndex(
+            model_name='localpermission',
+            index=models.Index(
+                fields=['assignee_ct', 'assignee_id', 'instance_ct'],
+                name='djinn_auth_lp_assignee_idx'),
+        ),
+    ]
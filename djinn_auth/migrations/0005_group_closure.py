@@ -0,0 +1,43 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def add_groups(apps, schema_editor):
+
+    """ Every existing group is its own ancestor. There is no nesting
+    yet. """
+
+    Group = apps.get_model('djinn_auth', 'Group')
+    GroupClosure = apps.get_model('djinn_auth', 'GroupClosure')
+
+    GroupClosure.objects.bulk_create(
+        [GroupClosure(ancestor_id=pk, descendant_id=pk)
+         for pk in Group.objects.values_list('id', flat=True)],
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djinn_auth', '0004_effectivepermission'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='group',
+            name='subgroups',
+            field=models.ManyToManyField(blank=True, related_name='parents', to='djinn_auth.Group'),
+        ),
+        migrations.CreateModel(
+            name='GroupClosure',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='djinn_auth.group')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='djinn_auth.group')),
+            ],
+            options={
+                'unique_together': {('descendant', 'ancestor')},
+            },
+        ),
+        migrations.RunPython(add_groups, migrations.RunPython.noop),
+    ]
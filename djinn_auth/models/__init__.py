@@ -3,3 +3,5 @@ from .localrole import LocalRole
 from .globalrole import GlobalRole
 from .localpermission import LocalPermission
 from .group import Group
+from .effectivepermission import EffectivePermission
+from .groupclosure import GroupClosure
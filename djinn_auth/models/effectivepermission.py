@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.db import models
+from django.contrib.auth.models import Permission
+from django.contrib.contenttypes.models import ContentType
+
+
+class EffectivePermission(models.Model):
+
+    """Materialised grant of a permission to a user, either globally (no
+    instance) or on a specific model instance. The rows are derived from
+    the user's permissions, groups, global roles, local roles and local
+    permissions, and maintained by djinn_auth.materialize when the
+    DJINN_AUTH_MATERIALIZE setting is True.
+
+    """
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='+',
+                             on_delete=models.CASCADE)
+    permission = models.ForeignKey(Permission, related_name='+',
+                                   on_delete=models.CASCADE)
+
+    instance_ct = models.ForeignKey(ContentType, related_name='+', null=True,
+                                    on_delete=models.CASCADE)
+    instance_id = models.PositiveIntegerField(null=True)
+
+    # Global grants through a global role are not acquired by instances
+    # that have acquire_global_roles set to False.
+    #
+    global_role = models.BooleanField(default=False)
+
+    class Meta:
+
+        app_label = "djinn_auth"
+
+        unique_together = (
+            ('user', 'permission', 'instance_ct', 'instance_id',
+             'global_role'),
+        )
+
+    def __unicode__(self):
+
+        return u"%s has %s on %s" % (self.user_id, self.permission_id,
+                                     self.instance_id or "all")
+
+    __str__ = __unicode__
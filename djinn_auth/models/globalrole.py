@@ -12,3 +12,7 @@ class GlobalRole(RoleAssignment):
     class Meta:
 
         app_label = "djinn_auth"
+
+        # Lookups are always by assignee, which the unique index serves
+        #
+        unique_together = (('assignee_ct', 'assignee_id', 'role'),)
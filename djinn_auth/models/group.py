@@ -11,7 +11,8 @@ class Group(PolymorphicModel):
 
     """Abstract group base. The polymorphism enables you to extend this
     class in several ways, but find all kinds with the Group.objects
-    manager
+    manager. Groups can be nested: the members of subgroups are members
+    of the group as well.
 
     """
 
@@ -24,6 +25,11 @@ class Group(PolymorphicModel):
         Permission,
         related_name='groups',
         blank=True)
+    subgroups = models.ManyToManyField(
+        'self',
+        symmetrical=False,
+        related_name='parents',
+        blank=True)
 
     @property
     def ct_name(self):
@@ -0,0 +1,28 @@
+from django.db import models
+
+
+class GroupClosure(models.Model):
+
+    """Transitive closure of group nesting: a row for every group and each
+    of its ancestors, and one for the group itself. Members of the
+    descendant are members of the ancestor. The table is maintained by
+    djinn_auth.groupclosure.
+
+    """
+
+    ancestor = models.ForeignKey("djinn_auth.Group", related_name='+',
+                                 on_delete=models.CASCADE)
+    descendant = models.ForeignKey("djinn_auth.Group", related_name='+',
+                                   on_delete=models.CASCADE)
+
+    class Meta:
+
+        app_label = "djinn_auth"
+
+        unique_together = (('descendant', 'ancestor'),)
+
+    def __unicode__(self):
+
+        return u"%s in %s" % (self.descendant_id, self.ancestor_id)
+
+    __str__ = __unicode__
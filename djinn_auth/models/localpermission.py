@@ -29,9 +29,20 @@ class LocalPermission(models.Model):
 
         app_label = "djinn_auth"
 
+        # Same lookup paths as LocalRole
+        #
+        unique_together = (
+            ('instance_ct', 'instance_id', 'assignee_ct', 'assignee_id',
+             'permission'),
+        )
+        indexes = [
+            models.Index(fields=['assignee_ct', 'assignee_id', 'instance_ct'],
+                         name='djinn_auth_lp_assignee_idx'),
+        ]
+
     def __unicode__(self):
 
         return u"%s has %s for %s" % (self.assignee, self.permission,
-                                      self.content)
+                                      self.instance)
 
     __str__ = __unicode__
@@ -22,6 +22,18 @@ class LocalRole(RoleAssignment):
 
         app_label = "djinn_auth"
 
+        # Lookups are always by instance and assignee, or by assignee
+        # and instance type. The unique index serves the first.
+        #
+        unique_together = (
+            ('instance_ct', 'instance_id', 'assignee_ct', 'assignee_id',
+             'role'),
+        )
+        indexes = [
+            models.Index(fields=['assignee_ct', 'assignee_id', 'instance_ct'],
+                         name='djinn_auth_lr_assignee_idx'),
+        ]
+
     def __unicode__(self):
 
         return u"%s is %s for %s" % (self.assignee, self.role, self.instance)
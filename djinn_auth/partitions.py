@@ -0,0 +1,265 @@
+""" Optional partitioned storage of local roles. On PostgreSQL, the
+local role table can be turned into a partitioned table, so vacuum and
+index maintenance work on parts of manageable size. The partition key is
+set with DJINN_AUTH_LOCALROLE_PARTITION_KEY:
+
+  'instance_ct' partitions by list of instance content type, with a
+  partition per content type in use at the time of partitioning and a
+  default partition for the others;
+
+  'instance_id' partitions by hash of the instance id, in
+  DJINN_AUTH_LOCALROLE_PARTITIONS (default 16) partitions.
+
+The ORM keeps using the parent table; the database routes rows and
+queries to the partitions, as long as queries filter on the partition
+key. The lookups in utils always filter on the instance content type
+and id, grouped with instances_filter. Lookups by assignee only, like
+iter_user_local_instances, visit all partitions.
+
+Other databases, like SQLite in tests, keep the single table. The
+djinn_auth_partition_localroles command migrates an existing table
+either way.
+
+"""
+
+from django.conf import settings
+from django.db.models import Q
+
+
+INSTANCE_CT = "instance_ct"
+INSTANCE_ID = "instance_id"
+
+# Partition key to (partition method, column)
+#
+KEYS = {
+    INSTANCE_CT: ("LIST", "instance_ct_id"),
+    INSTANCE_ID: ("HASH", "instance_id"),
+}
+
+UNPARTITIONED = "%s_unpartitioned"
+
+
+class PartitionError(Exception):
+
+    """ Raised when the local role table can't be (un)partitioned """
+
+
+def get_partition_key():
+
+    return getattr(settings, 'DJINN_AUTH_LOCALROLE_PARTITION_KEY', None)
+
+
+def get_partition_count():
+
+    return getattr(settings, 'DJINN_AUTH_LOCALROLE_PARTITIONS', 16)
+
+
+def instances_filter(instances):
+
+    """Return a filter on the rows of the given (content type id,
+    instance id) tuples. Ids are grouped per content type, so every
+    condition holds both partition keys.
+
+    """
+
+    _filter = Q()
+
+    for ctype_id in sorted(set(ctype_id for ctype_id, instance_id
+                               in instances)):
+        _filter |= Q(
+            instance_ct_id=ctype_id,
+            instance_id__in=sorted(set(
+                instance_id for _ctype_id, instance_id in instances
+                if _ctype_id == ctype_id)))
+
+    return _filter
+
+
+def is_supported(connection):
+
+    """ Declarative partitioning with primary and foreign keys needs
+    PostgreSQL 11 or later """
+
+    return (connection.vendor == "postgresql" and
+            connection.pg_version >= 110000)
+
+
+def is_partitioned(connection, table):
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table "
+                       "WHERE partrelid = %s::regclass", [table])
+
+        return cursor.fetchone() is not None
+
+
+def get_partition_sql(connection, table, key, count=None, ctype_ids=()):
+
+    """Return the partitioning clause for the parent table, and the
+    statements that create the partitions.
+
+    """
+
+    qn = connection.ops.quote_name
+
+    try:
+        method, column = KEYS[key]
+    except KeyError:
+        raise PartitionError("Unknown partition key %r, use one of %s" % (
+            key, ", ".join(sorted(KEYS))))
+
+    clause = "PARTITION BY %s (%s)" % (method, qn(column))
+    statements = []
+
+    if key == INSTANCE_CT:
+        for ctype_id in sorted(ctype_ids):
+            statements.append(
+                "CREATE TABLE %s PARTITION OF %s FOR VALUES IN (%d)" % (
+                    qn("%s_ct%d" % (table, ctype_id)), qn(table), ctype_id))
+
+        statements.append("CREATE TABLE %s PARTITION OF %s DEFAULT" % (
+            qn("%s_default" % table), qn(table)))
+    else:
+        count = count or get_partition_count()
+
+        for remainder in range(count):
+            statements.append(
+                "CREATE TABLE %s PARTITION OF %s FOR VALUES WITH "
+                "(MODULUS %d, REMAINDER %d)" % (
+                    qn("%s_p%d" % (table, remainder)), qn(table), count,
+                    remainder))
+
+    return clause, statements
+
+
+def get_constraint_sql(connection, table, constraints, pk_columns):
+
+    """Return the statements that recreate the constraints and indexes,
+    as introspected from the original table, on the new table. The
+    primary key is made up of pk_columns, since on a partitioned table
+    it must hold the partition key. Names are kept, so migrations still
+    find them.
+
+    """
+
+    qn = connection.ops.quote_name
+    statements = []
+
+    def columns(names):
+        return ", ".join(qn(name) for name in names)
+
+    for name, constraint in sorted(constraints.items()):
+        if constraint['primary_key']:
+            statements.append("ALTER TABLE %s ADD CONSTRAINT %s "
+                              "PRIMARY KEY (%s)" % (
+                                  qn(table), qn(name), columns(pk_columns)))
+        elif constraint['foreign_key']:
+            statements.append(
+                "ALTER TABLE %s ADD CONSTRAINT %s FOREIGN KEY (%s) "
+                "REFERENCES %s (%s) DEFERRABLE INITIALLY DEFERRED" % (
+                    qn(table), qn(name), columns(constraint['columns']),
+                    qn(constraint['foreign_key'][0]),
+                    qn(constraint['foreign_key'][1])))
+        elif constraint['unique']:
+            statements.append("ALTER TABLE %s ADD CONSTRAINT %s "
+                              "UNIQUE (%s)" % (
+                                  qn(table), qn(name),
+                                  columns(constraint['columns'])))
+        elif constraint['index']:
+            statements.append("CREATE INDEX %s ON %s (%s)" % (
+                qn(name), qn(table), columns(constraint['columns'])))
+
+    return statements
+
+
+def get_migration_sql(connection, table, key=None, count=None):
+
+    """Return the statements that move the rows of the local role table
+    into a new table, partitioned by key, or into a single table if key
+    is None. The statements copy the rows in one go, so run them in a
+    transaction.
+
+    """
+
+    qn = connection.ops.quote_name
+    old = UNPARTITIONED % table
+
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, table)
+
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id'), "
+                       "attidentity FROM pg_attribute WHERE "
+                       "attrelid = %s::regclass AND attname = 'id'",
+                       [table, table])
+        sequence, identity = cursor.fetchone()
+
+        ctype_ids = []
+
+        if key == INSTANCE_CT:
+            cursor.execute("SELECT DISTINCT instance_ct_id FROM %s" %
+                           qn(table))
+            ctype_ids = [row[0] for row in cursor.fetchall()]
+
+    statements = [
+        "ALTER TABLE %s RENAME TO %s" % (qn(table), qn(old)),
+    ]
+
+    create = ("CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS "
+              "INCLUDING CONSTRAINTS INCLUDING IDENTITY)" % (
+                  qn(table), qn(old)))
+
+    if key:
+        clause, partitions = get_partition_sql(connection, table, key,
+                                               count=count,
+                                               ctype_ids=ctype_ids)
+        statements.append("%s %s" % (create, clause))
+        statements.extend(partitions)
+        pk_columns = ["id", KEYS[key][1]]
+    else:
+        statements.append(create)
+        pk_columns = ["id"]
+
+    statements.append("INSERT INTO %s SELECT * FROM %s" % (qn(table),
+                                                           qn(old)))
+
+    # A serial id keeps its sequence, an identity gets a new one
+    #
+    if identity:
+        statements.append(
+            "SELECT setval(pg_get_serial_sequence('%s', 'id'), "
+            "COALESCE(MAX(id), 0) + 1, false) FROM %s" % (table, qn(table)))
+    elif sequence:
+        statements.append("ALTER SEQUENCE %s OWNED BY %s.%s" % (
+            sequence, qn(table), qn("id")))
+
+    statements.append("DROP TABLE %s" % qn(old))
+    statements.extend(get_constraint_sql(connection, table, constraints,
+                                         pk_columns))
+
+    return statements
+
+
+def migrate(connection, table, key=None, count=None, dry_run=False):
+
+    """Partition the local role table by key, or turn it back into a
+    single table if key is None. Return the statements, that are only
+    executed if dry_run is False.
+
+    """
+
+    if not is_supported(connection):
+        raise PartitionError("Partitioned storage of local roles requires "
+                             "PostgreSQL 11 or later")
+
+    if bool(key) == is_partitioned(connection, table):
+        raise PartitionError("The local role table is already %s" % (
+            "partitioned" if key else "a single table"))
+
+    statements = get_migration_sql(connection, table, key=key, count=count)
+
+    if not dry_run:
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+
+    return statements
@@ -0,0 +1,331 @@
+""" In memory index of permissions, by their 'app_label.codename' names,
+to permission and role ids. The index is loaded lazily, once per
+process, and reloaded whenever roles or permissions change. To have all
+processes pick up changes, the index has a version that is kept in the
+Django cache; a process that finds its own version differs from the
+shared one will reload. The shared version is read at most once every
+DJINN_AUTH_INDEX_CHECK_INTERVAL seconds (default 1), so changes made by
+other processes take up to that long to show.
+
+Changes made in a transaction are only published when it commits: until
+then, the thread making them uses an index of its own, that is dropped
+if the transaction rolls back.
+
+"""
+
+import threading
+import time
+from django.conf import settings
+from django.contrib.auth.models import Permission
+from django.core.cache import caches
+from djinn_auth.commit import PendingHooks
+
+
+VERSION_KEY = "djinn_auth:permindex:version"
+
+CHECK_INTERVAL = 1
+
+EMPTY = frozenset()
+
+
+def get_cache():
+
+    return caches[getattr(settings, 'DJINN_AUTH_CACHE', 'default')]
+
+
+def get_check_interval():
+
+    return getattr(settings, 'DJINN_AUTH_INDEX_CHECK_INTERVAL',
+                   CHECK_INTERVAL)
+
+
+class IndexData(object):
+
+    """ The index as loaded for one version. The permissions and the
+    roles are loaded when first needed. """
+
+    def __init__(self, version):
+
+        self.version = version
+
+        # When the version was last found to be the shared one
+        #
+        self.checked = time.monotonic()
+
+        # None until the permissions are loaded
+        #
+        self.index = None
+        self.role_permissions = {}
+        self.labels = {}
+        self.bits = {}
+        self.masks = {}
+        self.role_masks = {}
+        self.permissions = {}
+
+        # Roles by name, loaded by the role cache
+        #
+        self.roles = None
+
+
+class PermissionIndex(object):
+
+    """Map 'app_label.codename' permission names onto the ids of the
+    permissions, and the ids of the roles holding these permissions.
+    Also map roles onto the ids of their permissions, and permission ids
+    onto their names. Since all permissions are indexed, unknown names
+    cost no more than a dictionary lookup.
+
+    For the bitset engine, every permission also gets a bit, and every
+    role a mask of the bits of its permissions. Bits are assigned anew
+    on every load, so masks are only valid for the version they were
+    made with.
+
+    """
+
+    def __init__(self):
+
+        self._data = None
+        self._local = threading.local()
+        self._pending = PendingHooks()
+        self._lock = threading.Lock()
+
+    @property
+    def version(self):
+
+        return self.get_data().version
+
+    def get_shared_version(self):
+
+        """ Get the version from the shared cache, initializing it if need
+        be."""
+
+        cache = get_cache()
+        version = cache.get(VERSION_KEY)
+
+        if version is None:
+            cache.add(VERSION_KEY, 1, None)
+            version = cache.get(VERSION_KEY, 1)
+
+        return version
+
+    def load(self, data):
+
+        """ Load the permissions of the index data from the database """
+
+        from djinn_auth.models import Role
+
+        index = {}
+        perm_ids = {}
+        role_ids = {}
+        role_permissions = {}
+
+        for pk, app_label, codename in Permission.objects.values_list(
+                'id', 'content_type__app_label', 'codename'):
+            label = "%s.%s" % (app_label, codename)
+            perm_ids.setdefault(label, set()).add(pk)
+            data.labels[pk] = label
+            data.bits[pk] = 1 << len(data.bits)
+
+        for perm_id, role_id in Role.permissions.through.objects.values_list(
+                'permission_id', 'role_id'):
+            role_ids.setdefault(perm_id, set()).add(role_id)
+            role_permissions.setdefault(role_id, set()).add(perm_id)
+
+        for label, pks in perm_ids.items():
+            index[label] = (
+                frozenset(pks),
+                frozenset(role_id for pk in pks
+                          for role_id in role_ids.get(pk, EMPTY)))
+            data.masks[label] = self._make_mask(data.bits, pks)
+
+        for role_id, pks in role_permissions.items():
+            data.role_permissions[role_id] = frozenset(pks)
+            data.role_masks[role_id] = self._make_mask(data.bits, pks)
+
+        data.index = index
+
+        return data
+
+    def _check(self, data):
+
+        """Return data if its version is still the shared one, or new
+        data otherwise. The shared version is not read again within the
+        check interval.
+
+        """
+
+        if data is not None and \
+                time.monotonic() < data.checked + get_check_interval():
+            return data
+
+        version = self.get_shared_version()
+
+        if data is None or data.version != version:
+            return IndexData(version)
+
+        data.checked = time.monotonic()
+
+        return data
+
+    def get_data(self, load=True):
+
+        """Return the index data for the current version. Unless load is
+        False, the permissions are loaded if need be.
+
+        """
+
+        pending, rolled_back = self._pending.check()
+
+        # The thread's own index may hold changes that were rolled back
+        #
+        if rolled_back:
+            self._local.data = None
+
+        if pending:
+            data = self._local.data = self._check(
+                getattr(self._local, "data", None))
+        else:
+            data = self._data = self._check(self._data)
+
+        if load and data.index is None:
+            with self._lock:
+                if data.index is None:
+                    self.load(data)
+
+        return data
+
+    def get_index(self):
+
+        return self.get_data().index
+
+    def get_role_permission_ids(self, role_id):
+
+        """ Return the ids of the permissions of the given role """
+
+        return self.get_data().role_permissions.get(role_id, EMPTY)
+
+    @staticmethod
+    def _make_mask(bits, perm_ids):
+
+        mask = 0
+
+        for pk in perm_ids:
+            mask |= bits.get(pk, 0)
+
+        return mask
+
+    def get_mask(self, perm_ids):
+
+        """ Return the mask of the given permissions """
+
+        return self._make_mask(self.get_data().bits, perm_ids)
+
+    def get_permission_mask(self, perm):
+
+        """ Return the mask of the 'app_label.codename' permission, 0 for
+        unknown permissions """
+
+        return self.get_data().masks.get(perm, 0)
+
+    def get_roles_mask(self, role_ids):
+
+        """ Return the mask of all permissions of the given roles """
+
+        role_masks = self.get_data().role_masks
+
+        mask = 0
+
+        for role_id in role_ids:
+            mask |= role_masks.get(role_id, 0)
+
+        return mask
+
+    def get_labels(self, perm_ids):
+
+        """ Return the 'app_label.codename' labels of the permissions """
+
+        labels = self.get_data().labels
+
+        return set(labels[pk] for pk in perm_ids if pk in labels)
+
+    def lookup(self, perm):
+
+        """Return a tuple of permission ids and role ids for the given
+        'app_label.codename' permission. For unknown permissions, both
+        are empty.
+
+        """
+
+        return self.get_index().get(perm, (EMPTY, EMPTY))
+
+    def get_permission_ids(self, perm):
+
+        return self.lookup(perm)[0]
+
+    def get_role_ids(self, perm):
+
+        return self.lookup(perm)[1]
+
+    def get_permission(self, perm):
+
+        """Return the Permission object for the given 'app_label.codename'
+        permission. Permission objects are kept until the index is
+        reloaded. Raise Permission.DoesNotExist for unknown permissions,
+        and Permission.MultipleObjectsReturned if the codename is used
+        for several models of the app.
+
+        """
+
+        data = self.get_data()
+        perm_ids = data.index.get(perm, (EMPTY, EMPTY))[0]
+
+        if not perm_ids:
+            raise Permission.DoesNotExist(
+                "Permission %s does not exist" % perm)
+
+        if len(perm_ids) > 1:
+            raise Permission.MultipleObjectsReturned(
+                "Permission %s is ambiguous" % perm)
+
+        if perm not in data.permissions:
+            data.permissions[perm] = Permission.objects.get(
+                pk=list(perm_ids)[0])
+
+        return data.permissions[perm]
+
+    def invalidate(self):
+
+        """Drop the index and bump the shared version, so all processes
+        will reload. Within a transaction, this is done when it commits;
+        until then, this thread uses an index of its own.
+
+        """
+
+        self._local.data = None
+        self._pending.add(self._publish)
+
+    def _publish(self):
+
+        if not self._pending.check()[0]:
+            self._local.data = None
+
+        self._data = None
+
+        cache = get_cache()
+
+        try:
+            cache.incr(VERSION_KEY)
+        except ValueError:
+            cache.add(VERSION_KEY, 1, None)
+
+
+permission_index = PermissionIndex()
+
+
+def invalidate_on_change(sender, **kwargs):
+
+    """ Signal handler for changes in roles or permissions, and for
+    post_migrate, since permissions are created in bulk """
+
+    if kwargs.get("action", "post_").startswith("post_"):
+        permission_index.invalidate()
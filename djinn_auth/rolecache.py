@@ -0,0 +1,70 @@
+""" Process local cache of roles by name. Roles are a small and nearly
+static set, so all of them are loaded at once. They are kept with the
+permission index, that is reloaded whenever a role is saved or deleted,
+in this process or another, and dropped with it if the transaction
+making the change rolls back.
+
+"""
+
+from djinn_auth.permindex import permission_index
+
+
+class RoleCache(object):
+
+    """Map role names onto Role instances. The field values are cached,
+    and every lookup gets an instance of its own, so callers can't
+    change the cache by changing the instance.
+
+    """
+
+    def load(self):
+
+        """ Load the field values of all roles from the database """
+
+        from djinn_auth.models import Role
+
+        field_names = [field.attname for field in Role._meta.concrete_fields]
+        queryset = Role.objects.all()
+
+        return dict((values[field_names.index('name')],
+                     (queryset.db, field_names, values))
+                    for values in queryset.values_list(*field_names))
+
+    def get_roles(self):
+
+        data = permission_index.get_data(load=False)
+
+        if data.roles is None:
+            data.roles = self.load()
+
+        return data.roles
+
+    def get_role(self, name):
+
+        """ Return the Role with the given name. Raise Role.DoesNotExist if
+        there is no such role. """
+
+        from djinn_auth.models import Role
+
+        try:
+            return Role.from_db(*self.get_roles()[name])
+        except KeyError:
+            raise Role.DoesNotExist("Role %s does not exist" % name)
+
+    def get_role_id(self, name):
+
+        """ Return the id of the role with the given name, or None """
+
+        from djinn_auth.models import Role
+
+        role = self.get_roles().get(name)
+
+        if role is None:
+            return None
+
+        db, field_names, values = role
+
+        return values[field_names.index(Role._meta.pk.attname)]
+
+
+role_cache = RoleCache()
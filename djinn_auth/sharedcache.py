@@ -0,0 +1,289 @@
+""" Cache the role lookups in the Django cache, so they are shared by all
+processes. Enable with the DJINN_AUTH_SHARED_CACHE setting; the cache
+used is the one named by DJINN_AUTH_CACHE.
+
+Cache keys hold generation counters: one per user, bumped when the
+user's group membership changes, one per instance, bumped when local
+roles or permissions on the instance change, and a global one, bumped
+when global roles change. Invalidation is a matter of bumping a
+counter, and outdated entries simply expire. All keys also hold an
+epoch, bumped by invalidate_all for changes that bypass the signals,
+like imports.
+
+Within a transaction, counters are bumped when it commits. Until then,
+the thread making the change bypasses the cache, so it neither reads
+entries that miss its changes, nor stores entries that hold them.
+
+"""
+
+import collections
+import time
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from djinn_auth.commit import PendingHooks
+from djinn_auth.permindex import get_cache
+
+
+GLOBAL_GENERATION_KEY = "djinn_auth:gen:global"
+
+EPOCH_KEY = "djinn_auth:gen:epoch"
+
+STATS = collections.Counter()
+
+PENDING = PendingHooks()
+
+
+def is_enabled():
+
+    return getattr(settings, 'DJINN_AUTH_SHARED_CACHE', False)
+
+
+def get_stats():
+
+    """ Return the hit and miss counts of this process, in total and per
+    kind of lookup. """
+
+    stats = dict(STATS)
+    stats['hits'] = sum(v for k, v in STATS.items() if k.endswith(".hits"))
+    stats['misses'] = sum(v for k, v in STATS.items()
+                          if k.endswith(".misses"))
+
+    return stats
+
+
+def reset_stats():
+
+    STATS.clear()
+
+
+def user_generation_key(user_id):
+
+    return "djinn_auth:gen:user:%s" % user_id
+
+
+def instance_generation_key(ctype_id, instance_id):
+
+    return "djinn_auth:gen:instance:%s:%s" % (ctype_id, instance_id)
+
+
+def get_generations(keys):
+
+    """Return a dict of generation key to generation. Generations that
+    are missing, because they never existed or were evicted, are
+    initialized with the current time, so they never fall back on a
+    value that was used before.
+
+    """
+
+    cache = get_cache()
+    generations = cache.get_many(keys)
+
+    for key in keys:
+        if key not in generations:
+            cache.add(key, int(time.time() * 1000), None)
+            generations[key] = cache.get(key)
+
+    return generations
+
+
+def is_bypassed():
+
+    """ Tell whether this thread has bumps that wait for a commit """
+
+    return PENDING.check()[0] > 0
+
+
+def bump(*keys):
+
+    """ Increment the given generations, when the transaction commits """
+
+    if keys:
+        PENDING.add(lambda: _bump(keys))
+
+
+def _bump(keys):
+
+    cache = get_cache()
+
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, int(time.time() * 1000), None)
+
+
+def get_many(kind, keys, load):
+
+    """Get values from the cache. The keys argument is a dict of item to
+    cache key. Items that are not cached are loaded by calling load
+    with the list of missing items, that should return a dict of item to
+    value. Return a dict of item to value.
+
+    """
+
+    cache = get_cache()
+    found = cache.get_many(list(keys.values()))
+
+    result = dict((item, found[key]) for item, key in keys.items()
+                  if key in found)
+    missing = [item for item in keys if item not in result]
+
+    STATS[kind + ".hits"] += len(result)
+    STATS[kind + ".misses"] += len(missing)
+
+    if missing:
+        loaded = load(missing)
+
+        cache.set_many(dict((keys[item], value)
+                            for item, value in loaded.items()))
+        result.update(loaded)
+
+    return result
+
+
+def get_user_group_ids(user, load):
+
+    """ Get the user's group ids from the cache """
+
+    if is_bypassed():
+        return load()
+
+    user_key = user_generation_key(user.id)
+    generations = get_generations([EPOCH_KEY, user_key])
+
+    return get_many(
+        "groups", {user: "djinn_auth:groups:%s:%s:%s" % (
+            generations[EPOCH_KEY], user.id, generations[user_key])},
+        lambda users: {user: load()})[user]
+
+
+def get_user_global_role_ids(user, load):
+
+    """ Get the user's global role ids from the cache """
+
+    if is_bypassed():
+        return load()
+
+    user_key = user_generation_key(user.id)
+    generations = get_generations([EPOCH_KEY, user_key,
+                                   GLOBAL_GENERATION_KEY])
+
+    return get_many(
+        "global", {user: "djinn_auth:global:%s:%s:%s:%s" % (
+            generations[EPOCH_KEY], user.id, generations[user_key],
+            generations[GLOBAL_GENERATION_KEY])},
+        lambda users: {user: load()})[user]
+
+
+def get_user_local_grants(user, instances, load):
+
+    """Get the user's local grants on the instances from the cache. The
+    instances argument is a list of (content type id, instance id)
+    tuples. Return a dict of such tuples to the grants.
+
+    """
+
+    if is_bypassed():
+        return load(instances)
+
+    user_key = user_generation_key(user.id)
+    generations = get_generations(
+        [EPOCH_KEY, user_key] + [instance_generation_key(*instance)
+                                 for instance in instances])
+
+    return get_many(
+        "local", dict(
+            (instance, "djinn_auth:local:%s:%s:%s:%s:%s:%s" % (
+                generations[EPOCH_KEY], user.id, generations[user_key],
+                instance[0], instance[1],
+                generations[instance_generation_key(*instance)]))
+            for instance in instances),
+        load)
+
+
+def invalidate_all():
+
+    """ Invalidate all entries, by bumping the epoch """
+
+    bump(EPOCH_KEY)
+
+
+def local_assignment_changed(sender, instance, **kwargs):
+
+    """ Handler for changes in local roles and permissions """
+
+    if is_enabled():
+        bump(instance_generation_key(instance.instance_ct_id,
+                                     instance.instance_id))
+
+
+def global_assignment_changed(sender, instance, **kwargs):
+
+    """ Handler for changes in global roles """
+
+    if is_enabled():
+        bump(GLOBAL_GENERATION_KEY)
+
+
+def membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+
+    """Handler for changes in group membership, either through
+    user.groups or through the users of djinn_auth groups. When a
+    group's members are cleared, the members are determined before the
+    clear.
+
+    """
+
+    if not is_enabled():
+        return
+
+    if isinstance(instance, get_user_model()):
+        user_ids = [instance.pk]
+    elif action == "pre_clear":
+        instance._djinn_auth_cleared_user_ids = list(
+            sender.objects.filter(group_id=instance.pk).values_list(
+                'user_id', flat=True))
+        return
+    elif action == "post_clear":
+        user_ids = getattr(instance, "_djinn_auth_cleared_user_ids", [])
+    else:
+        user_ids = pk_set or []
+
+    if action.startswith("post_"):
+        bump(*[user_generation_key(user_id) for user_id in user_ids])
+
+
+def group_pre_delete(sender, instance, **kwargs):
+
+    """Handler for deleting groups. The delete removes the memberships
+    without m2m_changed signals, so the members are determined before
+    the delete.
+
+    """
+
+    if is_enabled():
+        instance._djinn_auth_member_ids = list(
+            get_user_model().objects.filter(groups=instance).values_list(
+                'id', flat=True))
+
+
+def group_deleted(sender, instance, **kwargs):
+
+    """ Handler for deleting groups. The members lose its roles. """
+
+    if is_enabled():
+        bump(*[user_generation_key(user_id) for user_id
+               in getattr(instance, "_djinn_auth_member_ids", [])])
+
+
+def roles_changed(sender, assignees, instances, **kwargs):
+
+    """ Handler for bulk role (un)assignments """
+
+    if not is_enabled():
+        return
+
+    if instances is None:
+        bump(GLOBAL_GENERATION_KEY)
+    else:
+        bump(*[instance_generation_key(*instance) for instance in instances])
@@ -0,0 +1,19 @@
+from django.dispatch import Signal
+
+
+# Sent once after a bulk (un)assignment of roles, instead of a signal per
+# row. The sender is the assignment model, LocalRole or GlobalRole.
+# Arguments: assignees, a list of (content type id, id) tuples, and
+# instances, a list of (content type id, id) tuples for local roles, or
+# None for global roles.
+#
+roles_changed = Signal()
+
+
+# Sent after the backend resolved a permission check, when the
+# DJINN_AUTH_INSTRUMENT setting is enabled. The sender is the backend
+# class. Arguments: user, permission, obj, result, source (what decided
+# the check, see djinn_auth.instrument), queries (the number of queries
+# done) and elapsed (in seconds).
+#
+permission_checked = Signal()
@@ -0,0 +1,346 @@
+""" Export and import of the role state: roles, global roles, local roles
+and local permissions, in a compact columnar format.
+
+A snapshot starts with MAGIC, followed by frames. Each frame is a tag
+and a length, packed as FRAME, followed by that many bytes of zlib
+compressed payload. The META frame holds JSON with the content types,
+permissions and roles that the rows refer to, by natural key, so a
+snapshot can be loaded in a database where their ids differ. The other
+frames hold up to CHUNK_SIZE rows of one model, as a row count followed
+by a packed array per column: indexes into the META lists as unsigned
+shorts, ids as unsigned ints, all little endian. The END frame closes
+the snapshot.
+
+Instance and assignee ids are taken as is. Rows referring to content
+types or permissions that don't exist in the database loading the
+snapshot are skipped.
+
+"""
+
+import array
+import json
+import logging
+import struct
+import sys
+import zlib
+from django.contrib.auth.models import Permission
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from djinn_auth import sharedcache
+from djinn_auth.cache import invalidate_permission_cache
+from djinn_auth.models import Role, GlobalRole, LocalRole, LocalPermission
+
+
+LOGGER = logging.getLogger("djinn_auth")
+
+MAGIC = b"DJINNAUTH\x01"
+
+FRAME = struct.Struct("<4sI")
+COUNT = struct.Struct("<I")
+
+CHUNK_SIZE = 100000
+
+SHORT = "H"
+
+# Most items in a META list, as their indexes are packed as SHORT
+#
+MAX_ITEMS = 1 << 16
+INT = [code for code in "IL" if array.array(code).itemsize == 4][0]
+
+# Tag, model and columns of the row frames. Columns are (field, kind),
+# where kind is 'ct', 'role' or 'perm' for references to the META
+# lists, or 'id' for plain ids.
+#
+TABLES = [
+    (b"GROL", GlobalRole, [('assignee_ct_id', 'ct'), ('assignee_id', 'id'),
+                           ('role_id', 'role')]),
+    (b"LROL", LocalRole, [('instance_ct_id', 'ct'), ('instance_id', 'id'),
+                          ('assignee_ct_id', 'ct'), ('assignee_id', 'id'),
+                          ('role_id', 'role')]),
+    (b"LPRM", LocalPermission, [('instance_ct_id', 'ct'),
+                                ('instance_id', 'id'),
+                                ('assignee_ct_id', 'ct'),
+                                ('assignee_id', 'id'),
+                                ('permission_id', 'perm')]),
+]
+
+
+class SnapshotError(Exception):
+
+    """ Raised for files that are not valid snapshots """
+
+
+def write_frame(output, tag, payload):
+
+    payload = zlib.compress(payload)
+
+    output.write(FRAME.pack(tag, len(payload)))
+    output.write(payload)
+
+
+def read_frames(infile):
+
+    """ Yield (tag, payload) for all frames, up to END """
+
+    if infile.read(len(MAGIC)) != MAGIC:
+        raise SnapshotError("Not a djinn_auth snapshot")
+
+    while True:
+        header = infile.read(FRAME.size)
+
+        if len(header) < FRAME.size:
+            raise SnapshotError("Snapshot is truncated")
+
+        tag, length = FRAME.unpack(header)
+
+        if tag == b"END ":
+            return
+
+        payload = infile.read(length)
+
+        if len(payload) < length:
+            raise SnapshotError("Snapshot is truncated")
+
+        try:
+            payload = zlib.decompress(payload)
+        except zlib.error:
+            raise SnapshotError("Snapshot is corrupt")
+
+        yield tag, payload
+
+
+def pack_columns(columns, kinds):
+
+    """ Pack the columns into a payload """
+
+    payload = [COUNT.pack(len(columns[0]))]
+
+    for column, kind in zip(columns, kinds):
+        packed = array.array(INT if kind == 'id' else SHORT, column)
+
+        if sys.byteorder == "big":
+            packed.byteswap()
+
+        payload.append(packed.tobytes())
+
+    return b"".join(payload)
+
+
+def unpack_columns(payload, kinds):
+
+    """ Unpack a payload into columns """
+
+    count = COUNT.unpack_from(payload)[0]
+    offset = COUNT.size
+    columns = []
+
+    for kind in kinds:
+        column = array.array(INT if kind == 'id' else SHORT)
+        size = column.itemsize * count
+
+        column.frombytes(payload[offset:offset + size])
+        offset += size
+
+        if sys.byteorder == "big":
+            column.byteswap()
+
+        columns.append(column)
+
+    return columns
+
+
+def export_snapshot(output, chunk_size=CHUNK_SIZE):
+
+    """Write a snapshot of the role state to the binary file object
+    output. Rows are read and written in chunks. Return a dict of model
+    name to number of rows written.
+
+    """
+
+    ctypes = list(ContentType.objects.order_by('id'))
+    perms = list(Permission.objects.select_related(
+        'content_type').order_by('id'))
+    roles = list(Role.objects.order_by('id'))
+
+    for name, items in [('content types', ctypes), ('permissions', perms),
+                        ('roles', roles)]:
+        if len(items) > MAX_ITEMS:
+            raise SnapshotError("Too many %s for a snapshot: %d" % (
+                name, len(items)))
+
+    role_perms = {}
+
+    for role_id, perm_id in Role.permissions.through.objects.values_list(
+            'role_id', 'permission_id'):
+        role_perms.setdefault(role_id, []).append(perm_id)
+
+    indexes = {
+        'ct': dict((ctype.id, i) for i, ctype in enumerate(ctypes)),
+        'perm': dict((perm.id, i) for i, perm in enumerate(perms)),
+        'role': dict((role.id, i) for i, role in enumerate(roles)),
+    }
+
+    meta = {
+        'content_types': [ctype.natural_key() for ctype in ctypes],
+        'permissions': [perm.natural_key() for perm in perms],
+        'roles': [{'name': role.name,
+                   'permissions': [indexes['perm'][perm_id] for perm_id
+                                   in role_perms.get(role.id, [])]}
+                  for role in roles],
+    }
+
+    output.write(MAGIC)
+    write_frame(output, b"META", json.dumps(meta).encode("utf-8"))
+
+    counts = {}
+
+    for tag, model, columns in TABLES:
+        fields = [field for field, kind in columns]
+        kinds = [kind for field, kind in columns]
+        rows = []
+        counts[model.__name__] = 0
+
+        for row in model.objects.order_by('id').values_list(
+                *fields).iterator(chunk_size=chunk_size):
+
+            rows.append(row)
+
+            if len(rows) == chunk_size:
+                write_frame(output, tag, pack_columns(
+                    _map_columns(rows, kinds, indexes), kinds))
+                counts[model.__name__] += len(rows)
+                rows = []
+
+        if rows:
+            write_frame(output, tag, pack_columns(
+                _map_columns(rows, kinds, indexes), kinds))
+            counts[model.__name__] += len(rows)
+
+    output.write(FRAME.pack(b"END ", 0))
+
+    return counts
+
+
+def _map_columns(rows, kinds, indexes):
+
+    """ Turn rows into columns, replacing ids by their META index """
+
+    columns = [list(column) for column in zip(*rows)]
+
+    for column, kind in zip(columns, kinds):
+        if kind != 'id':
+            index = indexes[kind]
+            column[:] = [index[value] for value in column]
+
+    return columns
+
+
+def load_meta(meta):
+
+    """Resolve the META frame against this database. Roles are created
+    or updated by name. Return a dict of kind to the list of local ids
+    per index, where content types and permissions that don't exist
+    here are None.
+
+    """
+
+    ctype_ids = []
+
+    for app_label, model in meta['content_types']:
+        try:
+            ctype_ids.append(ContentType.objects.get_by_natural_key(
+                app_label, model).id)
+        except ContentType.DoesNotExist:
+            LOGGER.warning("Skipping the rows of unknown content type "
+                           "%s.%s", app_label, model)
+            ctype_ids.append(None)
+
+    perm_ids = []
+
+    for codename, app_label, model in meta['permissions']:
+        try:
+            perm_ids.append(Permission.objects.get(
+                codename=codename, content_type__app_label=app_label,
+                content_type__model=model).id)
+        except Permission.DoesNotExist:
+            LOGGER.warning("Skipping the rows of unknown permission "
+                           "%s.%s", app_label, codename)
+            perm_ids.append(None)
+
+    role_ids = []
+
+    for role in meta['roles']:
+        _role, created = Role.objects.get_or_create(name=role['name'])
+        _role.permissions.set([perm_ids[i] for i in role['permissions']
+                               if perm_ids[i] is not None])
+        role_ids.append(_role.id)
+
+    return {'ct': ctype_ids, 'perm': perm_ids, 'role': role_ids}
+
+
+def import_snapshot(infile, replace=False, batch_size=5000):
+
+    """Load a snapshot from the binary file object infile. If replace is
+    True, existing assignments are removed first; otherwise assignments
+    that already exist are skipped. Rows are loaded a frame at a time,
+    with bulk_create, and bypass the model signals: the materialised
+    permissions are not updated, and the shared cache is invalidated as
+    a whole. Rows referring to content types or permissions that don't
+    exist in this database are skipped. Return a dict of model name to
+    number of rows added.
+
+    """
+
+    tables = dict((tag, (model, columns)) for tag, model, columns in TABLES)
+    ids = None
+
+    # Delete in SQL, like the rows are inserted without signals
+    #
+    if replace:
+        with connection.cursor() as cursor:
+            for tag, model, columns in TABLES:
+                cursor.execute("DELETE FROM %s" % connection.ops.quote_name(
+                    model._meta.db_table))
+
+    # Rows that already exist are skipped by the database, so count the
+    # rows before and after
+    #
+    counts = dict((model.__name__, -model.objects.count())
+                  for tag, model, columns in TABLES)
+
+    for tag, payload in read_frames(infile):
+
+        if tag == b"META":
+            ids = load_meta(json.loads(payload.decode("utf-8")))
+            continue
+
+        if ids is None or tag not in tables:
+            raise SnapshotError("Unexpected frame %r" % tag)
+
+        model, columns = tables[tag]
+        fields = [field for field, kind in columns]
+        kinds = [kind for field, kind in columns]
+
+        rows = [column if kind == 'id' else
+                [ids[kind][value] for value in column]
+                for column, kind in zip(unpack_columns(payload, kinds),
+                                        kinds)]
+
+        objs = [model(**dict(zip(fields, row))) for row in zip(*rows)
+                if None not in row]
+
+        model.objects.bulk_create(objs, batch_size=batch_size,
+                                  ignore_conflicts=True)
+
+    if ids is None:
+        raise SnapshotError("Snapshot has no META frame")
+
+    for tag, model, columns in TABLES:
+        counts[model.__name__] += model.objects.count()
+
+    invalidate_permission_cache()
+
+    if sharedcache.is_enabled():
+        sharedcache.invalidate_all()
+
+    return counts
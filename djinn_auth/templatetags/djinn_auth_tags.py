@@ -1,10 +1,27 @@
-from django.template import Library
+import functools
+from django.template import Library, Node, TemplateSyntaxError
 from django.template.base import NodeList
 from django.template.defaulttags import IfNode, TemplateLiteral
+from djinn_auth.utils import has_perm_many
 
 
 register = Library()
 
+SHORT_PERMS = ["delete", "change", "add", "view"]
+
+
+@functools.lru_cache(maxsize=None)
+def normalize_perm(model, perm):
+
+    """ Expand the short permission names to the full permission of the
+    model, like 'app_label.view_model' """
+
+    if perm in SHORT_PERMS:
+        return "%s.%s_%s" % (model._meta.app_label, perm,
+                             model._meta.object_name.lower())
+
+    return perm
+
 
 class HasPermissionNode(IfNode):
 
@@ -26,10 +43,11 @@ class HasPermissionNode(IfNode):
 
         # Normalize permission if need be...
         #
-        if ctx and perm in ["delete", "change", "add", "view"]:
-            perm = "%s.%s_%s" % (ctx._meta.app_label, perm,
-                                 ctx._meta.object_name.lower())
+        if ctx:
+            perm = normalize_perm(type(ctx), perm)
 
+        # Verdicts of preload_perms are found in the user's cache
+        #
         if usr.has_perm(perm, obj=ctx):
             return self.nodelist_true.render(context)
         else:
@@ -56,3 +74,61 @@ def if_has_perm(parser, token):
     return HasPermissionNode(ctx, user, perm, nodelist_true, nodelist_false)
 
 register.tag("if_has_perm", if_has_perm)
+
+
+class PreloadPermsNode(Node):
+
+    def __init__(self, user, objs, perms):
+
+        self.usr = user
+        self.objs = objs
+        self.perms = perms
+
+    def render(self, context):
+
+        usr = self.usr.resolve(context)
+
+        # Superusers have all permissions, no need to check
+        #
+        if usr.is_active and usr.is_superuser:
+            return ""
+
+        objs = [obj for obj in self.objs.resolve(context) or []
+                if obj is not None]
+
+        models = {}
+
+        for obj in objs:
+            models.setdefault(type(obj), []).append(obj)
+
+        for perm in self.perms:
+            perm = perm.resolve(context)
+
+            for model, model_objs in models.items():
+                has_perm_many(usr, normalize_perm(model, perm), model_objs)
+
+        return ""
+
+
+def preload_perms(parser, token):
+
+    """Usage: preload_perms <user object> <objects> '<permission>' ...
+
+    Resolve the permissions on all objects in bulk. The verdicts are
+    kept in the user's permission cache, where the djinn_auth backend
+    finds them when if_has_perm checks the permissions; if_has_perm still
+    asks all backends.
+
+    """
+
+    bits = token.split_contents()[1:]
+
+    if len(bits) < 3:
+        raise TemplateSyntaxError(
+            "preload_perms takes a user, objects and permissions")
+
+    return PreloadPermsNode(parser.compile_filter(bits[0]),
+                            parser.compile_filter(bits[1]),
+                            [parser.compile_filter(bit) for bit in bits[2:]])
+
+register.tag("preload_perms", preload_perms)
@@ -1,9 +1,12 @@
-from django.test.testcases import TestCase
+from asgiref.sync import async_to_sync
+from django.test.testcases import TestCase, TransactionTestCase
+from django.test.utils import override_settings
 from django.contrib.auth.models import Group, User, Permission
 from django.contrib.contenttypes.models import ContentType
 from djinn_auth.models import Role
 from djinn_auth.utils import assign_global_role, unassign_global_role, \
-    assign_local_role, unassign_local_role
+    assign_local_role, unassign_local_role, assign_local_permission, \
+    unassign_local_permission
 from djinn_auth.authbackend import AuthBackend
 
 
@@ -33,15 +36,15 @@ class AuthBackendTest(TestCase):
 
         tjibbe = User.objects.create(username="Tjibbe")
 
-        self.assertFalse(self.backend.has_perm(tjibbe, "app.do_something"))
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something"))
 
         assign_global_role(tjibbe, self.owner)
 
-        self.assertTrue(self.backend.has_perm(tjibbe, "app.do_something"))
+        self.assertTrue(self.backend.has_perm(tjibbe, "auth.do_something"))
 
         unassign_global_role(tjibbe, self.owner)
 
-        self.assertFalse(self.backend.has_perm(tjibbe, "app.do_something"))
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something"))
 
     def test_has_perm_by_permission_on_user(self):
 
@@ -51,15 +54,15 @@ class AuthBackendTest(TestCase):
 
         tjibbe = User.objects.create(username="Tjibbe")
 
-        self.assertFalse(self.backend.has_perm(tjibbe, "app.do_something"))
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something"))
 
         tjibbe.user_permissions.add(self.perm)
 
-        self.assertTrue(self.backend.has_perm(tjibbe, "app.do_something"))
+        self.assertTrue(self.backend.has_perm(tjibbe, "auth.do_something"))
 
         tjibbe.user_permissions.remove(self.perm)
 
-        self.assertFalse(self.backend.has_perm(tjibbe, "app.do_something"))
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something"))
 
     def test_has_perm_by_global_role_on_group(self):
 
@@ -71,19 +74,19 @@ class AuthBackendTest(TestCase):
         tjibbe = User.objects.create(username="Tjibbe")
         tjibbes = Group.objects.create(name="Tjibbes")
 
-        self.assertFalse(self.backend.has_perm(tjibbe, "app.do_something"))
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something"))
 
         assign_global_role(tjibbes, self.owner)
 
-        self.assertFalse(self.backend.has_perm(tjibbe, "app.do_something"))
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something"))
 
         tjibbe.groups.add(tjibbes)
 
-        self.assertTrue(self.backend.has_perm(tjibbe, "app.do_something"))
+        self.assertTrue(self.backend.has_perm(tjibbe, "auth.do_something"))
 
         tjibbe.groups.remove(tjibbes)
 
-        self.assertFalse(self.backend.has_perm(tjibbe, "app.do_something"))
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something"))
 
     def test_has_perm_by_global_permission_on_group(self):
 
@@ -93,19 +96,19 @@ class AuthBackendTest(TestCase):
         tjibbe = User.objects.create(username="Tjibbe")
         tjibbes = Group.objects.create(name="Tjibbes")
 
-        self.assertFalse(self.backend.has_perm(tjibbe, "app.do_something"))
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something"))
 
         tjibbes.permissions.add(self.perm)
 
-        self.assertFalse(self.backend.has_perm(tjibbe, "app.do_something"))
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something"))
 
         tjibbe.groups.add(tjibbes)
 
-        self.assertTrue(self.backend.has_perm(tjibbe, "app.do_something"))
+        self.assertTrue(self.backend.has_perm(tjibbe, "auth.do_something"))
 
         tjibbe.groups.remove(tjibbes)
 
-        self.assertFalse(self.backend.has_perm(tjibbe, "app.do_something"))
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something"))
 
     def test_has_perm_on_object(self):
 
@@ -116,17 +119,17 @@ class AuthBackendTest(TestCase):
 
         content = Group.objects.create(name="Tjibbes")
 
-        self.assertFalse(self.backend.has_perm(tjibbe, "app.do_something",
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something",
                                                obj=content))
 
         assign_global_role(tjibbe, self.owner)
 
-        self.assertTrue(self.backend.has_perm(tjibbe, "app.do_something",
+        self.assertTrue(self.backend.has_perm(tjibbe, "auth.do_something",
                                               obj=content))
 
         unassign_global_role(tjibbe, self.owner)
 
-        self.assertFalse(self.backend.has_perm(tjibbe, "app.do_something",
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something",
                                                obj=content))
 
     def test_has_perm_on_object_with_userpermission(self):
@@ -138,17 +141,17 @@ class AuthBackendTest(TestCase):
 
         content = Group.objects.create(name="Tjibbes")
 
-        self.assertFalse(self.backend.has_perm(tjibbe, "app.do_something",
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something",
                                                obj=content))
 
         tjibbe.user_permissions.add(self.perm)
 
-        self.assertTrue(self.backend.has_perm(tjibbe, "app.do_something",
+        self.assertTrue(self.backend.has_perm(tjibbe, "auth.do_something",
                                               obj=content))
 
         tjibbe.user_permissions.remove(self.perm)
 
-        self.assertFalse(self.backend.has_perm(tjibbe, "app.do_something",
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something",
                                                obj=content))
 
     def test_has_perm_on_object_by_local_role(self):
@@ -157,17 +160,17 @@ class AuthBackendTest(TestCase):
 
         content = Group.objects.create(name="Tjibbes")
 
-        self.assertFalse(self.backend.has_perm(tjibbe, "app.do_something",
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something",
                                                obj=content))
 
         assign_local_role(tjibbe, content, self.owner)
 
-        self.assertTrue(self.backend.has_perm(tjibbe, "app.do_something",
+        self.assertTrue(self.backend.has_perm(tjibbe, "auth.do_something",
                                               obj=content))
 
         unassign_local_role(tjibbe, content, self.owner)
 
-        self.assertFalse(self.backend.has_perm(tjibbe, "app.do_something",
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something",
                                                obj=content))
 
     def test_has_perm_on_object_by_local_role_on_group(self):
@@ -177,22 +180,22 @@ class AuthBackendTest(TestCase):
 
         content = Group.objects.create(name="Content")
 
-        self.assertFalse(self.backend.has_perm(tjibbe, "app.do_something",
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something",
                                                obj=content))
 
         assign_local_role(tjibbes, content, self.owner)
 
-        self.assertFalse(self.backend.has_perm(tjibbe, "app.do_something",
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something",
                                                obj=content))
 
         tjibbe.groups.add(tjibbes)
 
-        self.assertTrue(self.backend.has_perm(tjibbe, "app.do_something",
+        self.assertTrue(self.backend.has_perm(tjibbe, "auth.do_something",
                                               obj=content))
 
         tjibbe.groups.remove(tjibbes)
 
-        self.assertFalse(self.backend.has_perm(tjibbe, "app.do_something",
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something",
                                                obj=content))
 
     def test_local_roles_without_acquire_global(self):
@@ -205,12 +208,12 @@ class AuthBackendTest(TestCase):
 
         assign_global_role(tjibbe, self.owner)
 
-        self.assertTrue(self.backend.has_perm(tjibbe, "app.do_something",
+        self.assertTrue(self.backend.has_perm(tjibbe, "auth.do_something",
                                               obj=content))
 
         setattr(content, "acquire_global_roles", False)
 
-        self.assertFalse(self.backend.has_perm(tjibbe, "app.do_something",
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something",
                                                obj=content))
 
     def test_has_perm_with_acquisition(self):
@@ -220,20 +223,490 @@ class AuthBackendTest(TestCase):
 
         tjibbe = User.objects.create(username="Tjibbe")
 
-        self.assertFalse(self.backend.has_perm(tjibbe, "app.do_something",
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something",
                                                obj=content))
 
         assign_local_role(tjibbe, parent, self.owner)
 
-        self.assertFalse(self.backend.has_perm(tjibbe, "app.do_something",
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something",
                                                obj=content))
 
         assign_local_role(tjibbe, parent, self.owner)
 
-        self.assertFalse(self.backend.has_perm(tjibbe, "app.do_something",
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something",
                                                obj=content))
 
         content.acquire_from = [parent]
 
-        self.assertTrue(self.backend.has_perm(tjibbe, "app.do_something",
+        self.assertTrue(self.backend.has_perm(tjibbe, "auth.do_something",
                                               obj=content))
+
+    def test_has_perm_on_object_by_local_permission(self):
+
+        tjibbe = User.objects.create(username="Tjibbe")
+        tjibbes = Group.objects.create(name="Tjibbes")
+
+        content = Group.objects.create(name="Content")
+
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something",
+                                               obj=content))
+
+        assign_local_permission(tjibbe, content, self.perm)
+
+        self.assertTrue(self.backend.has_perm(tjibbe, "auth.do_something",
+                                              obj=content))
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something"))
+
+        unassign_local_permission(tjibbe, content, self.perm)
+
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something",
+                                               obj=content))
+
+        assign_local_permission(tjibbes, content, self.perm)
+
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something",
+                                               obj=content))
+
+        tjibbe.groups.add(tjibbes)
+
+        self.assertTrue(self.backend.has_perm(tjibbe, "auth.do_something",
+                                              obj=content))
+
+    def test_local_permission_with_acquisition(self):
+
+        content = Group.objects.create(name="Tjibbes")
+        parent = Group.objects.create(name="Parent")
+
+        tjibbe = User.objects.create(username="Tjibbe")
+
+        assign_local_permission(tjibbe, parent, self.perm)
+
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something",
+                                               obj=content))
+
+        content.acquire_from = [parent]
+
+        self.assertTrue(self.backend.has_perm(tjibbe, "auth.do_something",
+                                              obj=content))
+
+    def test_has_perm_with_deep_acquisition(self):
+
+        space = Group.objects.create(name="Space")
+        folder = Group.objects.create(name="Folder")
+        subfolder = Group.objects.create(name="Subfolder")
+        document = Group.objects.create(name="Document")
+
+        document.acquire_from = [subfolder]
+        subfolder.acquire_from = [folder]
+        folder.acquire_from = [space]
+
+        # make it a cycle, for good measure
+        #
+        space.acquire_from = [document]
+
+        tjibbe = User.objects.create(username="Tjibbe")
+
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something",
+                                               obj=document))
+
+        assign_local_role(tjibbe, space, self.owner)
+
+        self.assertTrue(self.backend.has_perm(tjibbe, "auth.do_something",
+                                              obj=document))
+
+        # Use a fresh user, to start with an empty cache
+        #
+        tjibbe = User.objects.get(pk=tjibbe.pk)
+
+        with self.settings(DJINN_AUTH_ACQUIRE_MAX_DEPTH=2):
+            self.assertFalse(self.backend.has_perm(
+                tjibbe, "auth.do_something", obj=document))
+
+        with self.settings(DJINN_AUTH_ACQUIRE_MAX_DEPTH=3):
+            self.assertTrue(self.backend.has_perm(
+                User.objects.get(pk=tjibbe.pk), "auth.do_something",
+                obj=document))
+
+    def test_get_all_permissions(self):
+
+        tjibbe = User.objects.create(username="Tjibbe")
+        tjibbes = Group.objects.create(name="Tjibbes")
+        content = Group.objects.create(name="Content")
+        parent = Group.objects.create(name="Parent")
+
+        content.acquire_from = [parent]
+        tjibbe.groups.add(tjibbes)
+
+        self.assertEqual(set(), self.backend.get_all_permissions(tjibbe))
+        self.assertEqual(set(), self.backend.get_all_permissions(
+            tjibbe, obj=content))
+
+        assign_local_role(tjibbes, parent, self.owner)
+
+        self.assertEqual(set(), self.backend.get_all_permissions(tjibbe))
+        self.assertEqual(set(["auth.do_something"]),
+                         self.backend.get_all_permissions(tjibbe,
+                                                          obj=content))
+        self.assertEqual(set(["auth.do_something"]),
+                         self.backend.get_group_permissions(tjibbe,
+                                                            obj=content))
+
+        with self.assertNumQueries(0):
+            self.assertTrue(tjibbe.has_perms(["auth.do_something"],
+                                             obj=content))
+
+    def test_unknown_permission(self):
+
+        tjibbe = User.objects.create(username="Tjibbe")
+        content = Group.objects.create(name="Foo")
+
+        assign_global_role(tjibbe, self.owner)
+
+        self.assertTrue(self.backend.has_perm(tjibbe, "auth.do_something"))
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_nothing"))
+        self.assertFalse(self.backend.has_perm(tjibbe, "do_something"))
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_nothing",
+                                               obj=content))
+
+        # The app label counts, not just the codename
+        #
+        self.assertFalse(self.backend.has_perm(tjibbe,
+                                               "djinn_auth.do_something"))
+
+    def test_ahas_perm(self):
+
+        tjibbe = User.objects.create(username="Tjibbe")
+        content = Group.objects.create(name="Foo")
+
+        ahas_perm = async_to_sync(self.backend.ahas_perm)
+
+        self.assertFalse(ahas_perm(tjibbe, "auth.do_something", obj=content))
+
+        assign_local_role(tjibbe, content, self.owner)
+
+        self.assertTrue(ahas_perm(tjibbe, "auth.do_something", obj=content))
+
+        # Cached verdicts don't need the database
+        #
+        with self.assertNumQueries(0):
+            self.assertTrue(ahas_perm(tjibbe, "auth.do_something",
+                                      obj=content))
+
+    def test_get_group_permissions(self):
+
+        tjibbe = User.objects.create(username="Tjibbe")
+        tjibbes = Group.objects.create(name="Tjibbes")
+
+        tjibbe.groups.add(tjibbes)
+        assign_global_role(tjibbe, self.owner)
+
+        self.assertEqual(set(["auth.do_something"]),
+                         self.backend.get_all_permissions(tjibbe))
+        self.assertEqual(set(), self.backend.get_group_permissions(tjibbe))
+
+        assign_global_role(tjibbes, self.owner)
+
+        self.assertEqual(set(["auth.do_something"]),
+                         self.backend.get_group_permissions(tjibbe))
+
+    def test_has_perm_cached(self):
+
+        """Repeated checks within the same request should not hit the
+        database, unless the roles have changed in between."""
+
+        tjibbe = User.objects.create(username="Tjibbe")
+        content = Group.objects.create(name="Content")
+
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something",
+                                               obj=content))
+
+        with self.assertNumQueries(0):
+            self.assertFalse(self.backend.has_perm(
+                tjibbe, "auth.do_something", obj=content))
+
+        assign_local_role(tjibbe, content, self.owner)
+
+        self.assertTrue(self.backend.has_perm(tjibbe, "auth.do_something",
+                                              obj=content))
+
+        with self.assertNumQueries(0):
+            self.assertTrue(self.backend.has_perm(
+                tjibbe, "auth.do_something", obj=content))
+
+
+@override_settings(DJINN_AUTH_ENGINE="sql")
+class SQLAuthBackendTest(AuthBackendTest):
+
+    """ Run the same tests against the single query engine """
+
+    def test_denied_in_single_query(self):
+
+        tjibbe = User.objects.create(username="Tjibbe")
+        content = Group.objects.create(name="Content")
+        parent = Group.objects.create(name="Parent")
+
+        content.acquire_from = [parent]
+
+        # warm up the permission index
+        #
+        self.backend.has_perm(tjibbe, "auth.do_something")
+
+        with self.assertNumQueries(1):
+            self.assertFalse(self.backend.has_perm(
+                tjibbe, "auth.do_something", obj=content))
+
+
+@override_settings(DJINN_AUTH_ENGINE="materialized",
+                   DJINN_AUTH_MATERIALIZE=True)
+class MaterializedAuthBackendTest(AuthBackendTest):
+
+    """ Run the same tests against the materialised permissions, to make
+    sure the table is maintained properly """
+
+    def test_rebuild_and_check(self):
+
+        from djinn_auth.materialize import rebuild, check_users
+        from djinn_auth.models import EffectivePermission
+
+        tjibbe = User.objects.create(username="Tjibbe")
+        content = Group.objects.create(name="Content")
+
+        assign_local_role(tjibbe, content, self.owner)
+        assign_global_role(tjibbe, self.owner)
+
+        self.assertEqual([], list(check_users()))
+
+        EffectivePermission.objects.filter(global_role=True).delete()
+
+        self.assertEqual(
+            [(tjibbe.id, 'missing', (self.perm.id, None, None, True))],
+            list(check_users([tjibbe.id])))
+
+        rebuild()
+
+        self.assertEqual([], list(check_users()))
+        self.assertEqual(2, EffectivePermission.objects.count())
+
+    def test_group_assignment(self):
+
+        """ Assigning a role to a group only adds the grants of the
+        members on the instance, in a fixed number of queries """
+
+        from djinn_auth.materialize import check_users
+        from djinn_auth.models import EffectivePermission
+
+        content = Group.objects.create(name="Content")
+        juniors = Group.objects.create(name="Juniors")
+        other = Group.objects.create(name="Other")
+
+        for i in range(50):
+            user = User.objects.create(username="User%d" % i)
+            user.groups.add(juniors)
+            assign_local_role(user, other, self.owner)
+
+        tjibbe = User.objects.get(username="User0")
+        assign_local_role(tjibbe, content, self.owner)
+
+        # warm up the permission index
+        #
+        self.backend.has_perm(tjibbe, "auth.do_something")
+
+        # The assignment, the members, the role assignments and local
+        # permissions on the instance, the existing grants and the
+        # insert, with their savepoints
+        #
+        with self.assertNumQueries(11):
+            assign_local_role(juniors, content, self.owner)
+
+        self.assertEqual(50, EffectivePermission.objects.filter(
+            instance_id=content.id).count())
+
+        # Tjibbe keeps the grant of the own role
+        #
+        unassign_local_role(juniors, content, self.owner)
+
+        self.assertEqual(
+            [tjibbe.id], list(EffectivePermission.objects.filter(
+                instance_id=content.id).values_list('user_id', flat=True)))
+        self.assertEqual([], list(check_users()))
+
+
+@override_settings(DJINN_AUTH_ENGINE="bitset")
+class BitsetAuthBackendTest(AuthBackendTest):
+
+    """ Run the same tests against the bitset engine """
+
+    def test_global_is_a_mask(self):
+
+        tjibbe = User.objects.create(username="Tjibbe")
+
+        assign_global_role(tjibbe, self.owner)
+
+        self.assertTrue(self.backend.has_perm(tjibbe, "auth.do_something"))
+
+        # Once the masks are known, checking another permission doesn't
+        # need the database
+        #
+        ctype = ContentType.objects.get_for_model(Group)
+
+        other, created = Permission.objects.get_or_create(
+            codename="do_other",
+            content_type=ctype, defaults={'name': 'Can do other things'})
+
+        self.owner.add_permission(other)
+
+        self.assertTrue(self.backend.has_perm(tjibbe, "auth.do_other"))
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.change_group"))
+
+        with self.assertNumQueries(0):
+            self.assertFalse(self.backend.has_perm(tjibbe,
+                                                   "auth.delete_group"))
+
+
+@override_settings(DJINN_AUTH_ADAPTIVE_ORDER=True)
+class AdaptiveAuthBackendTest(AuthBackendTest):
+
+    """ Run the same tests with the sources ordered by their grants """
+
+
+@override_settings(DJINN_AUTH_SHARED_CACHE=True)
+class SharedCacheAuthBackendTest(AuthBackendTest):
+
+    """ Run the same tests with the shared cache enabled """
+
+    def setUp(self):
+
+        from djinn_auth.permindex import get_cache
+
+        # Ids are reused between tests, so start afresh
+        #
+        get_cache().clear()
+
+        super(SharedCacheAuthBackendTest, self).setUp()
+
+    def test_shared_between_requests(self):
+
+        from djinn_auth import sharedcache
+
+        tjibbe = User.objects.create(username="Tjibbe")
+        content = Group.objects.create(name="Content")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            assign_local_role(tjibbe, content, self.owner)
+
+        self.assertTrue(self.backend.has_perm(tjibbe, "auth.do_something",
+                                              obj=content))
+
+        sharedcache.reset_stats()
+
+        # A new request, so no cache on the user object. Only the user
+        # permissions are checked in the database.
+        #
+        with self.assertNumQueries(2):
+            self.assertTrue(self.backend.has_perm(
+                User.objects.get(pk=tjibbe.pk), "auth.do_something",
+                obj=content))
+
+        self.assertEqual(0, sharedcache.get_stats()['misses'])
+        self.assertEqual(3, sharedcache.get_stats()['hits'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            unassign_local_role(tjibbe, content, self.owner)
+
+        self.assertFalse(self.backend.has_perm(
+            User.objects.get(pk=tjibbe.pk), "auth.do_something",
+            obj=content))
+
+    def test_bump_on_commit(self):
+
+        from djinn_auth import ctcache, sharedcache
+        from djinn_auth.permindex import get_cache
+
+        tjibbe = User.objects.create(username="Tjibbe")
+        content = Group.objects.create(name="Content")
+
+        key = sharedcache.instance_generation_key(ctcache.get_ct_id(Group),
+                                                  content.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            assign_local_role(tjibbe, content, self.owner)
+
+        self.assertTrue(self.backend.has_perm(tjibbe, "auth.do_something",
+                                              obj=content))
+
+        generation = get_cache().get(key)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            unassign_local_role(tjibbe, content, self.owner)
+
+            # Other processes keep the old generation until the commit,
+            # while this thread bypasses the cache
+            #
+            self.assertEqual(generation, get_cache().get(key))
+            self.assertTrue(sharedcache.is_bypassed())
+            self.assertFalse(self.backend.has_perm(
+                User.objects.get(pk=tjibbe.pk), "auth.do_something",
+                obj=content))
+
+        self.assertEqual(1, len(callbacks))
+        self.assertEqual(generation + 1, get_cache().get(key))
+        self.assertFalse(sharedcache.is_bypassed())
+
+
+class GroupDeleteTest(TransactionTestCase):
+
+    """ Deleting a group removes its memberships without m2m_changed
+    signals. Changes are committed, so the commit hooks run. """
+
+    def setUp(self):
+
+        from djinn_auth.permindex import get_cache
+
+        get_cache().clear()
+
+        self.backend = AuthBackend()
+        self.owner = Role.objects.create(name="owner")
+
+        self.perm, created = Permission.objects.get_or_create(
+            codename="do_something",
+            content_type=ContentType.objects.get_for_model(Group),
+            defaults={'name': 'Can do things'})
+
+        self.owner.add_permission(self.perm)
+
+        self.tjibbe = User.objects.create(username="Tjibbe")
+        self.tjibbes = Group.objects.create(name="Tjibbes")
+        self.tjibbe.groups.add(self.tjibbes)
+
+        assign_global_role(self.tjibbes, self.owner)
+
+    def has_perm(self):
+
+        # A new request, so no cache on the user object
+        #
+        return self.backend.has_perm(User.objects.get(pk=self.tjibbe.pk),
+                                     "auth.do_something")
+
+    @override_settings(DJINN_AUTH_SHARED_CACHE=True)
+    def test_shared_cache(self):
+
+        self.assertTrue(self.has_perm())
+
+        self.tjibbes.delete()
+
+        self.assertFalse(self.has_perm())
+
+    @override_settings(DJINN_AUTH_ENGINE="materialized",
+                       DJINN_AUTH_MATERIALIZE=True)
+    def test_materialized(self):
+
+        from djinn_auth.materialize import check_users, rebuild
+
+        rebuild()
+
+        self.assertTrue(self.has_perm())
+
+        self.tjibbes.delete()
+
+        self.assertFalse(self.has_perm())
+        self.assertEqual([], list(check_users()))
@@ -0,0 +1,29 @@
+from django.test.testcases import TestCase
+from django.contrib.auth.models import User
+from djinn_auth.benchmark import run_permission_benchmark
+from djinn_auth.models import LocalRole
+
+
+class PermissionBenchmarkTest(TestCase):
+
+    def test_paths(self):
+
+        result = run_permission_benchmark(
+            users=30, groups=5, roles=4, local_roles=500, depth=2,
+            repeat=10)
+
+        results = result['results']
+
+        self.assertEqual(set(['global', 'local', 'acquired', 'denied']),
+                         set(results))
+
+        for name in ['global', 'local', 'acquired']:
+            self.assertEqual(10, results[name]['granted'], name)
+
+        self.assertEqual(0, results['denied']['granted'])
+        self.assertTrue(results['denied']['queries_per_check'] > 0)
+
+        # All data is rolled back
+        #
+        self.assertEqual(0, User.objects.count())
+        self.assertEqual(0, LocalRole.objects.count())
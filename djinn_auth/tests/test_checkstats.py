@@ -0,0 +1,112 @@
+from django.test.testcases import TestCase
+from django.test.utils import override_settings
+from django.contrib.auth.models import Group, User, Permission
+from django.contrib.contenttypes.models import ContentType
+from djinn_auth import instrument
+from djinn_auth.authbackend import AuthBackend
+from djinn_auth.checkstats import check_stats, CheckStats, SOURCES
+from djinn_auth.models import Role
+from djinn_auth.permindex import permission_index
+from djinn_auth.utils import assign_global_role, assign_local_role
+
+
+@override_settings(DJINN_AUTH_ADAPTIVE_ORDER=True)
+class CheckStatsTest(TestCase):
+
+    def setUp(self):
+
+        self.backend = AuthBackend()
+        self.owner = Role.objects.create(name="owner")
+
+        ctype = ContentType.objects.get_for_model(Group)
+
+        do_something, created = Permission.objects.get_or_create(
+            codename="do_something",
+            content_type=ctype, defaults={'name': 'Can do things'})
+
+        self.owner.add_permission(do_something)
+
+        check_stats.reset()
+
+    def test_order(self):
+
+        stats = CheckStats()
+
+        self.assertEqual(SOURCES, stats.get_order("auth.do_something"))
+
+        stats.record("auth.do_something", instrument.LOCAL_ROLE)
+
+        self.assertEqual(instrument.LOCAL_ROLE,
+                         stats.get_order("auth.do_something")[0])
+        self.assertEqual(SOURCES, stats.get_order("auth.do_other"))
+
+    @override_settings(DJINN_AUTH_ADAPTIVE_DECAY=0.5)
+    def test_decay(self):
+
+        stats = CheckStats()
+
+        for i in range(10):
+            stats.record("auth.do_something", instrument.LOCAL_ROLE)
+
+        stats.record("auth.do_something", instrument.GLOBAL_ROLE)
+        stats.record("auth.do_something", instrument.GLOBAL_ROLE)
+
+        self.assertEqual(
+            [instrument.GLOBAL_ROLE, instrument.LOCAL_ROLE],
+            stats.get_stats()["auth.do_something"]['order'][:2])
+
+    def test_local_first(self):
+
+        """ After local roles granted the permission, these are checked
+        first """
+
+        group = Group.objects.create(name="Groupies")
+
+        tjibbe = User.objects.create(username="Tjibbe")
+        assign_local_role(tjibbe, group, self.owner)
+
+        tjibbe = User.objects.get(pk=tjibbe.pk)
+        permission_index.get_index()
+
+        # The user set, the user's groups, global and local roles
+        #
+        with self.assertNumQueries(4):
+            self.assertTrue(self.backend.has_perm(tjibbe,
+                                                  "auth.do_something",
+                                                  obj=group))
+
+        self.assertEqual(
+            instrument.LOCAL_ROLE,
+            check_stats.get_stats()["auth.do_something"]['order'][0])
+
+        # The user's groups and the local grants only
+        #
+        tjibbe = User.objects.get(pk=tjibbe.pk)
+
+        with self.assertNumQueries(2):
+            self.assertTrue(self.backend.has_perm(tjibbe,
+                                                  "auth.do_something",
+                                                  obj=group))
+
+        # Other sources still grant
+        #
+        gurbe = User.objects.create(username="Gurbe")
+        assign_global_role(gurbe, self.owner)
+
+        self.assertTrue(self.backend.has_perm(gurbe, "auth.do_something",
+                                              obj=group))
+        self.assertFalse(self.backend.has_perm(
+            User.objects.create(username="Pier"), "auth.do_something",
+            obj=group))
+
+    @override_settings(DJINN_AUTH_ADAPTIVE_ORDER=False)
+    def test_disabled(self):
+
+        group = Group.objects.create(name="Groupies")
+
+        tjibbe = User.objects.create(username="Tjibbe")
+        assign_local_role(tjibbe, group, self.owner)
+
+        self.assertTrue(self.backend.has_perm(tjibbe, "auth.do_something",
+                                              obj=group))
+        self.assertEqual({}, check_stats.get_stats())
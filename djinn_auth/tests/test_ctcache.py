@@ -0,0 +1,52 @@
+from django.test import override_settings
+from django.test.testcases import TestCase
+from django.contrib.auth.models import User, Group
+from django.contrib.contenttypes.models import ContentType
+from djinn_auth import ctcache
+from djinn_auth.models import Role, Group as DjinnGroup
+from djinn_auth.utils import assign_global_role, assign_local_role, \
+    get_user_global_roles, get_user_local_roles
+
+
+class ContentTypeCacheTest(TestCase):
+
+    def setUp(self):
+
+        self.owner = Role.objects.create(name="owner")
+
+    def test_ids(self):
+
+        self.assertEqual(ContentType.objects.get_for_model(User).id,
+                         ctcache.get_user_ct_id())
+        self.assertEqual(ContentType.objects.get_for_model(Group).id,
+                         ctcache.get_group_ct_id())
+        self.assertEqual(ContentType.objects.get_for_model(Group).id,
+                         ctcache.get_ct_id(Group(name="Groupies")))
+
+    def test_group_model(self):
+
+        self.assertEqual(Group, ctcache.get_group_model())
+
+        with override_settings(AUTH_GROUP_MODEL="djinn_auth.Group"):
+            self.assertEqual(DjinnGroup, ctcache.get_group_model())
+            self.assertEqual(
+                ContentType.objects.get_for_model(DjinnGroup).id,
+                ctcache.get_group_ct_id())
+
+        self.assertEqual(Group, ctcache.get_group_model())
+
+    def test_no_lookups(self):
+
+        tjibbe = User.objects.create(username="Tjibbe")
+        group = Group.objects.create(name="Groupies")
+
+        assign_global_role(tjibbe, self.owner)
+        assign_local_role(tjibbe, group, self.owner)
+
+        ContentType.objects.clear_cache()
+
+        # The user's groups and the role queries, no content type lookups
+        #
+        with self.assertNumQueries(3):
+            self.assertEqual(1, len(get_user_global_roles(tjibbe)))
+            self.assertEqual(1, len(get_user_local_roles(tjibbe, group)))
@@ -0,0 +1,82 @@
+from django.test.testcases import TestCase
+from django.contrib.auth.models import Group, User, Permission
+from django.contrib.contenttypes.models import ContentType
+from djinn_auth.models import Role
+from djinn_auth.utils import assign_global_role, assign_local_role, \
+    assign_local_permission, filter_by_perm
+
+
+class FilterByPermTest(TestCase):
+
+    def setUp(self):
+
+        self.owner, created = Role.objects.get_or_create(name="owner")
+
+        ctype = ContentType.objects.get_for_model(Group)
+
+        self.perm, created = Permission.objects.get_or_create(
+            codename="do_something",
+            content_type=ctype, defaults={'name': 'Can do things'})
+
+        self.owner.add_permission(self.perm)
+
+        self.user = User.objects.create(username="Tjibbe")
+        self.content = [Group.objects.create(name="Content %d" % i)
+                        for i in range(5)]
+
+    def _filter(self):
+
+        return filter_by_perm(self.user, "auth.do_something",
+                              Group.objects.order_by("id"))
+
+    def test_no_perm(self):
+
+        self.assertEqual(0, self._filter().count())
+
+    def test_local_role(self):
+
+        assign_local_role(self.user, self.content[1], self.owner)
+        assign_local_role(self.user, self.content[3], self.owner)
+
+        self._filter().count()
+
+        with self.assertNumQueries(1):
+            self.assertEqual([self.content[1], self.content[3]],
+                             list(self._filter()))
+
+    def test_local_permission(self):
+
+        assign_local_permission(self.user, self.content[4], self.perm)
+
+        self.assertEqual([self.content[4]], list(self._filter()))
+
+    def test_local_role_on_group(self):
+
+        tjibbes = Group.objects.create(name="Tjibbes")
+
+        assign_local_role(tjibbes, self.content[2], self.owner)
+
+        self.assertEqual(0, self._filter().count())
+
+        self.user.groups.add(tjibbes)
+
+        self.assertEqual([self.content[2]], list(self._filter()))
+
+    def test_global(self):
+
+        assign_global_role(self.user, self.owner)
+
+        self.assertEqual(5, self._filter().count())
+
+        Group.acquire_global_roles = False
+
+        try:
+            self.assertEqual(0, self._filter().count())
+        finally:
+            del Group.acquire_global_roles
+
+    def test_user_permission(self):
+
+        self.user.user_permissions.add(self.perm)
+
+        self.assertEqual(5, self._filter().count())
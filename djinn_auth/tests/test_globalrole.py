@@ -2,7 +2,8 @@ from django.test.testcases import TestCase
 from django.contrib.auth.models import User
 from djinn_auth.models import Role
 from djinn_auth.utils import get_global_roles, has_global_role, \
-    assign_global_role, unassign_global_role
+    assign_global_role, unassign_global_role, bulk_assign_global_roles, \
+    bulk_unassign_global_roles
 
 
 class GlobalRoleTest(TestCase):
@@ -58,3 +59,22 @@ class GlobalRoleTest(TestCase):
         assign_global_role(tjibbe, self.role)
 
         self.assertEquals(1, len(get_global_roles(tjibbe)))
+
+    def test_bulk_assign_global_roles(self):
+
+        tjibbe = User.objects.create(username="Tjibbe")
+        gurbe = User.objects.create(username="Gurbe")
+
+        assign_global_role(tjibbe, self.role)
+
+        self.assertEqual(1, bulk_assign_global_roles(
+            [(tjibbe, self.role), (gurbe, "somerole")]))
+
+        self.assertTrue(has_global_role(tjibbe, self.role))
+        self.assertTrue(has_global_role(gurbe, self.role))
+
+        self.assertEqual(2, bulk_unassign_global_roles(
+            [(tjibbe, "somerole"), (gurbe, self.role)]))
+
+        self.assertFalse(has_global_role(tjibbe, self.role))
+        self.assertFalse(has_global_role(gurbe, self.role))
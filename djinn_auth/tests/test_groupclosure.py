@@ -0,0 +1,212 @@
+from django.db import connection
+from django.test.testcases import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.test.utils import override_settings
+from django.contrib.auth.models import Group as AuthGroup, User, \
+    Permission
+from django.contrib.contenttypes.models import ContentType
+from djinn_auth.authbackend import AuthBackend
+from djinn_auth.models import Group, GroupClosure, Role
+from djinn_auth.groupclosure import rebuild
+from djinn_auth.permindex import get_cache
+from djinn_auth.utils import assign_global_role, get_user_group_ids, \
+    has_user_local_role, assign_local_role, filter_by_perm, has_perm_many
+
+
+@override_settings(AUTH_GROUP_MODEL="djinn_auth.Group")
+class GroupClosureTest(TestCase):
+
+    def setUp(self):
+
+        self.staff = Group.objects.create(name="Staff")
+        self.tjibbes = Group.objects.create(name="Tjibbes")
+        self.juniors = Group.objects.create(name="Junior Tjibbes")
+
+        self.tjibbe = User.objects.create(username="Tjibbe")
+        self.juniors.users.add(self.tjibbe)
+
+    def get_ancestor_ids(self, group):
+
+        return set(GroupClosure.objects.filter(
+            descendant=group).values_list('ancestor_id', flat=True))
+
+    def test_nesting(self):
+
+        self.assertEqual(set([self.juniors.id]),
+                         self.get_ancestor_ids(self.juniors))
+
+        self.tjibbes.subgroups.add(self.juniors)
+        self.staff.subgroups.add(self.tjibbes)
+
+        self.assertEqual(
+            set([self.staff.id, self.tjibbes.id, self.juniors.id]),
+            self.get_ancestor_ids(self.juniors))
+
+        self.tjibbes.subgroups.remove(self.juniors)
+
+        self.assertEqual(set([self.juniors.id]),
+                         self.get_ancestor_ids(self.juniors))
+        self.assertEqual(set([self.staff.id, self.tjibbes.id]),
+                         self.get_ancestor_ids(self.tjibbes))
+
+        self.juniors.parents.add(self.staff, self.tjibbes)
+        self.tjibbes.subgroups.clear()
+
+        self.assertEqual(set([self.staff.id, self.juniors.id]),
+                         self.get_ancestor_ids(self.juniors))
+
+        self.staff.delete()
+
+        self.assertEqual(set([self.juniors.id]),
+                         self.get_ancestor_ids(self.juniors))
+
+    def test_incremental(self):
+
+        """ A nesting change only reads the nesting of the groups below
+        it, and takes the ancestors above it from the closure """
+
+        for i in range(10):
+            Group.objects.create(name="Other %d" % i).subgroups.add(
+                Group.objects.create(name="Nested %d" % i))
+
+        self.staff.subgroups.add(self.tjibbes)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.tjibbes.subgroups.add(self.juniors)
+
+        self.assertEqual(
+            set([self.staff.id, self.tjibbes.id, self.juniors.id]),
+            self.get_ancestor_ids(self.juniors))
+
+        for query in queries:
+            if 'FROM "djinn_auth_group_subgroups"' in query['sql']:
+                self.assertIn("WHERE", query['sql'])
+
+    def test_cycle(self):
+
+        self.tjibbes.subgroups.add(self.juniors)
+        self.juniors.subgroups.add(self.tjibbes)
+
+        self.assertEqual(set([self.tjibbes.id, self.juniors.id]),
+                         self.get_ancestor_ids(self.juniors))
+
+        GroupClosure.objects.all().delete()
+        rebuild()
+
+        self.assertEqual(set([self.tjibbes.id, self.juniors.id]),
+                         self.get_ancestor_ids(self.tjibbes))
+
+    def test_user_group_ids(self):
+
+        self.tjibbes.subgroups.add(self.juniors)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(set([self.tjibbes.id, self.juniors.id]),
+                             get_user_group_ids(self.tjibbe))
+
+        with self.assertNumQueries(0):
+            get_user_group_ids(self.tjibbe)
+
+        self.staff.subgroups.add(self.tjibbes)
+
+        self.assertEqual(
+            set([self.staff.id, self.tjibbes.id, self.juniors.id]),
+            get_user_group_ids(self.tjibbe))
+
+    def test_roles(self):
+
+        owner = Role.objects.create(name="owner")
+        content = AuthGroup.objects.create(name="Foo")
+
+        assign_local_role(self.staff, content, owner)
+
+        self.assertFalse(has_user_local_role(self.tjibbe, content, owner))
+
+        self.staff.subgroups.add(self.tjibbes)
+        self.tjibbes.subgroups.add(self.juniors)
+
+        self.assertTrue(has_user_local_role(self.tjibbe, content, owner))
+
+    def test_group_permissions(self):
+
+        """Permissions of Django groups don't count, even if their ids are
+        those of the user's groups """
+
+        perm, created = Permission.objects.get_or_create(
+            codename="do_something",
+            content_type=ContentType.objects.get_for_model(AuthGroup),
+            defaults={'name': 'Can do things'})
+
+        content = AuthGroup.objects.create(pk=self.juniors.pk, name="Foo")
+        content.permissions.add(perm)
+
+        backend = AuthBackend()
+        engines = ["queryset", "sql", "bitset"]
+
+        def check(expected):
+            for engine in engines:
+                with override_settings(DJINN_AUTH_ENGINE=engine):
+                    tjibbe = User.objects.get(pk=self.tjibbe.pk)
+
+                    self.assertEqual(expected, backend.has_perm(
+                        tjibbe, "auth.do_something"), engine)
+
+            tjibbe = User.objects.get(pk=self.tjibbe.pk)
+
+            self.assertEqual(expected, "auth.do_something" in
+                             backend.get_all_permissions(tjibbe))
+            self.assertEqual(expected, has_perm_many(
+                tjibbe, "auth.do_something", [content])[content])
+            self.assertEqual(expected, filter_by_perm(
+                tjibbe, "auth.do_something",
+                AuthGroup.objects.all()).exists())
+
+        check(False)
+
+        self.tjibbes.permissions.add(perm)
+
+        check(False)
+
+        self.tjibbes.subgroups.add(self.juniors)
+
+        check(True)
+
+    def test_delete(self):
+
+        """ Deleting a group removes its members without m2m signals; they
+        should lose its roles anyway """
+
+        owner = Role.objects.create(name="owner")
+        perm, created = Permission.objects.get_or_create(
+            codename="do_something",
+            content_type=ContentType.objects.get_for_model(AuthGroup),
+            defaults={'name': 'Can do things'})
+        owner.add_permission(perm)
+
+        backend = AuthBackend()
+
+        for settings in [{'DJINN_AUTH_SHARED_CACHE': True},
+                         {'DJINN_AUTH_MATERIALIZE': True,
+                          'DJINN_AUTH_ENGINE': 'materialized'}]:
+
+            with override_settings(**settings):
+                get_cache().clear()
+
+                child = Group.objects.create(name="Child")
+                parent = Group.objects.create(name="Parent")
+
+                child.users.add(self.tjibbe)
+                parent.subgroups.add(child)
+                assign_global_role(parent, owner)
+
+                self.assertTrue(backend.has_perm(
+                    User.objects.get(pk=self.tjibbe.pk),
+                    "auth.do_something"))
+
+                child.delete()
+
+                self.assertFalse(backend.has_perm(
+                    User.objects.get(pk=self.tjibbe.pk),
+                    "auth.do_something"), settings)
+
+                parent.delete()
@@ -0,0 +1,107 @@
+from django.test.testcases import TestCase
+from django.contrib.auth.models import Group, User, Permission
+from django.contrib.contenttypes.models import ContentType
+from djinn_auth.models import Role
+from djinn_auth.utils import assign_global_role, assign_local_role, \
+    has_perm_many, prefetch_perms
+
+
+class HasPermManyTest(TestCase):
+
+    def setUp(self):
+
+        self.owner, created = Role.objects.get_or_create(name="owner")
+
+        ctype = ContentType.objects.get_for_model(Group)
+
+        self.perm, created = Permission.objects.get_or_create(
+            codename="do_something",
+            content_type=ctype, defaults={'name': 'Can do things'})
+
+        self.owner.add_permission(self.perm)
+
+        self.user = User.objects.create(username="Tjibbe")
+        self.content = [Group.objects.create(name="Content %d" % i)
+                        for i in range(3)]
+        self.role = Role.objects.create(name="Other")
+
+    def test_mixed_types(self):
+
+        assign_local_role(self.user, self.content[0], self.owner)
+        assign_local_role(self.user, self.role, self.owner)
+
+        objs = self.content + [self.role]
+
+        # warm up the permission index, groups and global roles
+        #
+        has_perm_many(self.user, "auth.do_something", [])
+
+        # user permissions and local grants for both content types
+        #
+        with self.assertNumQueries(2):
+            result = has_perm_many(self.user, "auth.do_something", objs)
+
+        self.assertEqual({self.content[0]: True, self.content[1]: False,
+                          self.content[2]: False, self.role: True},
+                         result)
+
+    def test_unsaved(self):
+
+        """ Unsaved objects get the verdict of has_perm """
+
+        unsaved = Group(name="Unsaved")
+
+        result = has_perm_many(self.user, "auth.do_something",
+                               [self.content[0], unsaved])
+
+        self.assertFalse(result[unsaved])
+        self.assertFalse(result.get(unsaved))
+        self.assertEqual(self.user.has_perm("auth.do_something", unsaved),
+                         result[unsaved])
+
+        assign_global_role(self.user, self.owner)
+        user = User.objects.get(pk=self.user.pk)
+
+        result = has_perm_many(user, "auth.do_something",
+                               [self.content[0], unsaved])
+
+        self.assertTrue(result[self.content[0]])
+        self.assertTrue(result[unsaved])
+        self.assertEqual(user.has_perm("auth.do_something", unsaved),
+                         result[unsaved])
+
+    def test_acquisition(self):
+
+        parent = Group.objects.create(name="Parent")
+
+        self.content[1].acquire_from = [parent]
+
+        assign_local_role(self.user, parent, self.owner)
+
+        result = has_perm_many(self.user, "auth.do_something", self.content)
+
+        self.assertEqual([False, True, False],
+                         [result[obj] for obj in self.content])
+
+    def test_global(self):
+
+        assign_global_role(self.user, self.owner)
+
+        self.content[2].acquire_global_roles = False
+
+        result = has_perm_many(self.user, "auth.do_something", self.content)
+
+        self.assertEqual([True, True, False],
+                         [result[obj] for obj in self.content])
+
+    def test_prefetch(self):
+
+        assign_local_role(self.user, self.content[1], self.owner)
+
+        prefetch_perms(self.user, "auth.do_something", self.content)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                [False, True, False],
+                [self.user.has_perm("auth.do_something", obj=obj)
+                 for obj in self.content])
@@ -0,0 +1,127 @@
+from django.http import HttpResponse
+from django.test.client import RequestFactory
+from django.test.testcases import TestCase
+from django.test.utils import override_settings
+from django.contrib.auth.models import Group, User, Permission
+from django.contrib.contenttypes.models import ContentType
+from djinn_auth import instrument
+from djinn_auth.authbackend import AuthBackend
+from djinn_auth.middleware import PermissionCheckMiddleware
+from djinn_auth.models import Role
+from djinn_auth.permindex import permission_index
+from djinn_auth.signals import permission_checked
+from djinn_auth.utils import assign_global_role, assign_local_role
+
+
+@override_settings(DJINN_AUTH_INSTRUMENT=True)
+class InstrumentTest(TestCase):
+
+    def setUp(self):
+
+        self.backend = AuthBackend()
+        self.owner = Role.objects.create(name="owner")
+
+        ctype = ContentType.objects.get_for_model(Group)
+
+        self.perm, created = Permission.objects.get_or_create(
+            codename="do_something",
+            content_type=ctype, defaults={'name': 'Can do things'})
+
+        self.owner.add_permission(self.perm)
+
+        self.checks = []
+        permission_checked.connect(self.receiver)
+
+        instrument.collector.reset()
+
+    def tearDown(self):
+
+        permission_checked.disconnect(self.receiver)
+
+    def receiver(self, sender, **kwargs):
+
+        self.checks.append(kwargs)
+
+    def test_sources(self):
+
+        tjibbe = User.objects.create(username="Tjibbe")
+        content = Group.objects.create(name="Foo")
+        parent = Group.objects.create(name="Bar")
+        content.acquire_from = [parent]
+
+        self.assertFalse(self.backend.has_perm(tjibbe, "auth.do_something"))
+
+        assign_local_role(tjibbe, parent, self.owner)
+
+        self.assertTrue(self.backend.has_perm(tjibbe, "auth.do_something",
+                                              obj=content))
+
+        assign_local_role(tjibbe, content, self.owner)
+
+        self.assertTrue(self.backend.has_perm(tjibbe, "auth.do_something",
+                                              obj=content))
+
+        assign_global_role(tjibbe, self.owner)
+
+        self.assertTrue(self.backend.has_perm(tjibbe, "auth.do_something"))
+
+        tjibbe.user_permissions.add(self.perm)
+
+        self.assertTrue(self.backend.has_perm(tjibbe, "auth.do_something"))
+
+        self.assertEqual([instrument.DENIED, instrument.ACQUIRED,
+                          instrument.LOCAL_ROLE, instrument.GLOBAL_ROLE,
+                          instrument.USER_SET],
+                         [check['source'] for check in self.checks])
+
+        self.assertTrue(all(check['queries'] > 0 for check in self.checks))
+        self.assertEqual("auth.do_something", self.checks[0]['permission'])
+
+        metrics = instrument.collector.render()
+
+        self.assertIn('djinn_auth_permission_checks_total'
+                      '{source="denied"} 1', metrics)
+        self.assertIn('djinn_auth_permission_check_seconds_count'
+                      '{source="acquired"} 1', metrics)
+
+    @override_settings(DJINN_AUTH_ENGINE='sql')
+    def test_engine_source(self):
+
+        tjibbe = User.objects.create(username="Tjibbe")
+
+        assign_global_role(tjibbe, self.owner)
+        permission_index.get_index()
+
+        self.assertTrue(self.backend.has_perm(tjibbe, "auth.do_something"))
+        self.assertEqual(['sql'], [check['source'] for check in self.checks])
+        self.assertEqual(1, self.checks[0]['queries'])
+
+    def test_middleware(self):
+
+        tjibbe = User.objects.create(username="Tjibbe")
+
+        def view(request):
+
+            self.backend.has_perm(tjibbe, "auth.do_something")
+            self.backend.has_perm(tjibbe, "auth.do_something", obj=tjibbe)
+
+            return HttpResponse()
+
+        with override_settings(DEBUG=True):
+            response = PermissionCheckMiddleware(view)(
+                RequestFactory().get("/"))
+
+        self.assertTrue(response["X-Djinn-Auth-Checks"].startswith(
+            "checks=2 granted=0 "))
+
+    def test_disabled(self):
+
+        with override_settings(DJINN_AUTH_INSTRUMENT=False):
+            self.assertEqual(self.backend._check_all_permissions,
+                             self.backend.get_check())
+
+            tjibbe = User.objects.create(username="Tjibbe")
+
+            self.backend.has_perm(tjibbe, "auth.do_something")
+
+        self.assertEqual([], self.checks)
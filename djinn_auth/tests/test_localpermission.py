@@ -0,0 +1,74 @@
+from django.test.testcases import TestCase
+from django.contrib.auth.models import Group, User, Permission
+from django.contrib.contenttypes.models import ContentType
+from djinn_auth.utils import set_local_permission, get_local_permissions, \
+    has_local_permission, assign_local_permission, \
+    unassign_local_permission, has_user_local_permission
+
+
+class LocalPermissionTest(TestCase):
+
+    def setUp(self):
+
+        self.content = Group.objects.create(name="Foo")
+
+        ctype = ContentType.objects.get_for_model(Group)
+
+        self.perm, created = Permission.objects.get_or_create(
+            codename="do_something",
+            content_type=ctype, defaults={'name': 'Can do things'})
+
+    def test_set_local_permission(self):
+
+        tjibbe = User.objects.create(username="Tjibbe")
+        gurbe = User.objects.create(username="Gurbe")
+
+        self.assertFalse(has_local_permission(tjibbe, self.content,
+                                              self.perm))
+
+        set_local_permission(tjibbe, self.content, self.perm)
+
+        self.assertTrue(has_local_permission(tjibbe, self.content,
+                                             self.perm))
+
+        set_local_permission(gurbe, self.content, "auth.do_something")
+
+        self.assertFalse(has_local_permission(tjibbe, self.content,
+                                              self.perm))
+        self.assertTrue(has_local_permission(gurbe, self.content,
+                                             "auth.do_something"))
+
+    def test_assign_local_permission(self):
+
+        tjibbe = User.objects.create(username="Tjibbe")
+        gurbe = User.objects.create(username="Gurbe")
+
+        assign_local_permission(tjibbe, self.content, self.perm)
+        assign_local_permission(gurbe, self.content, self.perm)
+        assign_local_permission(gurbe, self.content, self.perm)
+
+        self.assertEqual(2, len(get_local_permissions(self.content)))
+        self.assertEqual(2, len(get_local_permissions(self.content,
+                                                      self.perm)))
+
+        unassign_local_permission(tjibbe, self.content, self.perm)
+
+        self.assertFalse(has_local_permission(tjibbe, self.content,
+                                              self.perm))
+        self.assertTrue(has_local_permission(gurbe, self.content,
+                                             self.perm))
+
+    def test_local_permission_to_group(self):
+
+        tjibbe = User.objects.create(username="Tjibbe")
+        tjibbes = Group.objects.create(name="Tjibbes")
+
+        set_local_permission(tjibbes, self.content, self.perm)
+
+        self.assertFalse(has_user_local_permission(tjibbe, self.content,
+                                                   self.perm))
+
+        tjibbe.groups.add(tjibbes)
+
+        self.assertTrue(has_user_local_permission(tjibbe, self.content,
+                                                  self.perm))
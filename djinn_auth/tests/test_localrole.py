@@ -1,8 +1,14 @@
+from unittest import mock
+from asgiref.sync import async_to_sync
 from django.test.testcases import TestCase
 from django.contrib.auth.models import Group, User
+from django.contrib.contenttypes.models import ContentType
 from djinn_auth.models import Role
+from djinn_auth.signals import roles_changed
 from djinn_auth.utils import set_local_role, get_local_roles, has_local_role, \
-    assign_local_role, has_user_local_role
+    assign_local_role, has_user_local_role, bulk_assign_local_roles, \
+    bulk_unassign_local_roles, aget_user_local_roles, \
+    iter_user_local_instances
 
 
 class LocalRoleTest(TestCase):
@@ -81,3 +87,140 @@ class LocalRoleTest(TestCase):
 
         self.assertEquals(2, len(get_local_roles(self.content)))
         self.assertEquals(2, len(get_local_roles(self.content, self.owner)))
+
+    def test_bulk_assign_local_roles(self):
+
+        tjibbe = User.objects.create(username="Tjibbe")
+        gurbe = User.objects.create(username="Gurbe")
+        other = Group.objects.create(name="Bar")
+
+        assign_local_role(tjibbe, self.content, self.owner)
+
+        received = []
+
+        def receiver(sender, **kwargs):
+            received.append(kwargs)
+
+        roles_changed.connect(receiver)
+
+        try:
+            # Loading the role cache, existing rows, then the insert
+            #
+            with self.assertNumQueries(3):
+                created = bulk_assign_local_roles(
+                    [(tjibbe, self.content, "owner"),
+                     (gurbe, self.content, self.owner),
+                     (gurbe, self.content, self.owner),
+                     (gurbe, other, "owner")])
+
+            self.assertEqual(2, created)
+            self.assertEqual(1, len(received))
+            self.assertEqual(2, len(received[0]['instances']))
+
+            self.assertTrue(has_local_role(tjibbe, self.content, self.owner))
+            self.assertTrue(has_local_role(gurbe, self.content, self.owner))
+            self.assertTrue(has_local_role(gurbe, other, self.owner))
+
+            with self.assertNumQueries(2):
+                removed = bulk_unassign_local_roles(
+                    [(gurbe, self.content, self.owner),
+                     (gurbe, other, self.owner),
+                     (tjibbe, other, self.owner)])
+
+            self.assertEqual(2, removed)
+            self.assertEqual(2, len(received))
+        finally:
+            roles_changed.disconnect(receiver)
+
+        self.assertTrue(has_local_role(tjibbe, self.content, self.owner))
+        self.assertFalse(has_local_role(gurbe, self.content, self.owner))
+        self.assertFalse(has_local_role(gurbe, other, self.owner))
+
+    def test_bulk_unassign_exact(self):
+
+        """ Only the given assignments are matched, not every combination
+        of their values """
+
+        tjibbe = User.objects.create(username="Tjibbe")
+        gurbe = User.objects.create(username="Gurbe")
+        other = Group.objects.create(name="Bar")
+
+        assign_local_role(tjibbe, self.content, self.owner)
+        assign_local_role(gurbe, other, self.owner)
+
+        # A lookup and a delete per row
+        #
+        with mock.patch("djinn_auth.utils.BULK_CHUNK_SIZE", 1):
+            with self.assertNumQueries(4):
+                removed = bulk_unassign_local_roles(
+                    [(tjibbe, other, self.owner),
+                     (gurbe, self.content, self.owner),
+                     (gurbe, other, self.owner)])
+
+        self.assertEqual(1, removed)
+        self.assertTrue(has_local_role(tjibbe, self.content, self.owner))
+        self.assertFalse(has_local_role(gurbe, other, self.owner))
+
+    def test_bulk_assign_invalidates(self):
+
+        tjibbe = User.objects.create(username="Tjibbe")
+
+        self.assertFalse(has_user_local_role(tjibbe, self.content, self.owner))
+
+        bulk_assign_local_roles([(tjibbe, self.content, self.owner)])
+
+        self.assertTrue(has_user_local_role(tjibbe, self.content, self.owner))
+
+        bulk_unassign_local_roles([(tjibbe, self.content, self.owner)])
+
+        self.assertFalse(has_user_local_role(tjibbe, self.content, self.owner))
+
+    def test_async_user_roles(self):
+
+        tjibbe = User.objects.create(username="Tjibbe")
+
+        assign_local_role(tjibbe, self.content, self.owner)
+
+        self.assertEqual(
+            [self.owner],
+            async_to_sync(aget_user_local_roles)(tjibbe, self.content,
+                                                 as_role=True))
+
+    def test_iter_user_local_instances(self):
+
+        tjibbe = User.objects.create(username="Tjibbe")
+        tjibbes = Group.objects.create(name="Tjibbes")
+        other = Group.objects.create(name="Bar")
+        editor = Role.objects.create(name="editor")
+
+        tjibbe.groups.add(tjibbes)
+
+        assign_local_role(tjibbe, self.content, self.owner)
+        assign_local_role(tjibbes, self.content, editor)
+        assign_local_role(tjibbes, other, editor)
+        assign_local_role(tjibbe, tjibbe, self.owner)
+
+        ctype = ContentType.objects.get_for_model(Group)
+        user_ctype = ContentType.objects.get_for_model(User)
+
+        self.assertEqual(
+            set([(ctype, self.content.id), (ctype, other.id),
+                 (user_ctype, tjibbe.id)]),
+            set(iter_user_local_instances(tjibbe)))
+
+        self.assertEqual(
+            [(ctype, self.content.id), (ctype, other.id)],
+            list(iter_user_local_instances(tjibbe, role="editor")))
+
+        self.assertEqual(
+            [(ctype, self.content.id)],
+            list(iter_user_local_instances(tjibbe, role=self.owner,
+                                           ct=Group)))
+
+        self.assertEqual(
+            [], list(iter_user_local_instances(tjibbe, role="nobody")))
+
+        self.assertEqual(
+            [(ctype, self.content), (ctype, other)],
+            list(iter_user_local_instances(tjibbe, ct=ctype, resolve=True,
+                                           chunk_size=1)))
@@ -0,0 +1,110 @@
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import override_settings
+from django.test.testcases import TestCase
+from django.contrib.auth.models import User, Group
+from djinn_auth import ctcache, partitions
+from djinn_auth.models import Role, LocalRole
+from djinn_auth.utils import assign_local_role
+
+
+class PartitionsTest(TestCase):
+
+    def setUp(self):
+
+        self.owner = Role.objects.create(name="owner")
+
+    def test_instances_filter(self):
+
+        tjibbe = User.objects.create(username="Tjibbe")
+        group0 = Group.objects.create(name="Group0")
+        group1 = Group.objects.create(name="Group1")
+
+        assign_local_role(tjibbe, group0, self.owner)
+        assign_local_role(tjibbe, group1, self.owner)
+
+        group_ct_id = ctcache.get_ct_id(Group)
+
+        _filter = partitions.instances_filter([(group_ct_id, group0.id)])
+
+        self.assertEqual(1, LocalRole.objects.filter(_filter).count())
+
+        # Every condition holds the content type
+        #
+        self.assertEqual(
+            [('instance_ct_id', group_ct_id),
+             ('instance_id__in', [group0.id, group1.id])],
+            partitions.instances_filter([(group_ct_id, group1.id),
+                                         (group_ct_id, group0.id)]).children)
+
+    def test_partition_sql(self):
+
+        clause, statements = partitions.get_partition_sql(
+            connection, "djinn_auth_localrole", partitions.INSTANCE_CT,
+            ctype_ids=[7, 3])
+
+        self.assertEqual('PARTITION BY LIST ("instance_ct_id")', clause)
+        self.assertEqual(
+            ['CREATE TABLE "djinn_auth_localrole_ct3" PARTITION OF '
+             '"djinn_auth_localrole" FOR VALUES IN (3)',
+             'CREATE TABLE "djinn_auth_localrole_ct7" PARTITION OF '
+             '"djinn_auth_localrole" FOR VALUES IN (7)',
+             'CREATE TABLE "djinn_auth_localrole_default" PARTITION OF '
+             '"djinn_auth_localrole" DEFAULT'], statements)
+
+        with override_settings(DJINN_AUTH_LOCALROLE_PARTITIONS=4):
+            clause, statements = partitions.get_partition_sql(
+                connection, "djinn_auth_localrole", partitions.INSTANCE_ID)
+
+        self.assertEqual('PARTITION BY HASH ("instance_id")', clause)
+        self.assertEqual(4, len(statements))
+        self.assertEqual(
+            'CREATE TABLE "djinn_auth_localrole_p3" PARTITION OF '
+            '"djinn_auth_localrole" FOR VALUES WITH (MODULUS 4, REMAINDER 3)',
+            statements[3])
+
+        with self.assertRaises(partitions.PartitionError):
+            partitions.get_partition_sql(connection, "djinn_auth_localrole",
+                                         "role")
+
+    def test_constraint_sql(self):
+
+        constraint = {'columns': [], 'primary_key': False, 'unique': False,
+                      'foreign_key': None, 'check': False, 'index': False}
+
+        constraints = {
+            'lr_pkey': dict(constraint, columns=['id'], primary_key=True,
+                            unique=True),
+            'lr_fk': dict(constraint, columns=['role_id'],
+                          foreign_key=('djinn_auth_role', 'id')),
+            'lr_uniq': dict(constraint, columns=['instance_ct_id',
+                                                 'instance_id'],
+                            unique=True),
+            'lr_idx': dict(constraint, columns=['assignee_id'], index=True),
+            'lr_check': dict(constraint, columns=['instance_id'],
+                             check=True),
+        }
+
+        self.assertEqual(
+            ['ALTER TABLE "lr" ADD CONSTRAINT "lr_fk" FOREIGN KEY '
+             '("role_id") REFERENCES "djinn_auth_role" ("id") DEFERRABLE '
+             'INITIALLY DEFERRED',
+             'CREATE INDEX "lr_idx" ON "lr" ("assignee_id")',
+             'ALTER TABLE "lr" ADD CONSTRAINT "lr_pkey" PRIMARY KEY '
+             '("id", "instance_id")',
+             'ALTER TABLE "lr" ADD CONSTRAINT "lr_uniq" UNIQUE '
+             '("instance_ct_id", "instance_id")'],
+            partitions.get_constraint_sql(connection, "lr", constraints,
+                                          ["id", "instance_id"]))
+
+    def test_command(self):
+
+        """ SQLite keeps the single table """
+
+        with self.assertRaises(CommandError):
+            call_command("djinn_auth_partition_localroles",
+                         key=partitions.INSTANCE_CT, dry_run=True)
+
+        with self.assertRaises(CommandError):
+            call_command("djinn_auth_partition_localroles")
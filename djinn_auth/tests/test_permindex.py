@@ -0,0 +1,176 @@
+from unittest import mock
+from django.apps import apps
+from django.db import transaction
+from django.db.models.signals import post_migrate
+from django.test.testcases import TestCase
+from django.test.utils import override_settings
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from djinn_auth.models import Role
+from djinn_auth.permindex import permission_index, get_cache, VERSION_KEY
+
+
+class PermissionIndexTest(TestCase):
+
+    def setUp(self):
+
+        self.owner = Role.objects.create(name="owner")
+
+        ctype = ContentType.objects.get_for_model(Group)
+
+        self.perm, created = Permission.objects.get_or_create(
+            codename="do_something",
+            content_type=ctype, defaults={'name': 'Can do things'})
+
+    def test_lookup(self):
+
+        self.assertEqual(frozenset(),
+                         permission_index.get_role_ids("auth.do_something"))
+
+        self.owner.add_permission(self.perm)
+
+        perm_ids, role_ids = permission_index.lookup("auth.do_something")
+
+        self.assertEqual(frozenset([self.perm.id]), perm_ids)
+        self.assertEqual(frozenset([self.owner.id]), role_ids)
+
+        with self.assertNumQueries(0):
+            permission_index.lookup("auth.do_something")
+
+        self.owner.permissions.remove(self.perm)
+
+        self.assertEqual(frozenset(),
+                         permission_index.get_role_ids("auth.do_something"))
+
+    def test_unknown_permission(self):
+
+        permission_index.get_index()
+
+        with self.assertNumQueries(0):
+            self.assertEqual((frozenset(), frozenset()),
+                             permission_index.lookup("auth.do_nothing"))
+            self.assertEqual((frozenset(), frozenset()),
+                             permission_index.lookup("do_something"))
+
+        with self.assertRaises(Permission.DoesNotExist):
+            permission_index.get_permission("auth.do_nothing")
+
+    def test_app_label(self):
+
+        """ Codenames may be used by several apps """
+
+        ctype = ContentType.objects.get_for_model(Role)
+
+        other, created = Permission.objects.get_or_create(
+            codename="do_something",
+            content_type=ctype, defaults={'name': 'Can do things'})
+
+        self.assertEqual(frozenset([self.perm.id]),
+                         permission_index.get_permission_ids(
+                             "auth.do_something"))
+        self.assertEqual(frozenset([other.id]),
+                         permission_index.get_permission_ids(
+                             "djinn_auth.do_something"))
+
+        self.assertEqual(other,
+                         permission_index.get_permission(
+                             "djinn_auth.do_something"))
+
+        with self.assertNumQueries(0):
+            permission_index.get_permission("djinn_auth.do_something")
+
+    def test_shared_version(self):
+
+        """ Another process bumping the version should trigger a reload """
+
+        permission_index.lookup("auth.do_something")
+
+        get_cache().incr(VERSION_KEY)
+
+        # Not seen within the check interval
+        #
+        with override_settings(DJINN_AUTH_INDEX_CHECK_INTERVAL=60):
+            with self.assertNumQueries(0):
+                permission_index.lookup("auth.do_something")
+
+        with override_settings(DJINN_AUTH_INDEX_CHECK_INTERVAL=0):
+            with self.assertNumQueries(2):
+                permission_index.lookup("auth.do_something")
+
+            with self.assertNumQueries(0):
+                permission_index.lookup("auth.do_something")
+
+    def test_check_interval(self):
+
+        """ The shared version is read once within the check interval """
+
+        permission_index.lookup("auth.do_something")
+
+        cache = get_cache()
+
+        with mock.patch.object(cache, "get", wraps=cache.get) as get:
+            for i in range(10):
+                permission_index.lookup("auth.do_something")
+                permission_index.get_role_permission_ids(self.owner.id)
+
+            self.assertEqual(0, get.call_count)
+
+            with override_settings(DJINN_AUTH_INDEX_CHECK_INTERVAL=0):
+                permission_index.lookup("auth.do_something")
+
+            self.assertEqual(1, get.call_count)
+
+    def test_commit(self):
+
+        """ Other processes learn about changes once committed """
+
+        permission_index.lookup("auth.do_something")
+        version = permission_index.get_shared_version()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.owner.add_permission(self.perm)
+
+            self.assertEqual(frozenset([self.owner.id]),
+                             permission_index.get_role_ids(
+                                 "auth.do_something"))
+            self.assertEqual(version, permission_index.get_shared_version())
+
+        self.assertTrue(version < permission_index.get_shared_version())
+        self.assertEqual(frozenset([self.owner.id]),
+                         permission_index.get_role_ids("auth.do_something"))
+
+    def test_rollback(self):
+
+        self.assertEqual(frozenset(),
+                         permission_index.get_role_ids("auth.do_something"))
+
+        try:
+            with transaction.atomic():
+                self.owner.add_permission(self.perm)
+
+                self.assertEqual(frozenset([self.owner.id]),
+                                 permission_index.get_role_ids(
+                                     "auth.do_something"))
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertEqual(frozenset(),
+                         permission_index.get_role_ids("auth.do_something"))
+
+    def test_migrate(self):
+
+        """ Permissions created after migrations don't send post_save """
+
+        permission_index.get_index()
+
+        Permission.objects.bulk_create([Permission(
+            codename="zap", name="Can zap",
+            content_type=ContentType.objects.get_for_model(Group))])
+
+        post_migrate.send(sender=apps.get_app_config("djinn_auth"),
+                          app_config=apps.get_app_config("djinn_auth"),
+                          verbosity=0, interactive=False, using="default",
+                          apps=apps, plan=[])
+
+        self.assertTrue(permission_index.get_permission_ids("auth.zap"))
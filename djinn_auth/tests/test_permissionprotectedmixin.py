@@ -1,3 +1,4 @@
+from asgiref.sync import async_to_sync
 from django.core.exceptions import PermissionDenied
 from django.test.testcases import TestCase
 from django.contrib.auth.models import User
@@ -45,6 +46,20 @@ class ClosedDetailView(BaseView):
         return self.obj
 
 
+class AsyncView(PermissionProtectedMixin, View):
+
+    view_is_async = True
+    permission = {'GET': "contenttypes.view"}
+
+    async def get(self, request, *args, **kwargs):
+
+        return "GET OK"
+
+    async def post(self, request, *args, **kwargs):
+
+        return "POST OK"
+
+
 class Request(object):
 
     def __init__(self, method, user):
@@ -98,6 +113,21 @@ class PermissionProtectedMixinTest(TestCase):
         self.assertEqual('Not authorized', str(ctx.exception),
                          "GET should be forbidden")
 
+    def test_async(self):
+
+        view = AsyncView.as_view()
+
+        self.assertEqual("POST OK",
+                         async_to_sync(view)(Request("POST", self.user)))
+
+        with self.assertRaises(PermissionDenied):
+            async_to_sync(view)(Request("GET", self.user))
+
+        self.user.user_permissions.add(self.perm)
+
+        self.assertEqual("GET OK",
+                         async_to_sync(view)(Request("GET", self.user)))
+
     def OFFtest_object_view(self):
 
         thing = self.user.profile
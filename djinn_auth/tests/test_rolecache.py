@@ -0,0 +1,74 @@
+from django.test.testcases import TestCase
+from django.test.utils import override_settings
+from django.contrib.auth.models import User
+from djinn_auth.models import Role
+from djinn_auth.permindex import get_cache, VERSION_KEY
+from djinn_auth.rolecache import role_cache
+from djinn_auth.utils import assign_global_role, has_global_role
+
+
+class RoleCacheTest(TestCase):
+
+    def setUp(self):
+
+        self.owner = Role.objects.create(name="owner")
+
+    def test_get_role(self):
+
+        self.assertEqual(self.owner, role_cache.get_role("owner"))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.owner.id, role_cache.get_role_id("owner"))
+            self.assertEqual(None, role_cache.get_role_id("nobody"))
+
+        with self.assertRaises(Role.DoesNotExist):
+            role_cache.get_role("nobody")
+
+    def test_copies(self):
+
+        """ Changing a role that was looked up doesn't change the cache """
+
+        role = role_cache.get_role("owner")
+        role.name = "proprietor"
+
+        with self.assertNumQueries(0):
+            self.assertEqual("owner", role_cache.get_role("owner").name)
+            self.assertIsNot(role, role_cache.get_role("owner"))
+
+    def test_invalidate(self):
+
+        role_cache.get_role("owner")
+
+        self.owner.name = "proprietor"
+        self.owner.save()
+
+        self.assertEqual(None, role_cache.get_role_id("owner"))
+        self.assertEqual(self.owner.id, role_cache.get_role_id("proprietor"))
+
+        self.owner.delete()
+
+        self.assertEqual(None, role_cache.get_role_id("proprietor"))
+
+    def test_shared_version(self):
+
+        """ Another process bumping the version should trigger a reload """
+
+        role_cache.get_role("owner")
+
+        get_cache().incr(VERSION_KEY)
+
+        with override_settings(DJINN_AUTH_INDEX_CHECK_INTERVAL=0):
+            with self.assertNumQueries(1):
+                role_cache.get_role("owner")
+
+    def test_role_by_name(self):
+
+        tjibbe = User.objects.create(username="Tjibbe")
+
+        assign_global_role(tjibbe, "owner")
+
+        with self.assertNumQueries(1):
+            self.assertTrue(has_global_role(tjibbe, "owner"))
+
+        with self.assertNumQueries(0):
+            self.assertFalse(has_global_role(tjibbe, "nobody"))
@@ -0,0 +1,158 @@
+import io
+import zlib
+from unittest import mock
+from django.test.testcases import TestCase
+from django.test.utils import override_settings
+from django.contrib.auth.models import Group, User, Permission
+from django.contrib.contenttypes.models import ContentType
+from djinn_auth import sharedcache
+from djinn_auth.models import Role, GlobalRole, LocalRole, LocalPermission
+from djinn_auth.permindex import get_cache
+from djinn_auth.snapshot import export_snapshot, import_snapshot, \
+    SnapshotError, MAGIC, FRAME
+from djinn_auth.utils import assign_global_role, assign_local_role, \
+    assign_local_permission
+
+
+class SnapshotTest(TestCase):
+
+    def setUp(self):
+
+        self.owner = Role.objects.create(name="owner")
+        self.editor = Role.objects.create(name="editor")
+
+        ctype = ContentType.objects.get_for_model(Group)
+
+        self.perm, created = Permission.objects.get_or_create(
+            codename="do_something",
+            content_type=ctype, defaults={'name': 'Can do things'})
+
+        self.owner.add_permission(self.perm)
+
+        self.tjibbe = User.objects.create(username="Tjibbe")
+        self.tjibbes = Group.objects.create(name="Tjibbes")
+
+        assign_global_role(self.tjibbe, self.editor)
+
+        for i in range(25):
+            content = Group.objects.create(name="Foo %d" % i)
+            assign_local_role(self.tjibbe, content, self.owner)
+            assign_local_role(self.tjibbes, content, self.editor)
+
+        assign_local_permission(self.tjibbe, self.tjibbes, self.perm)
+
+    def get_state(self):
+
+        return (
+            set(GlobalRole.objects.values_list(
+                'assignee_ct', 'assignee_id', 'role__name')),
+            set(LocalRole.objects.values_list(
+                'instance_ct', 'instance_id', 'assignee_ct', 'assignee_id',
+                'role__name')),
+            set(LocalPermission.objects.values_list(
+                'instance_ct', 'instance_id', 'assignee_ct', 'assignee_id',
+                'permission')),
+            set(Role.objects.values_list('name', 'permissions')))
+
+    def test_roundtrip(self):
+
+        state = self.get_state()
+        snapshot = io.BytesIO()
+
+        self.assertEqual({'GlobalRole': 1, 'LocalRole': 50,
+                          'LocalPermission': 1},
+                         export_snapshot(snapshot, chunk_size=20))
+
+        GlobalRole.objects.all().delete()
+        LocalRole.objects.all().delete()
+        LocalPermission.objects.all().delete()
+        Role.objects.all().delete()
+
+        snapshot.seek(0)
+        self.assertEqual({'GlobalRole': 1, 'LocalRole': 50,
+                          'LocalPermission': 1},
+                         import_snapshot(snapshot))
+
+        self.assertEqual(state, self.get_state())
+
+        # Importing again doesn't duplicate, replacing doesn't remove
+        #
+        snapshot.seek(0)
+        self.assertEqual({'GlobalRole': 0, 'LocalRole': 0,
+                          'LocalPermission': 0},
+                         import_snapshot(snapshot))
+
+        snapshot.seek(0)
+        self.assertEqual({'GlobalRole': 1, 'LocalRole': 50,
+                          'LocalPermission': 1},
+                         import_snapshot(snapshot, replace=True))
+
+        self.assertEqual(state, self.get_state())
+
+    def test_unknown_content_type(self):
+
+        """ Rows of models that aren't installed are skipped, and no
+        content types are created for them """
+
+        ctype = ContentType.objects.create(app_label="gone", model="thing")
+        LocalRole.objects.create(
+            instance_ct=ctype, instance_id=1,
+            assignee_ct=ContentType.objects.get_for_model(User),
+            assignee_id=self.tjibbe.id, role=self.owner)
+
+        snapshot = io.BytesIO()
+        export_snapshot(snapshot)
+
+        LocalRole.objects.all().delete()
+        ctype.delete()
+
+        snapshot.seek(0)
+
+        with self.assertLogs("djinn_auth", "WARNING"):
+            self.assertEqual(50, import_snapshot(snapshot)['LocalRole'])
+
+        self.assertFalse(ContentType.objects.filter(
+            app_label="gone").exists())
+
+    def test_too_many_roles(self):
+
+        with mock.patch("djinn_auth.snapshot.MAX_ITEMS", 1):
+            with self.assertRaises(SnapshotError):
+                export_snapshot(io.BytesIO())
+
+    @override_settings(DJINN_AUTH_SHARED_CACHE=True)
+    def test_shared_cache(self):
+
+        """ Importing invalidates all entries of the shared cache """
+
+        snapshot = io.BytesIO()
+        export_snapshot(snapshot)
+
+        epoch = sharedcache.get_generations(
+            [sharedcache.EPOCH_KEY])[sharedcache.EPOCH_KEY]
+
+        snapshot.seek(0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            import_snapshot(snapshot)
+
+        self.assertEqual(epoch + 1, get_cache().get(sharedcache.EPOCH_KEY))
+
+    def test_invalid(self):
+
+        with self.assertRaises(SnapshotError):
+            import_snapshot(io.BytesIO(b"<django-objects/>"))
+
+        payload = zlib.compress(b"{}")
+
+        # Payload shorter than the frame says
+        #
+        with self.assertRaises(SnapshotError):
+            import_snapshot(io.BytesIO(
+                MAGIC + FRAME.pack(b"META", len(payload) + 10) + payload))
+
+        # Payload that doesn't decompress
+        #
+        with self.assertRaises(SnapshotError):
+            import_snapshot(io.BytesIO(
+                MAGIC + FRAME.pack(b"META", 4) + b"junk"))
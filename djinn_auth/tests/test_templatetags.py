@@ -0,0 +1,98 @@
+from django.template import Context, Template
+from django.test.testcases import TestCase
+from django.test.utils import override_settings
+from django.contrib.auth.models import Group, User, Permission
+from django.contrib.contenttypes.models import ContentType
+from djinn_auth.models import Role
+from djinn_auth.permindex import permission_index
+from djinn_auth.utils import assign_local_role
+
+
+TEMPLATE = """{% load djinn_auth_tags %}{% preload_perms user groups "view" %}
+{% for group in groups %}{% if_has_perm group user "view" %}{{ group.name }}
+{% else %}-
+{% endif_has_perm %}{% endfor %}"""
+
+
+class NameBackend(object):
+
+    """ Grants everything on groups named 'Public' """
+
+    def has_perm(self, user_obj, perm, obj=None):
+
+        return getattr(obj, "name", None) == "Public"
+
+
+@override_settings(TEMPLATES=[
+    {'BACKEND': 'django.template.backends.django.DjangoTemplates'}])
+class TemplateTagsTest(TestCase):
+
+    def setUp(self):
+
+        self.owner = Role.objects.create(name="owner")
+
+        ctype = ContentType.objects.get_for_model(Group)
+
+        perm, created = Permission.objects.get_or_create(
+            codename="view_group",
+            content_type=ctype, defaults={'name': 'Can view group'})
+
+        self.owner.add_permission(perm)
+
+    def test_if_has_perm(self):
+
+        tjibbe = User.objects.create(username="Tjibbe")
+        group = Group.objects.create(name="Foo")
+
+        template = Template(
+            """{% load djinn_auth_tags %}"""
+            """{% if_has_perm group user "view" %}yes{% else %}no"""
+            """{% endif_has_perm %}""")
+
+        self.assertEqual("no", template.render(
+            Context({'user': tjibbe, 'group': group})))
+
+        assign_local_role(tjibbe, group, self.owner)
+
+        self.assertEqual("yes", template.render(
+            Context({'user': tjibbe, 'group': group})))
+
+    def test_preload_perms(self):
+
+        tjibbe = User.objects.create(username="Tjibbe")
+        groups = [Group.objects.create(name="Group_%d" % i)
+                  for i in range(20)]
+
+        for group in groups[::2]:
+            assign_local_role(tjibbe, group, self.owner)
+
+        permission_index.get_index()
+
+        # Fetch the user again, so nothing is cached on it
+        #
+        tjibbe = User.objects.get(pk=tjibbe.pk)
+
+        with self.assertNumQueries(4):
+            output = Template(TEMPLATE).render(
+                Context({'user': tjibbe, 'groups': groups}))
+
+        self.assertEqual(
+            [group.name if i % 2 == 0 else "-"
+             for i, group in enumerate(groups)],
+            output.split())
+
+    @override_settings(AUTHENTICATION_BACKENDS=[
+        "djinn_auth.tests.test_templatetags.NameBackend",
+        "djinn_auth.authbackend.AuthBackend"])
+    def test_preload_other_backends(self):
+
+        """ Preloaded denials don't hide grants of other backends """
+
+        tjibbe = User.objects.create(username="Tjibbe")
+        groups = [Group.objects.create(name=name)
+                  for name in ["Private", "Public"]]
+
+        output = Template(TEMPLATE).render(
+            Context({'user': tjibbe, 'groups': groups}))
+
+        self.assertEqual(["-", "Public"], output.split())
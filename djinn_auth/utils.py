@@ -1,36 +1,59 @@
+from asgiref.sync import sync_to_async
 from django.contrib.contenttypes.models import ContentType
-from django.db.models import Q
+from django.db import connections, router
+from django.db.models import Exists, IntegerField, Q, Value
 from django.contrib.auth.models import Group
-from django.contrib.auth import get_user_model
 from django.conf import settings
-from django.core.exceptions import ImproperlyConfigured
-from django.apps import apps
-from djinn_auth.models import LocalRole, GlobalRole, Role
+from djinn_auth.models import LocalRole, GlobalRole, LocalPermission, \
+    GroupClosure, Group as DjinnGroup
+from djinn_auth.cache import get_permission_cache, instance_key, \
+    invalidate_permission_cache, verdict_key
+from djinn_auth.permindex import permission_index
+from djinn_auth.rolecache import role_cache
+from djinn_auth import ctcache, partitions, sharedcache
+from djinn_auth.signals import roles_changed
+
+
+# Kinds of local grants
+#
+ROLE = 0
+PERMISSION = 1
+
+# Rows per query of the bulk (un)assignments
+#
+BULK_CHUNK_SIZE = 100
 
 
 def get_group_model():
 
     """Even though Django doesn't let you override the group model, we
-    do...
+    do... The model is resolved once, see djinn_auth.ctcache.
 
     """
 
-    group_model = Group
+    return ctcache.get_group_model()
+
 
-    if getattr(settings, 'AUTH_GROUP_MODEL', None):
-        try:
-            app_label, model_name = settings.AUTH_GROUP_MODEL.split('.')
-        except ValueError:
-            raise ImproperlyConfigured(
-                "AUTH_GROUP_MODEL must be of the form 'app_label.model_name'")
+def get_role(role):
+
+    """ Return the Role for the given role name, from the process wide role
+    cache. Role objects are returned as is. """
+
+    if type(role) in [str]:
+        role = role_cache.get_role(role)
 
-        group_model = apps.get_model(app_label, model_name)
+    return role
 
-        if group_model is None:
-            raise ImproperlyConfigured("AUTH_GROUP_MODEL refers to model '%s' "
-                                       "that has not been installed" %
-                                       settings.AUTH_GROUP_MODEL)
-    return group_model
+
+def get_role_id(role):
+
+    """ Return the id of the given role or role name, or None if there is
+    no role by that name """
+
+    if type(role) in [str]:
+        return role_cache.get_role_id(role)
+
+    return role.id
 
 
 def set_local_role(assignee, instance, role):
@@ -40,19 +63,20 @@ def set_local_role(assignee, instance, role):
 
     """
 
-    if type(role) in [str]:
-        role = Role.objects.get(name=role)
+    role = get_role(role)
 
-    ctype = ContentType.objects.get_for_model(instance)
+    ctype_id = ctcache.get_ct_id(instance)
 
     LocalRole.objects.filter(
         role=role,
         instance_id=instance.id,
-        instance_ct=ctype).delete()
+        instance_ct_id=ctype_id).delete()
 
     LocalRole.objects.create(instance=instance, assignee=assignee,
                              role=role)
 
+    invalidate_permission_cache(assignee)
+
 
 def assign_local_role(assignee, instance, role):
 
@@ -61,63 +85,263 @@ def assign_local_role(assignee, instance, role):
 
     """
 
-    instance_ct = ContentType.objects.get_for_model(instance)
-    assignee_ct = ContentType.objects.get_for_model(assignee)
+    instance_ct_id = ctcache.get_ct_id(instance)
+    assignee_ct_id = ctcache.get_ct_id(assignee)
 
-    if type(role) in [str]:
-        role = Role.objects.get(name=role)
+    role = get_role(role)
 
-    LocalRole.objects.get_or_create(instance_ct=instance_ct,
-                                    assignee_ct=assignee_ct,
+    LocalRole.objects.get_or_create(instance_ct_id=instance_ct_id,
+                                    assignee_ct_id=assignee_ct_id,
                                     instance_id=instance.id,
                                     assignee_id=assignee.id,
                                     role=role)
 
+    invalidate_permission_cache(assignee)
+
 
 def unassign_local_role(assignee, instance, role):
 
     """Unassign the local role on the given instance for the assignee"""
 
-    instance_ct = ContentType.objects.get_for_model(instance)
-    assignee_ct = ContentType.objects.get_for_model(assignee)
+    instance_ct_id = ctcache.get_ct_id(instance)
+    assignee_ct_id = ctcache.get_ct_id(assignee)
 
-    if type(role) in [str]:
-        role = Role.objects.get(name=role)
+    role = get_role(role)
 
-    LocalRole.objects.filter(instance_ct=instance_ct,
-                             assignee_ct=assignee_ct,
+    LocalRole.objects.filter(instance_ct_id=instance_ct_id,
+                             assignee_ct_id=assignee_ct_id,
                              instance_id=instance.id,
                              assignee_id=assignee.id,
                              role=role).delete()
 
+    invalidate_permission_cache(assignee)
+
 
 def assign_global_role(assignee, role):
 
     """Assign the global role to the assignee if it's not already there"""
 
-    assignee_ct = ContentType.objects.get_for_model(assignee)
+    assignee_ct_id = ctcache.get_ct_id(assignee)
 
-    if type(role) in [str]:
-        role = Role.objects.get(name=role)
+    role = get_role(role)
 
-    GlobalRole.objects.get_or_create(assignee_ct=assignee_ct,
+    GlobalRole.objects.get_or_create(assignee_ct_id=assignee_ct_id,
                                      assignee_id=assignee.id,
                                      role=role)
 
+    invalidate_permission_cache(assignee)
+
 
 def unassign_global_role(assignee, role):
 
     """Remove the global role for the asignee"""
 
-    assignee_ct = ContentType.objects.get_for_model(assignee)
+    assignee_ct_id = ctcache.get_ct_id(assignee)
 
-    if type(role) in [str]:
-        role = Role.objects.get(name=role)
+    role = get_role(role)
 
-    GlobalRole.objects.filter(assignee_ct=assignee_ct,
+    GlobalRole.objects.filter(assignee_ct_id=assignee_ct_id,
                               assignee_id=assignee.id,
                               role=role).delete()
 
+    invalidate_permission_cache(assignee)
+
+
+def _chunks(rows):
+
+    rows = list(rows)
+
+    for i in range(0, len(rows), BULK_CHUNK_SIZE):
+        yield rows[i:i + BULK_CHUNK_SIZE]
+
+
+def _bulk_fields(model):
+
+    """ Return the fields of the model's unique_together """
+
+    return [model._meta.get_field(field)
+            for field in model._meta.unique_together[0]]
+
+
+def _bulk_assignments(model, rows):
+
+    """Find the given assignments in the database. The rows are tuples of
+    field values, in the order of the model's unique_together. Return a
+    dict of row to primary key of the existing assignments, using a
+    query per BULK_CHUNK_SIZE rows.
+
+    """
+
+    fields = [field.attname for field in _bulk_fields(model)]
+    existing = {}
+
+    for chunk in _chunks(rows):
+        _filter = Q()
+
+        for row in chunk:
+            _filter |= Q(**dict(zip(fields, row)))
+
+        existing.update(
+            (tuple(values[1:]), values[0]) for values in
+            model.objects.filter(_filter).values_list('id', *fields))
+
+    return existing
+
+
+def _bulk_delete(model, rows):
+
+    """Delete the given assignments, with rows like for
+    _bulk_assignments. The rows are deleted in SQL, to skip the signals
+    per row. The conditions hold all fields, including those of the
+    instance, so on a partitioned table the delete is routed to the
+    partitions.
+
+    """
+
+    connection = connections[router.db_for_write(model)]
+    qn = connection.ops.quote_name
+
+    condition = "(%s)" % " AND ".join(
+        "%s = %%s" % qn(field.column) for field in _bulk_fields(model))
+
+    with connection.cursor() as cursor:
+        for chunk in _chunks(rows):
+            cursor.execute(
+                "DELETE FROM %s WHERE %s" % (
+                    qn(model._meta.db_table),
+                    " OR ".join([condition] * len(chunk))),
+                [value for row in chunk for value in row])
+
+
+def bulk_assign_local_roles(assignments, batch_size=1000):
+
+    """Assign local roles in bulk. The assignments are (assignee,
+    instance, role) tuples, where role may be a Role or a role name.
+    Existing assignments are skipped. Instead of a signal per row, a
+    single roles_changed signal is sent. Return the number of
+    assignments created.
+
+    """
+
+    rows = set()
+
+    for assignee, instance, role in assignments:
+        rows.add((ctcache.get_ct_id(instance),
+                  instance.id,
+                  ctcache.get_ct_id(assignee),
+                  assignee.id,
+                  get_role(role).id))
+
+    if not rows:
+        return 0
+
+    existing = _bulk_assignments(LocalRole, rows)
+
+    LocalRole.objects.bulk_create([
+        LocalRole(instance_ct_id=row[0], instance_id=row[1],
+                  assignee_ct_id=row[2], assignee_id=row[3], role_id=row[4])
+        for row in rows if row not in existing],
+        batch_size=batch_size, ignore_conflicts=True)
+
+    roles_changed.send(sender=LocalRole,
+                       assignees=list(set(row[2:4] for row in rows)),
+                       instances=list(set(row[0:2] for row in rows)))
+
+    return len(rows) - len(existing)
+
+
+def bulk_unassign_local_roles(assignments):
+
+    """Unassign local roles in bulk. The assignments are (assignee,
+    instance, role) tuples, like for bulk_assign_local_roles. A single
+    roles_changed signal is sent. Return the number of assignments
+    removed.
+
+    """
+
+    rows = set()
+
+    for assignee, instance, role in assignments:
+        rows.add((ctcache.get_ct_id(instance),
+                  instance.id,
+                  ctcache.get_ct_id(assignee),
+                  assignee.id,
+                  get_role(role).id))
+
+    if not rows:
+        return 0
+
+    existing = _bulk_assignments(LocalRole, rows)
+
+    # roles_changed covers the signals per row
+    #
+    _bulk_delete(LocalRole, existing)
+
+    roles_changed.send(sender=LocalRole,
+                       assignees=list(set(row[2:4] for row in existing)),
+                       instances=list(set(row[0:2] for row in existing)))
+
+    return len(existing)
+
+
+def bulk_assign_global_roles(assignments, batch_size=1000):
+
+    """Assign global roles in bulk. The assignments are (assignee, role)
+    tuples, where role may be a Role or a role name. Existing
+    assignments are skipped. A single roles_changed signal is
+    sent. Return the number of assignments created.
+
+    """
+
+    rows = set((ctcache.get_ct_id(assignee),
+                assignee.id,
+                get_role(role).id)
+               for assignee, role in assignments)
+
+    if not rows:
+        return 0
+
+    existing = _bulk_assignments(GlobalRole, rows)
+
+    GlobalRole.objects.bulk_create([
+        GlobalRole(assignee_ct_id=row[0], assignee_id=row[1],
+                   role_id=row[2])
+        for row in rows if row not in existing],
+        batch_size=batch_size, ignore_conflicts=True)
+
+    roles_changed.send(sender=GlobalRole,
+                       assignees=list(set(row[0:2] for row in rows)),
+                       instances=None)
+
+    return len(rows) - len(existing)
+
+
+def bulk_unassign_global_roles(assignments):
+
+    """Unassign global roles in bulk. The assignments are (assignee,
+    role) tuples. A single roles_changed signal is sent. Return the
+    number of assignments removed.
+
+    """
+
+    rows = set((ctcache.get_ct_id(assignee),
+                assignee.id,
+                get_role(role).id)
+               for assignee, role in assignments)
+
+    if not rows:
+        return 0
+
+    existing = _bulk_assignments(GlobalRole, rows)
+
+    _bulk_delete(GlobalRole, existing)
+
+    roles_changed.send(sender=GlobalRole,
+                       assignees=list(set(row[0:2] for row in existing)),
+                       instances=None)
+
+    return len(existing)
+
 
 def get_global_roles(assignee, as_role=False):
 
@@ -127,9 +351,9 @@ def get_global_roles(assignee, as_role=False):
 
     """
 
-    assignee_ct = ContentType.objects.get_for_model(assignee)
+    assignee_ct_id = ctcache.get_ct_id(assignee)
 
-    roles = GlobalRole.objects.filter(assignee_ct=assignee_ct,
+    roles = GlobalRole.objects.filter(assignee_ct_id=assignee_ct_id,
                                       assignee_id=assignee.id)
 
     if as_role:
@@ -140,17 +364,346 @@ def get_global_roles(assignee, as_role=False):
 
 def has_global_role(assignee, role):
 
-    assignee_ct = ContentType.objects.get_for_model(assignee)
+    assignee_ct_id = ctcache.get_ct_id(assignee)
+    role_id = get_role_id(role)
 
-    if isinstance(role, Role):
-        role_name = role.name
-    else:
-        role_name = role
+    if role_id is None:
+        return False
 
     return GlobalRole.objects.filter(
-        role__name=role_name,
+        role_id=role_id,
         assignee_id=assignee.id,
-        assignee_ct=assignee_ct).exists()
+        assignee_ct_id=assignee_ct_id).exists()
+
+
+def uses_group_closure():
+
+    """ Whether the group model is a djinn_auth group, that can be nested """
+
+    return issubclass(get_group_model(), DjinnGroup)
+
+
+def get_group_permission_model():
+
+    """Return the model linking groups to their permissions. The user's
+    groups are djinn_auth groups if these are the group model, and
+    Django's groups otherwise, so their permissions are taken from the
+    same kind of group.
+
+    """
+
+    if uses_group_closure():
+        return DjinnGroup.permissions.through
+
+    return Group.permissions.through
+
+
+def has_group_permission(group_ids, perm_ids):
+
+    """ Check whether any of the groups holds any of the permissions """
+
+    return bool(group_ids) and get_group_permission_model().objects.filter(
+        group_id__in=group_ids, permission_id__in=perm_ids).exists()
+
+
+def get_user_group_subquery(user):
+
+    """Return a subquery for the ids of the user's groups. For djinn_auth
+    groups, these are the groups the user is in and all groups these
+    are nested in, from the group closure.
+
+    """
+
+    if uses_group_closure():
+        return GroupClosure.objects.filter(
+            descendant__users=user).values('ancestor_id')
+
+    return user.groups.all().values('id')
+
+
+def load_user_group_ids(user):
+
+    """ Return the ids of the user's groups from the database, in one
+    query """
+
+    if uses_group_closure():
+        return frozenset(GroupClosure.objects.filter(
+            descendant__users=user).values_list('ancestor_id', flat=True))
+
+    return frozenset(user.groups.all().values_list('id', flat=True))
+
+
+def get_user_group_ids(user):
+
+    """ Return the ids of the user's groups. The result is cached for the
+    lifetime of the user object, and in the shared cache if enabled."""
+
+    cache = get_permission_cache(user)
+
+    if cache.group_ids is None:
+        if sharedcache.is_enabled():
+            cache.group_ids = sharedcache.get_user_group_ids(
+                user, lambda: load_user_group_ids(user))
+        else:
+            cache.group_ids = load_user_group_ids(user)
+
+    return cache.group_ids
+
+
+def get_user_global_role_ids(user):
+
+    """ Return the ids of the roles the user has globally, either directly
+    or through one of the groups. The result is cached for the lifetime
+    of the user object, and in the shared cache if enabled."""
+
+    cache = get_permission_cache(user)
+
+    def load():
+        return frozenset(
+            get_user_global_roles(user).values_list('role_id', flat=True))
+
+    if cache.global_role_ids is None:
+        if sharedcache.is_enabled():
+            cache.global_role_ids = sharedcache.get_user_global_role_ids(
+                user, load)
+        else:
+            cache.global_role_ids = load()
+
+    return cache.global_role_ids
+
+
+def load_user_local_grants(user, instances):
+
+    """Load the local grants of the user on the given instances from the
+    database. The instances are given as (content type id, instance id)
+    tuples. Return a dict of such tuple to a tuple of the ids of the
+    roles and the ids of the permissions the user has on that instance,
+    either directly or through one of the groups. Local roles and local
+    permissions of all instances are fetched together, in a single
+    query.
+
+    """
+
+    instance_filter = partitions.instances_filter(instances)
+
+    user_ct_id = ctcache.get_user_ct_id()
+    group_ct_id = ctcache.get_group_ct_id()
+
+    _filter = instance_filter & (
+        Q(assignee_ct_id=user_ct_id, assignee_id=user.id) |
+        Q(assignee_ct_id=group_ct_id,
+          assignee_id__in=get_user_group_ids(user)))
+
+    roles = LocalRole.objects.filter(_filter).annotate(
+        kind=Value(ROLE, output_field=IntegerField())
+    ).values_list('instance_ct_id', 'instance_id', 'role_id', 'kind')
+
+    permissions = LocalPermission.objects.filter(_filter).annotate(
+        kind=Value(PERMISSION, output_field=IntegerField())
+    ).values_list('instance_ct_id', 'instance_id', 'permission_id', 'kind')
+
+    grants = dict((instance, (set(), set())) for instance in instances)
+
+    for ctype_id, instance_id, pk, kind in roles.union(permissions,
+                                                       all=True):
+        grants[(ctype_id, instance_id)][kind].add(pk)
+
+    return dict((instance, (frozenset(role_ids), frozenset(perm_ids)))
+                for instance, (role_ids, perm_ids) in grants.items())
+
+
+def get_user_local_grants_many(user, instances):
+
+    """Return a dict of instance key to a tuple of the ids of the roles
+    and the ids of the permissions the user has on that instance. What
+    isn't cached on the user yet is taken from the shared cache if
+    enabled, or else loaded from the database in a single query.
+
+    """
+
+    cache = get_permission_cache(user)
+
+    keys = {}
+
+    for instance in instances:
+        key = instance_key(instance)
+
+        if key not in cache.local_grants:
+            keys.setdefault(
+                (ctcache.get_ct_id(instance),
+                 instance.id), key)
+
+    if keys:
+
+        if sharedcache.is_enabled():
+            grants = sharedcache.get_user_local_grants(
+                user, list(keys),
+                lambda missing: load_user_local_grants(user, missing))
+        else:
+            grants = load_user_local_grants(user, list(keys))
+
+        for instance, instance_grants in grants.items():
+            cache.local_grants[keys[instance]] = instance_grants
+
+    return dict((instance_key(instance),
+                 cache.local_grants[instance_key(instance)])
+                for instance in instances)
+
+
+def get_user_local_grants(user, instance):
+
+    """ Return a tuple of the ids of the roles and the ids of the
+    permissions the user has on the instance. The result is cached for
+    the lifetime of the user object."""
+
+    if instance.pk is None:
+        return (frozenset(), frozenset())
+
+    return get_user_local_grants_many(user, [instance])[
+        instance_key(instance)]
+
+
+def grants_perm(grants, perm_ids, perm_role_ids):
+
+    """ Check whether the local grants, as returned by
+    get_user_local_grants, hold any of the permissions or roles """
+
+    role_ids, local_perm_ids = grants
+
+    return bool(perm_role_ids & role_ids or perm_ids & local_perm_ids)
+
+
+def get_user_local_role_ids(user, instance):
+
+    """ Return the ids of the roles the user has on the instance, either
+    directly or through one of the groups. The result is cached for the
+    lifetime of the user object."""
+
+    return get_user_local_grants(user, instance)[ROLE]
+
+
+def iter_acquire_levels(instances, max_depth=None):
+
+    """Walk up the acquire_from hierarchy of the given instances and
+    yield the instances acquired from, one list per level. Every
+    instance is yielded only once, so cycles are harmless. The depth
+    defaults to the DJINN_AUTH_ACQUIRE_MAX_DEPTH setting, or no limit
+    at all.
+
+    """
+
+    if max_depth is None:
+        max_depth = getattr(settings, 'DJINN_AUTH_ACQUIRE_MAX_DEPTH', None)
+
+    visited = set(instance_key(instance) for instance in instances)
+    level = list(instances)
+    depth = 0
+
+    while level and (max_depth is None or depth < max_depth):
+
+        parents = []
+
+        for instance in level:
+            for acq_obj in getattr(instance, "acquire_from", []):
+                if instance_key(acq_obj) not in visited:
+                    visited.add(instance_key(acq_obj))
+                    parents.append(acq_obj)
+
+        if parents:
+            yield parents
+
+        level = parents
+        depth += 1
+
+
+def get_acquire_chain(instance, max_depth=None):
+
+    """ Return all instances the instance acquires from, directly or
+    indirectly, nearest first. """
+
+    return [acq_obj for level in iter_acquire_levels([instance], max_depth)
+            for acq_obj in level]
+
+
+def get_user_direct_permission_ids(user):
+
+    """ Return the ids of the permissions given to the user directly, or
+    to one of the user's groups. The result is cached for the lifetime
+    of the user object."""
+
+    cache = get_permission_cache(user)
+
+    if cache.direct_permission_ids is None:
+        cache.direct_permission_ids = frozenset(
+            user.user_permissions.order_by().values_list(
+                'id', flat=True).union(
+                get_group_permission_model().objects.filter(
+                    group_id__in=get_user_group_ids(user)).values_list(
+                        'permission_id', flat=True)))
+
+    return cache.direct_permission_ids
+
+
+def get_user_permission_masks(user):
+
+    """Return a tuple of masks, as made by the permission index, of the
+    permissions the user has directly or through the user's groups, and
+    of the permissions the user has through global roles. The result is
+    cached for the lifetime of the user object, as long as the index
+    isn't reloaded.
+
+    """
+
+    cache = get_permission_cache(user)
+
+    permission_index.get_index()
+    version = permission_index.version
+
+    if cache.masks is None or cache.masks[0] != version:
+        cache.masks = (
+            version,
+            permission_index.get_mask(get_user_direct_permission_ids(user)),
+            permission_index.get_roles_mask(get_user_global_role_ids(user)))
+
+    return cache.masks[1:]
+
+
+def grants_mask(grants):
+
+    """ Return the mask of the permissions in the local grants, as returned
+    by get_user_local_grants """
+
+    role_ids, perm_ids = grants
+
+    return (permission_index.get_roles_mask(role_ids) |
+            permission_index.get_mask(perm_ids))
+
+
+def get_instances_filter(instances):
+
+    """ Return a filter that matches local roles or permissions on any of
+    the instances """
+
+    _filter = Q()
+
+    for instance in instances:
+        _filter |= Q(instance_ct_id=ctcache.get_ct_id(instance),
+                     instance_id=instance.id)
+
+    return _filter
+
+
+def get_user_assignee_filter(user):
+
+    """ Return a filter on role assignments that matches the user, or any
+    of the user's groups. The groups are matched using a subquery. """
+
+    user_ct_id = ctcache.get_user_ct_id()
+    group_ct_id = ctcache.get_group_ct_id()
+
+    return (Q(assignee_ct_id=user_ct_id, assignee_id=user.id) |
+            Q(assignee_ct_id=group_ct_id,
+              assignee_id__in=get_user_group_subquery(user)))
 
 
 def get_user_global_roles(user, as_role=False):
@@ -158,14 +711,14 @@ def get_user_global_roles(user, as_role=False):
     """ Get global roles for user, also taking groups into account. If as_role
     is True, return Role instances instead of GlobalRole objects."""
 
-    user_ct = ContentType.objects.get_for_model(get_user_model())
-    group_ct = ContentType.objects.get_for_model(get_group_model())
+    user_ct_id = ctcache.get_user_ct_id()
+    group_ct_id = ctcache.get_group_ct_id()
 
-    user_group_ids = user.groups.all().values_list('id', flat=True)
+    user_group_ids = get_user_group_ids(user)
 
     roles = GlobalRole.objects.filter(
-        Q(assignee_ct=user_ct, assignee_id=user.id) |
-        Q(assignee_ct=group_ct, assignee_id__in=user_group_ids)
+        Q(assignee_ct_id=user_ct_id, assignee_id=user.id) |
+        Q(assignee_ct_id=group_ct_id, assignee_id__in=user_group_ids)
     )
 
     if as_role:
@@ -179,17 +732,17 @@ def get_user_local_roles(user, instance, as_role=False):
     """ Get local roles for user, also taking groups into account. If as_role
     is True, return the Role objects instead of the LocalRole objects."""
 
-    user_ct = ContentType.objects.get_for_model(get_user_model())
-    group_ct = ContentType.objects.get_for_model(get_group_model())
-    instance_ct = ContentType.objects.get_for_model(instance)
+    user_ct_id = ctcache.get_user_ct_id()
+    group_ct_id = ctcache.get_group_ct_id()
+    instance_ct_id = ctcache.get_ct_id(instance)
 
-    user_group_ids = user.groups.all().values_list('id', flat=True)
+    user_group_ids = get_user_group_ids(user)
 
     roles = LocalRole.objects.filter(
-        Q(instance_ct=instance_ct, instance_id=instance.id,
-          assignee_ct=user_ct, assignee_id=user.id) |
-        Q(instance_ct=instance_ct, instance_id=instance.id,
-          assignee_ct=group_ct, assignee_id__in=user_group_ids)
+        Q(instance_ct_id=instance_ct_id, instance_id=instance.id,
+          assignee_ct_id=user_ct_id, assignee_id=user.id) |
+        Q(instance_ct_id=instance_ct_id, instance_id=instance.id,
+          assignee_ct_id=group_ct_id, assignee_id__in=user_group_ids)
     )
 
     if as_role:
@@ -198,20 +751,117 @@ def get_user_local_roles(user, instance, as_role=False):
     return roles
 
 
+async def aget_user_global_roles(user, as_role=False):
+
+    """Async variant of get_user_global_roles. Since querysets can't be
+    evaluated lazily in an async context, return a list.
+
+    """
+
+    return await sync_to_async(
+        lambda: list(get_user_global_roles(user, as_role=as_role)))()
+
+
+async def aget_user_local_roles(user, instance, as_role=False):
+
+    """ Async variant of get_user_local_roles, returning a list """
+
+    return await sync_to_async(
+        lambda: list(get_user_local_roles(user, instance, as_role=as_role)))()
+
+
+async def ahas_perm(user, perm, obj=None):
+
+    """Async variant of user.has_perm. On Django versions that have an
+    async user.ahas_perm, that is used, and that will call
+    AuthBackend.ahas_perm. Otherwise the check is run through
+    sync_to_async.
+
+    """
+
+    if hasattr(user, "ahas_perm"):
+        return await user.ahas_perm(perm, obj=obj)
+
+    return await sync_to_async(user.has_perm)(perm, obj=obj)
+
+
+def iter_user_local_instances(user, role=None, ct=None, resolve=False,
+                              chunk_size=2000):
+
+    """Yield (content type, instance id) tuples for all instances on which
+    the user has a local role, directly or through one of the user's
+    groups. Limit these to the given role and content type, if set; ct
+    may be a ContentType or a model. The rows are read with a server
+    side cursor, where the database supports it, so large results
+    stream in constant memory.
+
+    If resolve is True, yield (content type, instance) tuples instead,
+    fetching the instances in batches of chunk_size per content type.
+    Instances that no longer exist are skipped.
+
+    """
+
+    _filter = get_user_assignee_filter(user)
+
+    if role is not None:
+        role_id = get_role_id(role)
+
+        if role_id is None:
+            return
+
+        _filter &= Q(role_id=role_id)
+
+    if ct is not None:
+        if not isinstance(ct, ContentType):
+            ct = ContentType.objects.get_for_model(ct)
+
+        _filter &= Q(instance_ct_id=ct.id)
+
+    rows = LocalRole.objects.filter(_filter).values_list(
+        'instance_ct_id', 'instance_id').order_by(
+            'instance_ct_id', 'instance_id').distinct().iterator(
+                chunk_size=chunk_size)
+
+    if not resolve:
+        for ctype_id, instance_id in rows:
+            yield (ContentType.objects.get_for_id(ctype_id), instance_id)
+        return
+
+    def resolve_batch(ctype, instance_ids):
+        instances = ctype.model_class()._default_manager.in_bulk(instance_ids)
+
+        for instance_id in instance_ids:
+            if instance_id in instances:
+                yield (ctype, instances[instance_id])
+
+    ctype = None
+    batch = []
+
+    for ctype_id, instance_id in rows:
+        if batch and (ctype_id != ctype.id or len(batch) == chunk_size):
+            for result in resolve_batch(ctype, batch):
+                yield result
+            batch = []
+
+        ctype = ContentType.objects.get_for_id(ctype_id)
+        batch.append(instance_id)
+
+    if batch:
+        for result in resolve_batch(ctype, batch):
+            yield result
+
+
 def get_local_roles(instance, role=None):
 
     """ Return all local roles on the given instance. If role is set, return
     only local roles that have that role set."""
 
-    ctype = ContentType.objects.get_for_model(instance)
+    ctype_id = ctcache.get_ct_id(instance)
 
-    _filter = {'instance_id': instance.id, 'instance_ct': ctype}
+    _filter = {'instance_id': instance.id, 'instance_ct_id': ctype_id}
 
     if role:
-        if type(role) in [str]:
-            _filter['role__name'] = role
-        else:
-            _filter['role'] = role
+        _filter['role_id'] = get_role_id(role)
 
     return LocalRole.objects.filter(**_filter)
 
@@ -220,20 +870,19 @@ def has_local_role(assignee, instance, role):
 
     """ Check whether the assignee has the local role """
 
-    instance_ct = ContentType.objects.get_for_model(instance)
-    assignee_ct = ContentType.objects.get_for_model(assignee)
+    instance_ct_id = ctcache.get_ct_id(instance)
+    assignee_ct_id = ctcache.get_ct_id(assignee)
+    role_id = get_role_id(role)
 
-    if isinstance(role, Role):
-        role_name = role.name
-    else:
-        role_name = role
+    if role_id is None:
+        return False
 
     return LocalRole.objects.filter(
-        role__name=role_name,
+        role_id=role_id,
         assignee_id=assignee.id,
-        assignee_ct=assignee_ct,
+        assignee_ct_id=assignee_ct_id,
         instance_id=instance.id,
-        instance_ct=instance_ct).exists()
+        instance_ct_id=instance_ct_id).exists()
 
 
 def has_user_local_role(user, instance, role):
@@ -244,7 +893,310 @@ def has_user_local_role(user, instance, role):
 
     """
 
-    if type(role) in [str]:
-        role = Role.objects.get(name=role)
+    role = get_role(role)
 
     return get_user_local_roles(user, instance).filter(role=role).exists()
+
+
+def get_permission(permission):
+
+    """ Return the Permission for the given 'app_label.codename' string.
+    Permission objects are returned as is. Permissions are resolved
+    through the permission index, and cached there. """
+
+    if type(permission) in [str]:
+        permission = permission_index.get_permission(permission)
+
+    return permission
+
+
+def set_local_permission(assignee, instance, permission):
+
+    """Set the local permission. Existing local permissions on the given
+    instance with the same permission will be discarded.
+
+    """
+
+    permission = get_permission(permission)
+
+    ctype_id = ctcache.get_ct_id(instance)
+
+    LocalPermission.objects.filter(
+        permission=permission,
+        instance_id=instance.id,
+        instance_ct_id=ctype_id).delete()
+
+    LocalPermission.objects.create(instance=instance, assignee=assignee,
+                                   permission=permission)
+
+    invalidate_permission_cache(assignee)
+
+
+def assign_local_permission(assignee, instance, permission):
+
+    """Assign the local permission to the given assignee on the instance
+    if it's not already there
+
+    """
+
+    instance_ct_id = ctcache.get_ct_id(instance)
+    assignee_ct_id = ctcache.get_ct_id(assignee)
+
+    LocalPermission.objects.get_or_create(
+        instance_ct_id=instance_ct_id,
+        assignee_ct_id=assignee_ct_id,
+        instance_id=instance.id,
+        assignee_id=assignee.id,
+        permission=get_permission(permission))
+
+    invalidate_permission_cache(assignee)
+
+
+def unassign_local_permission(assignee, instance, permission):
+
+    """Unassign the local permission on the given instance for the
+    assignee"""
+
+    instance_ct_id = ctcache.get_ct_id(instance)
+    assignee_ct_id = ctcache.get_ct_id(assignee)
+
+    LocalPermission.objects.filter(
+        instance_ct_id=instance_ct_id,
+        assignee_ct_id=assignee_ct_id,
+        instance_id=instance.id,
+        assignee_id=assignee.id,
+        permission=get_permission(permission)).delete()
+
+    invalidate_permission_cache(assignee)
+
+
+def get_local_permissions(instance, permission=None):
+
+    """ Return all local permissions on the given instance. If permission
+    is set, return only local permissions for that permission."""
+
+    ctype_id = ctcache.get_ct_id(instance)
+
+    _filter = {'instance_id': instance.id, 'instance_ct_id': ctype_id}
+
+    if permission:
+        _filter['permission'] = get_permission(permission)
+
+    return LocalPermission.objects.filter(**_filter)
+
+
+def has_local_permission(assignee, instance, permission):
+
+    """ Check whether the assignee has the local permission """
+
+    instance_ct_id = ctcache.get_ct_id(instance)
+    assignee_ct_id = ctcache.get_ct_id(assignee)
+
+    return LocalPermission.objects.filter(
+        permission=get_permission(permission),
+        assignee_id=assignee.id,
+        assignee_ct_id=assignee_ct_id,
+        instance_id=instance.id,
+        instance_ct_id=instance_ct_id).exists()
+
+
+def get_user_local_permissions(user, instance, as_permission=False):
+
+    """ Get local permissions for user, also taking groups into account.
+    If as_permission is True, return the Permission objects instead of
+    the LocalPermission objects."""
+
+    user_ct_id = ctcache.get_user_ct_id()
+    group_ct_id = ctcache.get_group_ct_id()
+    instance_ct_id = ctcache.get_ct_id(instance)
+
+    user_group_ids = get_user_group_ids(user)
+
+    permissions = LocalPermission.objects.filter(
+        Q(instance_ct_id=instance_ct_id, instance_id=instance.id,
+          assignee_ct_id=user_ct_id, assignee_id=user.id) |
+        Q(instance_ct_id=instance_ct_id, instance_id=instance.id,
+          assignee_ct_id=group_ct_id, assignee_id__in=user_group_ids)
+    )
+
+    if as_permission:
+        permissions = [perm.permission for perm in permissions]
+
+    return permissions
+
+
+def has_user_local_permission(user, instance, permission):
+
+    """Check whether the user has the local permission. This is true if
+    either the user directly has the permission, or if one of the user
+    groups has it.
+
+    """
+
+    return get_user_local_permissions(user, instance).filter(
+        permission=get_permission(permission)).exists()
+
+
+def filter_by_perm(user, perm, queryset):
+
+    """Filter the queryset down to the instances the user has the
+    permission on. This is done in the database, in a single query, so
+    you can still count, slice or paginate the result.
+
+    Local roles, local permissions and global roles are taken into
+    account, the latter unless the model sets acquire_global_roles to
+    False. Since a property can't be evaluated
+    in the database, a model that implements acquire_global_roles as a
+    property doesn't acquire global roles here. Note that acquire_from
+    is not taken into account either.
+
+    """
+
+    perm_ids, perm_role_ids = permission_index.lookup(perm)
+
+    if user.is_anonymous or not perm_ids:
+        return queryset.none()
+
+    condition = Q(Exists(user.user_permissions.filter(pk__in=perm_ids)))
+    condition |= Q(Exists(get_group_permission_model().objects.filter(
+        group_id__in=get_user_group_subquery(user),
+        permission_id__in=perm_ids)))
+
+    assignee = get_user_assignee_filter(user)
+    instance_ct_id = ctcache.get_ct_id(queryset.model)
+
+    if perm_role_ids:
+
+        if getattr(queryset.model, "acquire_global_roles", True) is True:
+            condition |= Q(Exists(GlobalRole.objects.filter(
+                assignee, role__in=perm_role_ids)))
+
+        condition |= Q(pk__in=LocalRole.objects.filter(
+            assignee, instance_ct_id=instance_ct_id,
+            role__in=perm_role_ids).values('instance_id'))
+
+    condition |= Q(pk__in=LocalPermission.objects.filter(
+        assignee, instance_ct_id=instance_ct_id,
+        permission__in=perm_ids).values('instance_id'))
+
+    return queryset.filter(condition)
+
+
+class PermResult(dict):
+
+    """Dict of object to verdict, as returned by has_perm_many. Like with
+    has_perm, unsaved objects have no local roles, so only the user's
+    direct permissions, and global roles if the object acquires them,
+    count. Since model instances without a primary key can't be dict
+    keys, their lookups are answered without one.
+
+    """
+
+    def __init__(self, verdicts, unsaved=(), direct=False,
+                 global_grant=False):
+
+        dict.__init__(self, verdicts)
+
+        self.direct = direct
+        self.global_grant = global_grant
+
+        for obj in unsaved:
+            try:
+                self[obj] = self.get_unsaved(obj)
+            except TypeError:
+                pass
+
+    def get_unsaved(self, obj):
+
+        return self.direct or bool(
+            self.global_grant and getattr(obj, "acquire_global_roles", True))
+
+    def __getitem__(self, obj):
+
+        if obj.pk is None:
+            return self.get_unsaved(obj)
+
+        return dict.__getitem__(self, obj)
+
+    def get(self, obj, default=None):
+
+        if obj.pk is None:
+            return self.get_unsaved(obj)
+
+        return dict.get(self, obj, default)
+
+
+def has_perm_many(user, perm, objs):
+
+    """Check the permission for the user on all of the given objects,
+    that may be of different types. Return a PermResult, a dict of
+    object to boolean, that also holds unsaved objects. Local roles and
+    permissions are fetched in one query, including all objects the
+    objects acquire from. The verdicts are cached on the user, so
+    subsequent calls to has_perm are free.
+
+    """
+
+    objs = list(objs)
+    unsaved = [obj for obj in objs if obj.pk is None]
+    objs = [obj for obj in objs if obj.pk is not None]
+
+    if user.is_anonymous:
+        return PermResult(dict.fromkeys(objs, False), unsaved)
+
+    perm_ids, perm_role_ids = permission_index.lookup(perm)
+
+    # Direct permissions on the user or the user's groups hold for any
+    # object
+    #
+    user_group_ids = get_user_group_ids(user)
+    direct = global_grant = False
+
+    if not perm_ids:
+        result = dict.fromkeys(objs, False)
+    elif user.user_permissions.filter(pk__in=perm_ids).exists() or \
+            has_group_permission(user_group_ids, perm_ids):
+        direct = True
+        result = dict.fromkeys(objs, True)
+    else:
+        global_grant = bool(perm_role_ids & get_user_global_role_ids(user))
+
+        acquire_from = dict((obj, get_acquire_chain(obj)) for obj in objs)
+
+        local_grants = get_user_local_grants_many(
+            user, objs + [acq_obj for acq_objs in acquire_from.values()
+                          for acq_obj in acq_objs])
+
+        result = {}
+
+        for obj in objs:
+            result[obj] = bool(
+                global_grant and getattr(obj, "acquire_global_roles", True)
+            ) or any(grants_perm(local_grants[instance_key(instance)],
+                                 perm_ids, perm_role_ids)
+                     for instance in [obj] + acquire_from[obj])
+
+    verdicts = get_permission_cache(user).verdicts
+
+    for obj, verdict in result.items():
+        verdicts[verdict_key(perm, obj)] = verdict
+
+    return PermResult(result, unsaved, direct, global_grant)
+
+
+def prefetch_perms(user, perms, objs):
+
+    """Resolve the given permissions on all objects in bulk, so that
+    subsequent calls to user.has_perm, for instance from the if_has_perm
+    template tag, are served from the cache. Call this from your view
+    before rendering a list.
+
+    """
+
+    if isinstance(perms, str):
+        perms = [perms]
+
+    objs = list(objs)
+
+    for perm in perms:
+        has_perm_many(user, perm, objs)
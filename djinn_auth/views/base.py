@@ -1,4 +1,6 @@
+from asgiref.sync import sync_to_async
 from django.core.exceptions import PermissionDenied
+from djinn_auth.utils import ahas_perm
 
 
 class PermissionProtectedMixin(object):
@@ -6,7 +8,8 @@ class PermissionProtectedMixin(object):
     LET OP. PermissionProtectedMixin wordt in pgintranet (nog) niet gebruikt
 
     Mixin to protect the view with a permission. If provided,
-    the class may actually check against the type of call """
+    the class may actually check against the type of call. For async
+    views, the permission check is awaited. """
 
     permission = None
 
@@ -38,14 +41,59 @@ class PermissionProtectedMixin(object):
 
         return request.user.has_perm(permission, obj=obj)
 
+    async def aget_user(self, request):
+
+        """ Return the request's user. The user is loaded lazily, and
+        that must not happen in the event loop. """
+
+        if hasattr(request, "auser"):
+            return await request.auser()
+
+        def get_user():
+            user = request.user
+
+            # Have a lazy user load itself
+            #
+            user.pk
+
+            return user
+
+        return await sync_to_async(get_user)()
+
+    async def acheck_permission(self, request):
+
+        permission = self.get_permission(request)
+
+        if not permission:
+            return True
+
+        try:
+            obj = await sync_to_async(self.get_object)()
+        except:
+            obj = None
+
+        return await ahas_perm(await self.aget_user(request), permission,
+                               obj=obj)
+
     def handle_unauthorized(self):
 
         raise PermissionDenied('Not authorized')
 
     def dispatch(self, request, *args, **kwargs):
 
+        if getattr(self, "view_is_async", False):
+            return self.adispatch(request, *args, **kwargs)
+
         if not self.check_permission(request):
             self.handle_unauthorized()
 
         return super(PermissionProtectedMixin, self).dispatch(
             request, *args, **kwargs)
+
+    async def adispatch(self, request, *args, **kwargs):
+
+        if not await self.acheck_permission(request):
+            self.handle_unauthorized()
+
+        return await super(PermissionProtectedMixin, self).dispatch(
+            request, *args, **kwargs)